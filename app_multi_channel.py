@@ -1,26 +1,35 @@
-import sys
-import torchaudio
-
-if not hasattr(torchaudio, 'list_audio_backends'):
-    torchaudio.list_audio_backends = lambda: ['soundfile']
-
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, send_file, Response
 import os
 import json
 import uuid
 import logging
 from datetime import datetime
 from pathlib import Path
-from whisper_transcribe import transcribe_with_whisper
-from multi_channel_speaker_identification import MultiChannelFileProcessor
+from contextlib import nullcontext
+from word_index import WordIndex, iter_words, video_name_for
+from transcript_store import words_path_for
+from segment_edits import apply_operations, results_file_lock, write_results_atomic, SegmentEditError
+from tracing import prometheus_text
+from warmup import Warmup, warmup_requested
+from session_store import SessionStore, ServerSideSessionInterface, ResultsCache
+from fast_json import FastJSONProvider, EncodedResponseCache, compress_response
+from label_import import IMPORT_FORMATS, LabelImportError, import_format, import_segments
+from label_export import EXPORT_FORMATS, iter_export, iter_bulk_export, gzip_chunks, processed_results_files
+from inference_queue import InferenceQueue, QueueFull, queue_enabled, run_inference_job, patch_torchaudio
+from prefetch import (Prefetcher, prefetch_enabled, prefetched_transcript, record_transcript, segments_dir_for,
+                      build_waveform, load_waveform, WAVEFORM_FILE)
+from ingest import IngestQueue
+from speaker_library import SpeakerLibrary
 from flask import session
-import librosa
-import numpy as np
-import soundfile as sf
-from scipy import signal
+from audio_mixing import MixCache, audio_info
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+# Session state lives in data/sessions.sqlite; the cookie only carries the session id
+app.session_interface = ServerSideSessionInterface(SessionStore())
+# orjson-backed jsonify, and gzip/brotli for larger responses when the client accepts it
+app.json = FastJSONProvider(app)
+app.after_request(compress_response)
 app.config['UPLOAD_FOLDER'] = "/content/drive/MyDrive/all_videos/"
 
 # Configure logging
@@ -38,7 +47,55 @@ logger = logging.getLogger(__name__)
 # os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('data', exist_ok=True)
 
-file_processor_dict = {}
+word_index = WordIndex()
+# Transcripts from earlier runs are indexed in the background; searches never wait for it
+word_index.refresh()
+results_cache = ResultsCache()
+response_cache = EncodedResponseCache()
+# With INFERENCE_QUEUE=1 (the gunicorn profile) transcription and speaker identification
+# run in dedicated inference processes instead of the web worker handling the request
+inference_queue = InferenceQueue() if queue_enabled() else None
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 4 * 3600))
+# With PREFETCH=1 loaded videos are extracted, transcribed, embedded and given waveform
+# data in the background at low priority, so most are ready before anyone asks
+prefetcher = Prefetcher(inference_queue, enabled=prefetch_enabled())
+# Progress of the upload-folder ingest service (python ingest.py), which runs on its own
+ingest_queue = IngestQueue()
+# Speakers enrolled from labeled videos, used to pre-label new ones
+speaker_library = SpeakerLibrary()
+mix_cache = MixCache()
+
+
+def _load_whisper():
+    from whisper_transcribe import load_whisper_model
+    load_whisper_model()
+
+
+def _load_speaker_verification():
+    patch_torchaudio()
+    from speaker_identification import load_verification_model
+    load_verification_model()
+
+
+# Whisper, torch and speechbrain are imported by the endpoints that use them, so
+# the server starts without them; WARMUP=1 preloads the models once it is listening
+warmup = Warmup([("whisper", _load_whisper), ("speaker_verification", _load_speaker_verification)])
+# gunicorn.conf.py starts it in each web worker that runs inference itself
+app.extensions["warmup"] = warmup
+
+
+def run_inference(kind, payload):
+    """Run a transcription or speaker identification job and return the paths it wrote"""
+    if inference_queue is None:
+        with prefetcher.interactive():
+            return run_inference_job(kind, payload)
+    return inference_queue.wait(inference_queue.submit(kind, payload), INFERENCE_TIMEOUT)
+
+
+@app.errorhandler(QueueFull)
+def inference_queue_full(e):
+    logger.warning(f"Refused inference job: {str(e)}")
+    return jsonify({'error': 'The server is busy with other transcription or speaker identification jobs. Please try again shortly.'}), 503, {'Retry-After': '30'}
 
 
 def load_whisper_results():
@@ -47,13 +104,46 @@ def load_whisper_results():
         return None
     
     try:
-        with open(session["current_whisper_results_file"], 'r') as f:
-            return json.load(f)
+        return results_cache.load(session["current_whisper_results_file"])
     except (FileNotFoundError, json.JSONDecodeError) as e:
         logger.error(f"Failed to load whisper results from {session['current_whisper_results_file']}: {e}")
         return None
 
 
+def load_current_results():
+    """Load the results that editing endpoints work on: speaker results if present, else whisper results.
+
+    Results are shared with other requests through the results cache and must not be
+    modified in place; edits go through ``apply_operations``, which works on a copy.
+    """
+    if session.get("current_speaker_results_file"):
+        return results_cache.load(session["current_speaker_results_file"])
+    return load_whisper_results()
+
+
+def save_current_results(results):
+    """Write edited results atomically and keep them cached for the next read"""
+    results_file = current_results_file()
+    write_results_atomic(results_file, results)
+    results_cache.put(results_file, results)
+    return results_file
+
+
+def results_lock():
+    """Lock on the file edits of the current video are written to, shared by all web workers"""
+    if not session.get("current_whisper_results_file"):
+        return nullcontext()
+    results_file = session.get("current_speaker_results_file") or session["current_whisper_results_file"].replace(".json", "_speaker_results.json")
+    return results_file_lock(results_file)
+
+
+def current_results_file():
+    """Path that edited results are written to"""
+    if not session.get("current_speaker_results_file"):
+        session["current_speaker_results_file"] = session["current_whisper_results_file"].replace(".json", "_speaker_results.json")
+    return session["current_speaker_results_file"]
+
+
 @app.route('/load_video', methods=['POST'])
 def load_video():
     """Handle loading a video from local file path"""
@@ -92,6 +182,7 @@ def load_video():
     }
     session["current_video"] = current_video
     logger.info(f"Successfully loaded video: {current_video['filename']}")
+    prefetcher.submit(video_path, segments_dir_for(video_path))
     
     return jsonify({
         'success': True,
@@ -125,15 +216,9 @@ def load_audio():
         return jsonify({'error': 'Audio file not found'}), 400
     
     try:
-        # Load audio file to get channel information
-        audio_data, sample_rate = librosa.load(audio_path, sr=None, mono=False)
-        
-        # Determine number of channels
-        if audio_data.ndim == 1:
-            num_channels = 1
-            audio_data = audio_data.reshape(1, -1)  # Make it 2D for consistency
-        else:
-            num_channels = audio_data.shape[0]
+        # Read channel information from the file header instead of decoding the audio
+        num_frames, num_channels, sample_rate = audio_info(audio_path)
+        duration = num_frames / sample_rate
         
         # Store audio information
         current_audio = {
@@ -141,7 +226,7 @@ def load_audio():
             'filename': os.path.basename(audio_path),
             'sample_rate': int(sample_rate),
             'num_channels': num_channels,
-            'duration': audio_data.shape[1] / sample_rate,
+            'duration': duration,
             'audio_url': f'/serve_audio/{os.path.basename(audio_path)}',
             'channels': [f'Channel {i+1}' for i in range(num_channels)]
         }
@@ -255,6 +340,69 @@ def serve_audio(filename):
         as_attachment=False
     )
 
+@app.route('/mix_audio_channels', methods=['POST'])
+def mix_audio_channels():
+    """Mix a subset of the current audio's channels into a cached mono track"""
+    logger.info("Received request to mix audio channels")
+
+    if not session.get("current_audio") or not session["current_audio"].get('filepath'):
+        logger.error("No audio loaded for mixing")
+        return jsonify({'error': 'No audio loaded'}), 400
+
+    data = request.get_json()
+    channels = data.get('channels', [])
+    mix_type = data.get('mix_type', 'equal')
+    custom_weights = data.get('custom_weights', [])
+    logger.info(f"Mix parameters - channels: {channels}, mix_type: {mix_type}, custom_weights: {custom_weights}")
+
+    try:
+        channels = [int(c) for c in channels]
+        mix = mix_cache.start_mix(session["current_audio"]['filepath'], channels, mix_type, custom_weights)
+    except ValueError as e:
+        logger.error(f"Invalid mix request: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error mixing audio channels: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Error mixing audio channels: {str(e)}'}), 500
+
+    return jsonify({
+        'success': True,
+        'channels_used': mix.channels,
+        'mix_type': mix_type,
+        'weights': mix.weights,
+        'mixed_audio_url': f'/serve_mix/{mix.key}'
+    })
+
+@app.route('/serve_mix/<key>')
+def serve_mix(key):
+    """Serve a mixed track, streaming it with range support while it is still being rendered"""
+    logger.info(f"Request to serve mix: {key}")
+
+    mix = mix_cache.get(key)
+    if mix is None:
+        # Mixes started by another worker are streamed from its partial file
+        mix = mix_cache.partial(key)
+    if mix is None or mix.done.is_set():
+        mix_path = Path(mix_cache.path_for(key)).resolve()
+        if mix is not None and mix.error:
+            return jsonify({'error': f'Mixing failed: {mix.error}'}), 500
+        if not mix_path.exists():
+            logger.error(f"Mix not found: {key}")
+            return jsonify({'error': 'Mix not found'}), 404
+        return send_file(mix_path, mimetype='audio/wav', as_attachment=False, conditional=True)
+
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache'}
+    byte_range = request.range.range_for_length(mix.total_bytes) if request.range else None
+    if byte_range is None:
+        start, stop, status = 0, mix.total_bytes, 200
+    else:
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{mix.total_bytes}'
+    headers['Content-Length'] = str(stop - start)
+
+    return Response(mix.stream(start, stop), status=status, mimetype='audio/wav', headers=headers, direct_passthrough=True)
+
 @app.route('/whisper_transcribe', methods=['POST'])
 def whisper_transcribe():
     """Transcribe the current video using Whisper"""
@@ -268,26 +416,30 @@ def whisper_transcribe():
     logger.info(f"Starting transcription for video: {video_path}")
 
     try:
-        # Create segments directory
-        segments_dir = f'data/segments-{session["current_video"]["filepath"].split("/")[-2]}'
-        os.makedirs(segments_dir, exist_ok=True)
-        logger.info(f"Created segments directory: {segments_dir}")
-        
-        # Transcribe using Whisper
-        logger.info("Starting Whisper transcription process")
-        results, audio_path = transcribe_with_whisper(video_path, segments_dir)
-        logger.info("Whisper transcription completed successfully")
+        segments_dir = segments_dir_for(video_path)
+
+        # Transcribe using Whisper; the slim segment table and word-level columns are saved to segments_dir
+        job = prefetched_transcript(video_path, segments_dir)
+        if job:
+            logger.info(f"Using the prefetched transcript {job['whisper_results_file']}")
+        else:
+            logger.info("Starting Whisper transcription process")
+            job = run_inference('transcribe', {'media_path': video_path, 'segments_dir': segments_dir})
+            record_transcript(video_path, segments_dir, job)
+            logger.info("Whisper transcription completed successfully")
         
-        # Store the file path instead of the full results
-        whisper_results_file = f'{segments_dir}/whisper_results.json'
+        whisper_results_file = job['whisper_results_file']
+        results = results_cache.load(whisper_results_file)
         session["current_whisper_results_file"] = whisper_results_file
         session["current_speaker_results_file"] = whisper_results_file
-        json.dump(results, open(whisper_results_file, "w"))
-        session["current_video"].update({'audio_path': audio_path})
-        logger.info(f"Transcription results file path stored: {whisper_results_file}, audio path: {audio_path}")
+        word_index.index_transcript(whisper_results_file)
+        session["current_video"].update({'audio_path': job['audio_path']})
+        logger.info(f"Transcription results file path stored: {whisper_results_file}, audio path: {job['audio_path']}")
         
         return jsonify({'success': True, 'result': results})
         
+    except QueueFull:
+        raise
     except Exception as e:
         logger.error(f"Transcription failed: {str(e)}", exc_info=True)
         return jsonify({'error': f'Transcription failed: {str(e)}'}), 500
@@ -327,52 +479,330 @@ def speaker_identification():
     whisper_results_file = session["current_speaker_results_file"]
     logger.info(f"Using whisper results file: {whisper_results_file}")
 
-    new_file_processor = MultiChannelFileProcessor(session["current_audio"]["filepath"], whisper_results_file, denoise, denoise_prop, verification_threshold)
-    file_processor_dict.update({
-        session["current_audio"]["filepath"]: new_file_processor
-    })
+    speaker_results_file = whisper_results_file.replace(".json", "_speaker_results.json")
 
     logger.info("Starting speaker identification process")
-    file_processor_dict[session["current_audio"]["filepath"]].process()
+    try:
+        run_inference('speaker_identification', {
+            'pipeline': 'multi_channel',
+            'audio_path': session["current_audio"]["filepath"],
+            'whisper_results_file': whisper_results_file,
+            'speaker_results_file': speaker_results_file,
+            'denoise': denoise,
+            'denoise_prop': denoise_prop,
+            'verification_threshold': verification_threshold,
+        })
+    except QueueFull:
+        raise
+    except TimeoutError as e:
+        logger.error(f"Speaker identification timed out: {str(e)}")
+        return jsonify({'error': 'Speaker identification is taking too long. Please try again later.'}), 504
+    except Exception as e:
+        logger.error(f"Speaker identification failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Speaker identification failed: {str(e)}'}), 500
     logger.info("Speaker identification process completed")
 
-    session["current_speaker_results_file"] = whisper_results_file.replace(".json", "_speaker_results.json")
+    session["current_speaker_results_file"] = speaker_results_file
+
+    return jsonify({'success': True, 'message': 'Speaker identification completed successfully', 'results': results_cache.load(speaker_results_file)})
 
-    json.dump(file_processor_dict[session["current_audio"]["filepath"]].speaker_results, open(session["current_speaker_results_file"], "w+"))
+@app.route('/propose_speakers', methods=['POST'])
+def propose_speakers():
+    """Propose speakers for unlabeled segments by clustering their embeddings, seeded by the labeled speakers"""
+    data = request.get_json(silent=True) or {}
+    try:
+        distance_threshold = float(data.get('distance_threshold', 0.5))
+        min_cluster_size = int(data.get('min_cluster_size', 2))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid speaker proposal parameters: {data}")
+        return jsonify({'error': 'distance_threshold and min_cluster_size must be numbers'}), 400
+    if not 0.0 < distance_threshold < 2.0 or min_cluster_size < 1:
+        logger.error(f"Speaker proposal parameters out of range: {data}")
+        return jsonify({'error': 'distance_threshold must be between 0 and 2 and min_cluster_size at least 1'}), 400
+
+    if not session.get("current_video") or not session.get("current_whisper_results_file"):
+        logger.error("No transcription results available for speaker proposals")
+        return jsonify({'error': 'No transcription results available'}), 400
 
+    if not session.get("current_audio"):
+        logger.error("No audio loaded for speaker proposals")
+        return jsonify({'error': 'No audio loaded'}), 400
+    audio_path = session["current_audio"]["filepath"]
 
-    return jsonify({'success': True, 'message': 'Speaker identification completed successfully', 'results': file_processor_dict[session["current_audio"]["filepath"]].speaker_results})
+    # Cluster the segments as currently labeled, including edits made since the last identification run
+    results_file = session.get("current_speaker_results_file")
+    if not results_file or not os.path.exists(results_file):
+        results_file = session["current_whisper_results_file"]
+    proposals_file = os.path.join(os.path.dirname(results_file), "speaker_proposals.json")
+
+    logger.info(f"Proposing speakers for {results_file} with distance threshold {distance_threshold}")
+    try:
+        run_inference('propose_speakers', {
+            'audio_path': audio_path,
+            'results_file': results_file,
+            'proposals_file': proposals_file,
+            'distance_threshold': distance_threshold,
+            'min_cluster_size': min_cluster_size,
+        })
+        with open(proposals_file) as f:
+            proposals = json.load(f)
+    except QueueFull:
+        raise
+    except TimeoutError as e:
+        logger.error(f"Speaker proposals timed out: {str(e)}")
+        return jsonify({'error': 'Proposing speakers is taking too long. Please try again later.'}), 504
+    except Exception as e:
+        logger.error(f"Speaker proposals failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Proposing speakers failed: {str(e)}'}), 500
+    logger.info(f"Proposed {len(proposals['clusters'])} new speaker clusters and matches for {len(proposals['known'])} labeled speakers")
+    return jsonify(proposals)
+
+@app.route('/speaker_library')
+def get_speaker_library():
+    """List the speakers enrolled in the cross-video speaker library"""
+    try:
+        return jsonify(speaker_library.speakers())
+    except Exception as e:
+        logger.error(f"Failed to read speaker library: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to read speaker library: {str(e)}'}), 500
+
+@app.route('/enroll_speakers', methods=['POST'])
+def enroll_speakers():
+    """Add the labeled segments of the current video to the speaker library"""
+    if not session.get("current_video") or not session.get("current_whisper_results_file"):
+        logger.error("No transcription results available for enrollment")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+    if not session.get("current_audio"):
+        logger.error("No audio loaded for the speaker library")
+        return jsonify({'error': 'No audio loaded'}), 400
+    audio_path = session["current_audio"]["filepath"]
+
+    results_file = session.get("current_speaker_results_file")
+    if not results_file or not os.path.exists(results_file):
+        results_file = session["current_whisper_results_file"]
+
+    logger.info(f"Enrolling the labeled speakers of {results_file}")
+    try:
+        result = run_inference('enroll_speakers', {'audio_path': audio_path, 'results_file': results_file})
+    except QueueFull:
+        raise
+    except TimeoutError as e:
+        logger.error(f"Speaker enrollment timed out: {str(e)}")
+        return jsonify({'error': 'Enrollment is taking too long. Please try again later.'}), 504
+    except Exception as e:
+        logger.error(f"Speaker enrollment failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Enrollment failed: {str(e)}'}), 500
+    if not result['enrolled']:
+        return jsonify({'error': 'No labeled segments of at least one second to enroll'}), 400
+    return jsonify({'success': True, 'enrolled': result['enrolled'], 'speakers': speaker_library.speakers()})
+
+@app.route('/prelabel_speakers', methods=['POST'])
+def prelabel_speakers():
+    """Label the unlabeled segments of the current video that clearly match a library speaker"""
+    data = request.get_json(silent=True) or {}
+    try:
+        threshold = float(data.get('threshold', 0.5))
+    except (TypeError, ValueError):
+        logger.error(f"Invalid pre-label threshold: {data.get('threshold')}")
+        return jsonify({'error': 'threshold must be a number'}), 400
+
+    if not session.get("current_video") or not session.get("current_whisper_results_file"):
+        logger.error("No transcription results available for pre-labeling")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+    if not session.get("current_audio"):
+        logger.error("No audio loaded for the speaker library")
+        return jsonify({'error': 'No audio loaded'}), 400
+    audio_path = session["current_audio"]["filepath"]
+
+    results_file = session.get("current_speaker_results_file")
+    if not results_file or not os.path.exists(results_file):
+        results_file = session["current_whisper_results_file"]
+
+    logger.info(f"Pre-labeling {results_file} from the speaker library with threshold {threshold}")
+    try:
+        job = run_inference('prelabel_speakers', {
+            'audio_path': audio_path,
+            'results_file': results_file,
+            'threshold': threshold,
+        })
+    except QueueFull:
+        raise
+    except TimeoutError as e:
+        logger.error(f"Pre-labeling timed out: {str(e)}")
+        return jsonify({'error': 'Pre-labeling is taking too long. Please try again later.'}), 504
+    except Exception as e:
+        logger.error(f"Pre-labeling failed: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Pre-labeling failed: {str(e)}'}), 500
+
+    # Applied like a batch edit: under the same lock, with a version bump, and only to
+    # segments that are still there and still unlabeled after the embeddings were computed
+    with results_lock():
+        try:
+            results = load_current_results()
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to load results for pre-labeling: {e}")
+            results = None
+        if not results:
+            logger.error("No transcription results available for pre-labeling")
+            return jsonify({'error': 'No transcription results available'}), 400
+        unlabeled = {segment.get('id') for segment in results.get('segments', []) if not segment.get('speaker')}
+        operations = [op for op in job['operations'] if op['segment_id'] in unlabeled]
+        if operations:
+            results = apply_operations(results, operations)
+            save_current_results(results)
+    logger.info(f"Pre-labeled {len(operations)} segments from the speaker library")
+    return jsonify({'success': True, 'message': f'Pre-labeled {len(operations)} segments from the speaker library',
+                    'labeled': len(operations), 'results': results})
 
 @app.route('/get_segments')
 def get_segments():
-    """Get all current segments"""
+    """Get all current segments with the version of the results they come from"""
     logger.info("Request to get segments")
     
     # If there is a speaker results file, load it
     if session.get("current_speaker_results_file") and session.get("current_speaker_results_file") == session["current_whisper_results_file"].replace(".json", "_speaker_results.json"):
-        whisper_results = json.load(open(session["current_speaker_results_file"], "r"))
+        results_file = session["current_speaker_results_file"]
     else:
-        whisper_results = load_whisper_results()
-    if not whisper_results:
+        results_file = session.get("current_whisper_results_file")
+    try:
+        version = results_cache.signature(results_file) if results_file else None
+    except OSError:
+        version = None
+    if version is None:
         logger.error("No transcription results available")
         return jsonify({'error': 'No transcription results available'}), 400
     
-    # Extract segments from whisper results
-    segments = []
-    if 'segments' in whisper_results:
-        for segment in whisper_results['segments']:
-            curr_text = segment.get('text', '')
-            if len(curr_text) and len(curr_text.replace(".", "")):
-                segments.append({
-                    'id': segment.get('id', 0),
-                    'start': segment.get('start', 0.0),
-                    'end': segment.get('end', 0.0),
-                    'text': segment.get('text', ''),
-                    'speaker': segment.get('speaker', '')
-                })
-    
-    logger.info(f"Returning {len(segments)} segments")
-    return jsonify(segments)
+    def build():
+        # Extract segments from whisper results
+        whisper_results = results_cache.load(results_file)
+        segments = []
+        if 'segments' in whisper_results:
+            for segment in whisper_results['segments']:
+                curr_text = segment.get('text', '')
+                # Empty or dots-only Whisper segments are hidden, but labeled ones stay: RTTM and
+                # text-less CSV imports carry speakers and times only
+                if segment.get('speaker') or (len(curr_text) and len(curr_text.replace(".", ""))):
+                    segments.append({
+                        'id': segment.get('id', 0),
+                        'start': segment.get('start', 0.0),
+                        'end': segment.get('end', 0.0),
+                        'text': segment.get('text', ''),
+                        'speaker': segment.get('speaker', '')
+                    })
+        logger.info(f"Serialized {len(segments)} segments")
+        # Batch edits send the version back as base_version, so concurrent edits are detected
+        return {'version': whisper_results.get('version', 0), 'segments': segments}
+    
+    # Results that did not change since the last request are served from the encoded response cache
+    try:
+        return response_cache.response(app, ('segments', os.path.abspath(results_file), version), build)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to load results from {results_file}: {e}")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+@app.route('/get_words')
+def get_words():
+    """Get word-level timestamps of the current transcript for click-to-word seeking"""
+    logger.info("Request to get words")
+
+    if not session.get("current_whisper_results_file"):
+        logger.error("No transcription results available")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+    # The words come from the results file and its word table, so both make up the version
+    results_file = session["current_whisper_results_file"]
+    words_file = words_path_for(results_file)
+    try:
+        version = (results_cache.signature(results_file),
+                   results_cache.signature(words_file) if os.path.exists(words_file) else None)
+    except OSError as e:
+        logger.error(f"Failed to load words: {e}")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+    def build():
+        words = {'segment_id': [], 'start': [], 'end': [], 'word': []}
+        for segment_id, start, end, word in iter_words(results_file):
+            words['segment_id'].append(segment_id)
+            words['start'].append(round(start, 3))
+            words['end'].append(round(end, 3))
+            words['word'].append(word)
+        logger.info(f"Serialized {len(words['word'])} words")
+        return words
+
+    try:
+        return response_cache.response(app, ('words', os.path.abspath(results_file), version), build)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to load words: {e}")
+        return jsonify({'error': 'No transcription results available'}), 400
+
+@app.route('/get_waveform')
+def get_waveform():
+    """Get the min/max waveform envelope of the current video's audio, built by the prefetcher or on first request"""
+    if not session.get("current_video"):
+        logger.error("No video loaded for waveform")
+        return jsonify({'error': 'No video loaded'}), 400
+
+    video_path = session["current_video"]['filepath']
+    audio_path = session["current_video"].get('audio_path') or os.path.splitext(video_path)[0] + ".wav"
+    if not os.path.exists(audio_path):
+        logger.error(f"No extracted audio for waveform: {audio_path}")
+        return jsonify({'error': 'Audio has not been extracted yet'}), 404
+
+    segments_dir = segments_dir_for(video_path)
+    try:
+        os.makedirs(segments_dir, exist_ok=True)
+        waveform_file = build_waveform(audio_path, os.path.join(segments_dir, WAVEFORM_FILE))
+        version = results_cache.signature(waveform_file)
+    except Exception as e:
+        logger.error(f"Failed to build waveform for {audio_path}: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to build waveform: {str(e)}'}), 500
+
+    return response_cache.response(app, ('waveform', os.path.abspath(waveform_file), version),
+                                   lambda: load_waveform(waveform_file))
+
+@app.route('/search_words')
+def search_words():
+    """Search word-level timestamps across all processed transcripts"""
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 100, type=int)
+    video = request.args.get('video') or None
+    logger.info(f"Request to search words: {query}")
+
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+
+    word_index.refresh()
+    matches = word_index.search(query, limit=limit, video=video)
+    current_file = os.path.abspath(session["current_whisper_results_file"]) if session.get("current_whisper_results_file") else None
+    for match in matches:
+        match['current'] = match['results_file'] == current_file
+
+    logger.info(f"Found {len(matches)} matches for: {query}")
+    return jsonify(matches)
+
+def apply_segment_edit(operation, description):
+    """Apply one edit like a batch of one: under the results lock, with a version bump.
+
+    Returns an error response, or None once the edit is saved.
+    """
+    with results_lock():
+        whisper_results = load_current_results()
+        if not whisper_results:
+            logger.error(f"No transcription results available for {description}")
+            return jsonify({'error': 'No transcription results available'}), 400
+        if not any(segment.get('id') == operation['segment_id'] for segment in whisper_results.get('segments', [])):
+            logger.warning(f"Segment {operation['segment_id']} not found")
+            return jsonify({'error': 'Segment not found'}), 404
+        try:
+            whisper_results = apply_operations(whisper_results, [operation])
+        except SegmentEditError as e:
+            logger.error(f"Rejected {description}: {str(e)}")
+            return jsonify({'error': str(e)}), 400
+        whisper_results_file = save_current_results(whisper_results)
+    logger.info(f"Saved version {whisper_results['version']} to: {whisper_results_file}")
+    return None
 
 @app.route('/update_segment_speaker', methods=['POST'])
 def update_segment_speaker():
@@ -387,30 +817,11 @@ def update_segment_speaker():
         logger.error("Missing segment_id or speaker in request")
         return jsonify({'error': 'Missing segment_id or speaker'}), 400
     
-    if session.get("current_speaker_results_file"):
-        whisper_results = json.load(open(session["current_speaker_results_file"], "r"))
-    else:
-        whisper_results = load_whisper_results()
-    if not whisper_results:
-        logger.error("No transcription results available for speaker update")
-        return jsonify({'error': 'No transcription results available'}), 400
-    
-    # Update the speaker for the segment
-    if 'segments' in whisper_results:
-        for segment in whisper_results['segments']:
-            if segment.get('id') == segment_id:
-                segment['speaker'] = speaker
-                logger.info(f"Updated segment {segment_id} speaker to: {speaker}")
-                break
-    
-    # Save the updated results back to file
-    if not session.get("current_speaker_results_file"):
-        session["current_speaker_results_file"] = session["current_whisper_results_file"].replace(".json", "_speaker_results.json")
-    whisper_results_file = session["current_speaker_results_file"]
-    with open(whisper_results_file, "w") as f:
-        json.dump(whisper_results, f)
-    logger.info(f"Saved updated results to: {whisper_results_file}")
-    
+    error = apply_segment_edit({'op': 'assign', 'segment_id': segment_id, 'speaker': speaker}, "speaker update")
+    if error:
+        return error
+    logger.info(f"Updated segment {segment_id} speaker to: {speaker}")
+
     return jsonify({'success': True, 'message': 'Speaker updated successfully'})
 
 @app.route('/delete_segment', methods=['POST'])
@@ -425,79 +836,102 @@ def delete_segment():
         logger.error("Missing segment_id in request")
         return jsonify({'error': 'Missing segment_id'}), 400
 
-    if session.get("current_speaker_results_file"):
-        whisper_results = json.load(open(session["current_speaker_results_file"], "r"))
-    else:
-        whisper_results = load_whisper_results()
-    if not whisper_results:
-        logger.error("No transcription results available for segment deletion")
-        return jsonify({'error': 'No transcription results available'}), 400
-
-    # Delete the segment
-    if 'segments' in whisper_results:
-        original_count = len(whisper_results['segments'])
-        whisper_results['segments'] = [s for s in whisper_results['segments'] if s.get('id') != segment_id]
+    # Ids of the other segments stay as they are, like a batch delete
+    error = apply_segment_edit({'op': 'delete', 'segment_id': segment_id}, "segment deletion")
+    if error:
+        return error
+    logger.info(f"Deleted segment {segment_id}")
 
-        if len(whisper_results['segments']) < original_count:
-            logger.info(f"Deleted segment {segment_id}")
-
-            # Re-index segments to maintain sequential IDs
-            for i, segment in enumerate(whisper_results['segments']):
-                segment['id'] = i
-        else:
-            logger.warning(f"Segment {segment_id} not found")
-            return jsonify({'error': 'Segment not found'}), 404
+    return jsonify({'success': True, 'message': 'Segment deleted successfully'})
 
-    # Save the updated results back to file
-    if not session.get("current_speaker_results_file"):
-        session["current_speaker_results_file"] = session["current_whisper_results_file"].replace(".json", "_speaker_results.json")
-    whisper_results_file = session["current_speaker_results_file"]
-    with open(whisper_results_file, "w") as f:
-        json.dump(whisper_results, f)
-    logger.info(f"Saved updated results to: {whisper_results_file}")
+@app.route('/batch_edit_segments', methods=['POST'])
+def batch_edit_segments():
+    """Apply a batch of segment edits (assign, edit_text, delete, merge, split) in one atomic write"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        logger.error("Batch edit request is not a JSON object")
+        return jsonify({'error': 'Expected a JSON object with operations'}), 400
+    operations = data.get('operations')
+    base_version = data.get('base_version')
+
+    logger.info(f"Request to apply {len(operations) if isinstance(operations, list) else 0} segment edits")
+
+    if not isinstance(operations, list) or not operations:
+        logger.error("Missing operations in request")
+        return jsonify({'error': 'Missing operations'}), 400
+
+    with results_lock():
+        whisper_results = load_current_results()
+        if not whisper_results:
+            logger.error("No transcription results available for batch edit")
+            return jsonify({'error': 'No transcription results available'}), 400
+
+        current_version = whisper_results.get('version', 0)
+        if base_version is not None and base_version != current_version:
+            logger.warning(f"Batch edit based on version {base_version}, current version is {current_version}")
+            return jsonify({'error': 'Segments were modified since they were loaded', 'version': current_version}), 409
+
+        try:
+            whisper_results = apply_operations(whisper_results, operations)
+        except SegmentEditError as e:
+            logger.error(f"Rejected batch edit: {str(e)}")
+            return jsonify({'error': str(e), 'operation': e.operation, 'version': current_version}), 400
+
+        whisper_results_file = save_current_results(whisper_results)
+    logger.info(f"Applied {len(operations)} edits, saved version {whisper_results['version']} to: {whisper_results_file}")
+
+    return jsonify({'success': True, 'version': whisper_results['version'], 'applied': len(operations)})
+
+def export_response(chunks, fmt, download_name, compress=False):
+    """Stream an export; downloads other than plain JSON are sent as attachments"""
+    extension, mimetype = EXPORT_FORMATS[fmt]
+    headers = {}
+    if compress:
+        chunks = gzip_chunks(chunks)
+        extension, mimetype = f'{extension}.gz', 'application/gzip'
+    if compress or fmt != 'json':
+        headers['Content-Disposition'] = f'attachment; filename="{download_name}.{extension}"'
+    return Response(chunks, mimetype=mimetype, headers=headers)
 
-    return jsonify({'success': True, 'message': 'Segment deleted successfully'})
 
 @app.route('/export_labels')
 def export_labels():
-    """Export labels in the required format for evaluation"""
-    logger.info("Request to export labels")
+    """Export labels in start-time order as JSON (default), JSONL, CSV, RTTM, SRT or WebVTT; gzip=1 compresses the download"""
+    fmt = request.args.get('format', 'json').lower()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true')
+    logger.info(f"Request to export labels as {fmt}")
+
+    if fmt not in EXPORT_FORMATS:
+        logger.error(f"Unknown export format: {fmt}")
+        return jsonify({'error': f'Unknown export format, expected one of {", ".join(EXPORT_FORMATS)}'}), 400
     
-    if session.get("current_speaker_results_file"):
-        whisper_results = json.load(open(session["current_speaker_results_file"], "r"))
-    else:
-        whisper_results = load_whisper_results()
+    whisper_results = load_current_results()
     if not whisper_results or 'segments' not in whisper_results:
         logger.error("No segments available for export")
         return jsonify({'error': 'No segments to export'}), 400
     
-    # Sort segments by start time
-    sorted_segments = sorted(whisper_results['segments'], key=lambda x: x.get('start', 0))
-    
-    export_data = []
-    for segment in sorted_segments:
-        if segment.get('speaker'):  # Only export labeled segments
-            export_data.append({
-                'speaker': segment['speaker'],
-                'start': segment['start'],
-                'end': segment['end'],
-                'text': segment.get('text', '')
-            })
-        else:
-            export_data.append({
-                'speaker': '',
-                'start': segment['start'],
-                'end': segment['end'],
-                'text': segment.get('text', '')
-            })
-    
-    logger.info(f"Exported {len(export_data)} labeled segments")
-    return jsonify(export_data)
+    recording_id = video_name_for(current_results_file())
+    logger.info(f"Exporting {len(whisper_results['segments'])} segments of {recording_id}")
+    return export_response(iter_export(whisper_results['segments'], fmt, recording_id), fmt, 'speaker_labels', compress)
+
+
+@app.route('/export_all_labels')
+def export_all_labels():
+    """Export the labels of every processed video as one zip archive, streamed video by video"""
+    fmt = request.args.get('format', 'json').lower()
+    logger.info(f"Request to export all labels as {fmt}")
+
+    if fmt not in EXPORT_FORMATS:
+        logger.error(f"Unknown export format: {fmt}")
+        return jsonify({'error': f'Unknown export format, expected one of {", ".join(EXPORT_FORMATS)}'}), 400
+
+    return Response(iter_bulk_export(processed_results_files(), fmt), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="speaker_labels_{fmt}.zip"'})
 
 
 @app.route('/upload_segments', methods=['POST'])
 def upload_segments():
-    """Upload and process a segments file"""
+    """Upload a segments file (JSON array, JSONL, CSV or RTTM), validated and stored in one streaming pass"""
     logger.info("Received request to upload segments file")
     
     if 'file' not in request.files:
@@ -509,85 +943,72 @@ def upload_segments():
         logger.error("No file selected")
         return jsonify({'error': 'No file selected'}), 400
     
-    if not file.filename.lower().endswith('.json'):
+    fmt = import_format(file.filename)
+    if fmt is None:
         logger.error(f"Invalid file type: {file.filename}")
-        return jsonify({'error': 'File must be a JSON file'}), 400
+        return jsonify({'error': f'File must be one of: {", ".join("." + f for f in IMPORT_FORMATS)}'}), 400
     
     try:
-        # Read and parse the uploaded file
-        file_content = file.read().decode('utf-8')
-        segments_data = json.loads(file_content)
-        logger.info(f"Successfully parsed uploaded segments file: {file.filename}")
-        
-        # Validate the structure of the segments data
-        if not isinstance(segments_data, list):
-            logger.error("Invalid segments file format: expected array of segments")
-            return jsonify({'error': 'Invalid file format: expected array of segments'}), 400
-        
-        # Validate each segment has required fields
-        required_fields = ['speaker', 'start', 'end', 'text']
-        for i, segment in enumerate(segments_data):
-            if not isinstance(segment, dict):
-                logger.error(f"Invalid segment format at index {i}: expected object")
-                return jsonify({'error': f'Invalid segment format at index {i}: expected object'}), 400
-            
-            for field in required_fields:
-                if field not in segment:
-                    logger.error(f"Missing required field '{field}' in segment at index {i}")
-                    return jsonify({'error': f'Missing required field "{field}" in segment at index {i}'}), 400
-        
         # Create a segments directory for the uploaded data
         segments_dir = f'data/uploaded-segments-{datetime.now().strftime("%Y%m%d_%H%M%S")}'
         os.makedirs(segments_dir, exist_ok=True)
         logger.info(f"Created segments directory: {segments_dir}")
         
-        # Convert uploaded segments to whisper results format
-        whisper_results = {
-            'segments': []
-        }
-        
-        for i, segment in enumerate(segments_data):
-            whisper_segment = {
-                'id': i,
-                'start': float(segment['start']),
-                'end': float(segment['end']),
-                'text': segment['text'],
-                'speaker': segment['speaker']
-            }
-            whisper_results['segments'].append(whisper_segment)
-        
-        # Save the processed segments to file
+        # Segments are converted to the whisper results format as they are read and validated
         whisper_results_file = f'{segments_dir}/whisper_results.json'
-        with open(whisper_results_file, 'w') as f:
-            json.dump(whisper_results, f, indent=2)
+        segments_count = import_segments(file.stream, fmt, whisper_results_file)
         
-        # Store the file path in session
+        # Edits are written back to the same file, as after a transcription
         session["current_whisper_results_file"] = whisper_results_file
-        session["current_speaker_results_file"] = whisper_results_file.replace(".json", "_speaker_results.json")
-        
-        # Also save as speaker results for consistency
-        with open(session["current_speaker_results_file"], 'w') as f:
-            json.dump(whisper_results, f, indent=2)
+        session["current_speaker_results_file"] = whisper_results_file
         
-        logger.info(f"Successfully processed {len(segments_data)} segments from uploaded file")
+        logger.info(f"Successfully processed {segments_count} segments from uploaded {fmt} file")
         logger.info(f"Segments saved to: {whisper_results_file}")
         
         return jsonify({
             'success': True,
-            'message': f'Successfully uploaded and processed {len(segments_data)} segments',
-            'segments_count': len(segments_data),
+            'message': f'Successfully uploaded and processed {segments_count} segments',
+            'segments_count': segments_count,
             'file_path': whisper_results_file
         })
         
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in uploaded file: {str(e)}")
-        return jsonify({'error': f'Invalid JSON file: {str(e)}'}), 400
+    except LabelImportError as e:
+        logger.error(f"Invalid segments file {file.filename}: {str(e)}")
+        if not os.listdir(segments_dir):
+            os.rmdir(segments_dir)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error processing uploaded segments file: {str(e)}", exc_info=True)
         return jsonify({'error': f'Error processing file: {str(e)}'}), 500
 
 
+@app.route('/ingest_status')
+def ingest_status():
+    """Report the upload-folder watcher and the files queued or processed by the ingest service"""
+    limit = request.args.get('limit', 50, type=int)
+    try:
+        return jsonify(ingest_queue.status(limit=max(1, min(limit, 1000))))
+    except Exception as e:
+        logger.error(f"Failed to read ingest status: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to read ingest status: {str(e)}'}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Pipeline span statistics in Prometheus text format (populated when TRACING=1)"""
+    return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/ready')
+def ready():
+    """Readiness of this worker: 503 while the background warm-up is still loading models"""
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
 if __name__ == '__main__':
     logger.info("Starting Flask application")
     logger.info("Application will run on host=0.0.0.0, port=8000")
+    # With the debug reloader, only the child process that serves requests warms up
+    if warmup_requested() and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
     app.run(debug=True, host='0.0.0.0', port=8000)
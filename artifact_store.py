@@ -0,0 +1,87 @@
+import os
+import json
+import logging
+import tempfile
+from datetime import datetime
+from content_hash import hash_file, hash_params
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+class ArtifactStore:
+    """Content-addressed store for pipeline stage outputs.
+
+    Each stage run lives in ``<root>/<stage>/<key>/`` where the key is derived from the
+    content hashes of the stage inputs plus the stage parameters. A ``manifest.json`` next
+    to the outputs records the inputs, parameters, parent stages and output hashes, so a
+    stage is reused exactly when everything it depends on is unchanged, regardless of the
+    file names the inputs arrived under.
+    """
+
+    def __init__(self, root: str = "data/artifacts"):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, stage: str, inputs: dict, params: dict) -> str:
+        return hash_params(stage, inputs, params)
+
+    def stage_dir(self, stage: str, key: str) -> str:
+        return os.path.join(self.root, stage, key)
+
+    def output_path(self, stage: str, key: str, filename: str) -> str:
+        stage_dir = self.stage_dir(stage, key)
+        os.makedirs(stage_dir, exist_ok=True)
+        return os.path.join(stage_dir, filename)
+
+    def lookup(self, stage: str, key: str):
+        """Return the manifest of a completed stage run, or None if it has to be (re)computed"""
+        manifest_path = os.path.join(self.stage_dir(stage, key), MANIFEST_NAME)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        for output in manifest["outputs"].values():
+            if not os.path.exists(os.path.join(self.stage_dir(stage, key), output["file"])):
+                logger.warning(f"Artifact {stage}/{key} is missing {output['file']}, recomputing")
+                return None
+        return manifest
+
+    def commit(self, stage: str, key: str, inputs: dict, params: dict, outputs: dict, parents=None) -> dict:
+        """Record a finished stage run; ``outputs`` maps output names to files in the stage directory"""
+        stage_dir = self.stage_dir(stage, key)
+        manifest = {
+            "stage": stage,
+            "key": key,
+            "inputs": inputs,
+            "params": params,
+            "parents": parents or [],
+            "outputs": {
+                name: {"file": filename, "sha1": hash_file(os.path.join(stage_dir, filename))}
+                for name, filename in outputs.items()
+            },
+            "created_at": datetime.now().isoformat(),
+        }
+        # Write the manifest last and atomically: its presence marks the stage as complete
+        fd, tmp_path = tempfile.mkstemp(dir=stage_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(stage_dir, MANIFEST_NAME))
+        logger.info(f"Stored artifact {stage}/{key}")
+        return manifest
+
+    def path(self, manifest: dict, name: str) -> str:
+        return os.path.join(self.stage_dir(manifest["stage"], manifest["key"]), manifest["outputs"][name]["file"])
+
+    def output_hash(self, manifest: dict, name: str) -> str:
+        return manifest["outputs"][name]["sha1"]
+
+    def load_json(self, manifest: dict, name: str):
+        with open(self.path(manifest, name)) as f:
+            return json.load(f)
+
+    def save_json(self, stage: str, key: str, filename: str, data):
+        with open(self.output_path(stage, key, filename), "w") as f:
+            json.dump(data, f)
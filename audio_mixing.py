@@ -0,0 +1,445 @@
+import os
+import json
+import fcntl
+import struct
+import threading
+import time
+import logging
+import numpy as np
+import soundfile as sf
+from artifact_store import ArtifactStore
+from content_hash import hash_file, hash_params
+
+logger = logging.getLogger(__name__)
+
+MIX_TYPES = ("equal", "custom", "auto_gain")
+BLOCK_FRAMES = 1 << 16
+WAV_HEADER_BYTES = 44
+OUTPUT_SAMPLE_WIDTH = 2  # mixes are written as mono 16-bit PCM
+# How often a mix rendered by another worker is checked for new bytes
+FOLLOW_INTERVAL = 0.05
+
+# WAVE_FORMAT_PCM / WAVE_FORMAT_IEEE_FLOAT sample layouts that can be mapped without decoding
+_MAPPABLE_FORMATS = {
+    (1, 16): ("<i2", float(1 << 15)),
+    (1, 32): ("<i4", float(1 << 31)),
+    (3, 32): ("<f4", 1.0),
+    (3, 64): ("<f8", 1.0),
+}
+
+
+def open_wav_memmap(file_path: str):
+    """Memory-map the sample data of a WAV file.
+
+    Returns (samples[frames, channels], sample_rate, scale) or None when the file is not a
+    plain RIFF/WAVE file with a mappable sample format (e.g. 24-bit PCM or compressed audio).
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt_chunk = f.read(chunk_size)
+                audio_format, num_channels, sample_rate = struct.unpack("<HHI", fmt_chunk[:8])
+                bits_per_sample = struct.unpack("<H", fmt_chunk[14:16])[0]
+                if audio_format == 0xFFFE and len(fmt_chunk) >= 26:
+                    # WAVE_FORMAT_EXTENSIBLE stores the real format in the sub-format GUID
+                    audio_format = struct.unpack("<H", fmt_chunk[24:26])[0]
+                fmt = (audio_format, num_channels, sample_rate, bits_per_sample)
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    return None
+                data_offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+    audio_format, num_channels, sample_rate, bits_per_sample = fmt
+    layout = _MAPPABLE_FORMATS.get((audio_format, bits_per_sample))
+    if layout is None or num_channels == 0:
+        return None
+    dtype, scale = layout
+    frame_bytes = num_channels * bits_per_sample // 8
+    # Streaming writers often leave the data size unset, so trust the file size instead
+    data_bytes = min(chunk_size, file_size - data_offset)
+    num_frames = data_bytes // frame_bytes
+    if num_frames == 0:
+        return None
+    samples = np.memmap(file_path, dtype=dtype, mode="r", offset=data_offset, shape=(num_frames, num_channels))
+    return samples, sample_rate, scale
+
+
+def audio_info(file_path: str):
+    """Return (num_frames, num_channels, sample_rate) without decoding the file"""
+    mapped = open_wav_memmap(file_path)
+    if mapped is not None:
+        samples, sample_rate, _ = mapped
+        return samples.shape[0], samples.shape[1], sample_rate
+    info = sf.info(file_path)
+    return info.frames, info.channels, info.samplerate
+
+
+def iter_audio_blocks(file_path: str, channels, block_frames: int = BLOCK_FRAMES):
+    """Yield float32 blocks of shape (frames, len(channels)) without decoding the whole file"""
+    mapped = open_wav_memmap(file_path)
+    if mapped is not None:
+        samples, _, scale = mapped
+        for start in range(0, samples.shape[0], block_frames):
+            block = np.asarray(samples[start:start + block_frames, channels], dtype=np.float32)
+            if scale != 1.0:
+                block /= scale
+            yield block
+    else:
+        for block in sf.blocks(file_path, blocksize=block_frames, dtype="float32", always_2d=True):
+            yield block[:, channels]
+
+
+def compute_mix_weights(file_path: str, channels, mix_type: str, custom_weights=None,
+                        target_rms: float = 0.1):
+    """Return the per-channel gains for a mix of the selected channels"""
+    if mix_type == "equal":
+        return [1.0 / len(channels)] * len(channels)
+
+    if mix_type == "custom":
+        if not custom_weights or len(custom_weights) != len(channels):
+            raise ValueError("custom_weights must provide one weight per selected channel")
+        weights = np.asarray(custom_weights, dtype=np.float64)
+        if np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError("custom_weights must be non-negative and not all zero")
+        return (weights / weights.sum()).tolist()
+
+    if mix_type == "auto_gain":
+        # One streaming pass for per-channel energy and peak, never holding the full signal
+        sum_squares = np.zeros(len(channels), dtype=np.float64)
+        peaks = np.zeros(len(channels), dtype=np.float64)
+        num_frames = 0
+        for block in iter_audio_blocks(file_path, channels):
+            sum_squares += np.square(block, dtype=np.float64).sum(axis=0)
+            peaks = np.maximum(peaks, np.abs(block).max(axis=0))
+            num_frames += block.shape[0]
+        rms = np.sqrt(sum_squares / max(num_frames, 1))
+        gains = np.where(rms > 0, target_rms / np.maximum(rms, 1e-12), 0.0)
+        # Cap each channel so its contribution can never exceed 1/N of full scale
+        gains = np.minimum(gains, np.where(peaks > 0, 1.0 / np.maximum(peaks, 1e-12), 0.0))
+        return (gains / len(channels)).tolist()
+
+    raise ValueError(f"Unknown mix_type: {mix_type}")
+
+
+def iter_frames(file_path: str, frame_length: int):
+    """Yield float32 arrays of shape (frames, frame_length, channels) covering the file in order.
+
+    Only the final array can hold a shorter frame: the remainder of the file, on its own.
+    """
+    _, num_channels, _ = audio_info(file_path)
+    carry = None
+    # Blocks are a whole number of frames, so only the final block can leave a remainder
+    for block in iter_audio_blocks(file_path, list(range(num_channels)), block_frames=frame_length * 1024):
+        if carry is not None:
+            block, carry = np.concatenate([carry, block]), None
+        whole = block.shape[0] // frame_length * frame_length
+        if whole < block.shape[0]:
+            carry = block[whole:]
+        if whole:
+            yield block[:whole].reshape(-1, frame_length, block.shape[1])
+    if carry is not None:
+        yield carry[None]
+
+
+def waveform_peaks(file_path: str, peaks_per_second: int = 20):
+    """Min/max envelope over all channels, ``peaks_per_second`` buckets per second, in one streaming pass.
+
+    Returns (mins, maxs) as float32 arrays with one value per bucket; the last bucket may be partial.
+    """
+    _, _, sample_rate = audio_info(file_path)
+    bucket = max(1, int(round(sample_rate / peaks_per_second)))
+    mins, maxs = [], []
+    for frames in iter_frames(file_path, bucket):
+        mins.append(frames.min(axis=(1, 2)))
+        maxs.append(frames.max(axis=(1, 2)))
+    if not mins:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    return np.concatenate(mins).astype(np.float32), np.concatenate(maxs).astype(np.float32)
+
+
+def _wav_header(num_frames: int, sample_rate: int) -> bytes:
+    data_bytes = num_frames * OUTPUT_SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * OUTPUT_SAMPLE_WIDTH, OUTPUT_SAMPLE_WIDTH, 16,
+        b"data", data_bytes,
+    )
+
+
+class MixJob:
+    """A mix that is rendered block by block in the background and can be streamed while it grows"""
+
+    def __init__(self, key: str, source_path: str, output_path: str, channels, weights):
+        self.key = key
+        self.source_path = source_path
+        self.output_path = output_path
+        self.partial_path = output_path + ".part"
+        # Locked while this process renders, so other workers can stream the partial file
+        self.progress_path = output_path + ".part.json"
+        self.channels = channels
+        self.weights = weights
+        num_frames, _, self.sample_rate = audio_info(source_path)
+        # The output size is known up front, so the header is final from the first byte
+        self.total_bytes = WAV_HEADER_BYTES + num_frames * OUTPUT_SAMPLE_WIDTH
+        self.num_frames = num_frames
+        self.bytes_written = 0
+        self.error = None
+        self.done = threading.Event()
+        self._progress = threading.Condition()
+        self._claim = None
+
+    def claim(self) -> bool:
+        """Take the render lock of this mix; False if another process is rendering it"""
+        f = open(self.progress_path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        json.dump({"total_bytes": self.total_bytes, "channels": self.channels, "weights": self.weights}, f)
+        f.flush()
+        self._claim = f
+        return True
+
+    def _release(self):
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+        fcntl.flock(self._claim, fcntl.LOCK_UN)
+        self._claim.close()
+        self._claim = None
+
+    def render(self):
+        gains = np.asarray(self.weights, dtype=np.float32)
+        try:
+            with open(self.partial_path, "wb") as f:
+                f.write(_wav_header(self.num_frames, self.sample_rate))
+                self._advance(f, WAV_HEADER_BYTES)
+                for block in iter_audio_blocks(self.source_path, self.channels):
+                    mixed = block @ gains
+                    pcm = (np.clip(mixed, -1.0, 1.0) * 32767.0).astype("<i2")
+                    f.write(pcm.tobytes())
+                    self._advance(f, pcm.nbytes)
+            os.replace(self.partial_path, self.output_path)
+            logger.info(f"Finished mix {self.key} -> {self.output_path}")
+        except Exception as e:
+            logger.error(f"Mixing {self.source_path} failed: {str(e)}", exc_info=True)
+            self.error = str(e)
+        finally:
+            # Followers in other workers see the claim go away after the rename
+            self._release()
+            with self._progress:
+                self.done.set()
+                self._progress.notify_all()
+
+    def _advance(self, f, num_bytes: int):
+        f.flush()
+        with self._progress:
+            self.bytes_written += num_bytes
+            self._progress.notify_all()
+
+    def _open_output(self):
+        """Open whichever name currently exists, or None if rendering failed first.
+
+        The renderer creates the partial file on its own thread, so a request right after
+        start_mix may arrive before either name exists. Once it has written the header,
+        one of them does; an open handle survives the final rename.
+        """
+        with self._progress:
+            while self.bytes_written == 0 and not self.done.is_set():
+                self._progress.wait(timeout=1.0)
+        if self.error:
+            return None
+        try:
+            return open(self.partial_path, "rb")
+        except FileNotFoundError:
+            return open(self.output_path, "rb")
+
+    def stream(self, start: int, stop: int, chunk_size: int = 1 << 16):
+        """Yield bytes [start, stop) of the output, waiting for the renderer where necessary"""
+        f = self._open_output()
+        if f is None:
+            return
+        with f:
+            f.seek(start)
+            position = start
+            while position < stop:
+                with self._progress:
+                    while self.bytes_written <= position and not self.done.is_set():
+                        self._progress.wait(timeout=1.0)
+                    available = self.bytes_written
+                if self.error:
+                    return
+                chunk = f.read(min(chunk_size, stop - position, available - position))
+                if not chunk:
+                    time.sleep(0.01)
+                    continue
+                position += len(chunk)
+                yield chunk
+
+
+def _rendering(progress_path: str) -> bool:
+    """Whether some process holds the render lock of a mix"""
+    try:
+        f = open(progress_path, "r")
+    except FileNotFoundError:
+        return False
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+class PartialMix:
+    """A mix another worker is rendering, streamed from its partial file as it grows"""
+
+    def __init__(self, key: str, output_path: str, progress: dict):
+        self.key = key
+        self.output_path = output_path
+        self.partial_path = output_path + ".part"
+        self.progress_path = output_path + ".part.json"
+        self.total_bytes = progress["total_bytes"]
+        self.channels = progress["channels"]
+        self.weights = progress["weights"]
+        self.error = None
+        # Completion is only observed while streaming, through the render lock
+        self.done = threading.Event()
+
+    def _open_output(self):
+        """Open whichever name currently exists, waiting while the renderer has not created either"""
+        while True:
+            for path in (self.partial_path, self.output_path):
+                try:
+                    return open(path, "rb")
+                except FileNotFoundError:
+                    pass
+            if not _rendering(self.progress_path):
+                return None
+            time.sleep(FOLLOW_INTERVAL)
+
+    def stream(self, start: int, stop: int, chunk_size: int = 1 << 16):
+        """Yield bytes [start, stop) of the output, polling until the renderer has written them"""
+        f = self._open_output()
+        if f is None:
+            return
+        with f:
+            f.seek(start)
+            position = start
+            while position < stop:
+                chunk = f.read(min(chunk_size, stop - position))
+                if not chunk:
+                    if not _rendering(self.progress_path):
+                        # Everything the renderer wrote is visible once its lock is gone
+                        chunk = f.read(min(chunk_size, stop - position))
+                        if not chunk:
+                            return
+                    else:
+                        time.sleep(FOLLOW_INTERVAL)
+                        continue
+                position += len(chunk)
+                yield chunk
+
+
+class MixCache:
+    """Mixes keyed by (source content hash, channels, weights), rendered once and reused"""
+
+    def __init__(self, cache_dir: str = "data/mixes", artifacts_root: str = "data/artifacts"):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.artifacts = ArtifactStore(artifacts_root)
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def start_mix(self, source_path: str, channels, mix_type: str = "equal", custom_weights=None) -> MixJob:
+        if mix_type not in MIX_TYPES:
+            raise ValueError(f"Unknown mix_type: {mix_type}")
+        _, num_channels, _ = audio_info(source_path)
+        if not channels:
+            raise ValueError("At least one channel must be selected")
+        if any(c < 0 or c >= num_channels for c in channels):
+            raise ValueError(f"Channels must be between 0 and {num_channels - 1}")
+
+        audio_hash = hash_file(source_path)
+        if mix_type == "auto_gain":
+            weights = self._auto_gain_weights(source_path, audio_hash, channels)
+        else:
+            weights = compute_mix_weights(source_path, channels, mix_type, custom_weights)
+        key = hash_params(audio_hash, list(channels), [round(w, 6) for w in weights])
+
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is not None and not job.error:
+                return job
+            job = MixJob(key, source_path, self.path_for(key), list(channels), weights)
+            while True:
+                if os.path.exists(job.output_path):
+                    job.bytes_written = job.total_bytes
+                    job.done.set()
+                    break
+                if job.claim():
+                    if not os.path.exists(job.output_path):
+                        break
+                    # Another worker finished it between the two checks
+                    job._release()
+                    continue
+                partial = self.partial(key)
+                if partial is not None:
+                    logger.info(f"Mix {key} is being rendered by another worker")
+                    return partial
+            self.jobs[key] = job
+        if not job.done.is_set():
+            logger.info(f"Starting mix {key} of channels {channels} with weights {weights}")
+            threading.Thread(target=job.render, daemon=True).start()
+        return job
+
+    def _auto_gain_weights(self, source_path: str, audio_hash: str, channels):
+        """Auto-gain weights take a full pass over the recording, so they are computed once per content and channels"""
+        inputs = {"audio": audio_hash}
+        params = {"mix_type": "auto_gain", "channels": list(channels)}
+        key = self.artifacts.key("mix_weights", inputs, params)
+        manifest = self.artifacts.lookup("mix_weights", key)
+        if manifest is None:
+            self.artifacts.save_json("mix_weights", key, "weights.json",
+                                     compute_mix_weights(source_path, channels, "auto_gain"))
+            manifest = self.artifacts.commit("mix_weights", key, inputs, params, {"weights": "weights.json"})
+        return self.artifacts.load_json(manifest, "weights")
+
+    def get(self, key: str):
+        with self._lock:
+            return self.jobs.get(key)
+
+    def partial(self, key: str, attempts: int = 20):
+        """The mix of ``key`` while another worker renders it, or None if nobody is rendering it"""
+        progress_path = self.path_for(key) + ".part.json"
+        for _ in range(attempts):
+            if not _rendering(progress_path):
+                return None
+            try:
+                with open(progress_path) as f:
+                    return PartialMix(key, self.path_for(key), json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                # The renderer took the lock and has not written its progress yet
+                time.sleep(FOLLOW_INTERVAL)
+        return None
@@ -1,4 +1,7 @@
 from speaker_identification import FileProcessor
+from sweep import SweepRunner
+from frame_scoring import FrameScorer
+from results_store import ResultsStore, usage_snapshot, usage_since
 import json
 from pyannote.core import Segment, Timeline, Annotation
 from pyannote.metrics.diarization import DiarizationErrorRate
@@ -11,12 +14,24 @@ from argparse import ArgumentParser
 class Evaluator:
     def __init__(self, ground_truth_dict,
                  segment_info_dict,
-                 pred_trans_text: str):
+                 pred_trans_text: str,
+                 scorer: str = "pyannote",
+                 resolution: float = 0.01,
+                 frame_scorer: FrameScorer = None):
+        """``scorer="frame"`` scores on a frame grid instead of with pyannote Annotations.
+
+        A ``frame_scorer`` built once for the ground truth can be passed in to reuse its
+        rasterized reference across many evaluations.
+        """
         self.ground_truth_dict = ground_truth_dict
         self.ground_truth_dict = [s for s in self.ground_truth_dict if s["text"]]
         self.segment_info_dict = segment_info_dict
         self.segment_info_dict = [s for s in self.segment_info_dict if s["text"]]
         self.pred_trans_text = pred_trans_text
+        self.scorer = scorer
+        self.frame_scorer = frame_scorer
+        if scorer == "frame" and frame_scorer is None:
+            self.frame_scorer = FrameScorer(self.ground_truth_dict, resolution)
 
     def compute_diarization(self):
         reference = Annotation()
@@ -49,6 +64,12 @@ class Evaluator:
 
     def evaluate(self):
         results = {}
+        if self.scorer == "frame":
+            components = self.frame_scorer.diarization(self.segment_info_dict)
+            results["diarization"] = components.pop("diarization error rate")
+            results["diarization_components"] = components
+            results["speaker_classification_f1"] = self.frame_scorer.speaker_classification(self.segment_info_dict)
+            return results
         results["diarization"] = self.compute_diarization()
         # if "text" in self.ground_truth_dict:
         #     results["wer"] = self.compute_wer()
@@ -68,6 +89,10 @@ if __name__ == "__main__":
     parser.add_argument("--ground_truth_labels", type=str, default="data/ground_truth_labels.json")
     parser.add_argument("--video_path", type=str, default="data/videos/video1.mp4")
     parser.add_argument("--output_path", type=str, default="data/all_results.json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scorer", type=str, default="pyannote", choices=["pyannote", "frame"])
+    parser.add_argument("--results_db", type=str, default=None, help="Also append the metrics to this results store")
+    parser.add_argument("--video_name", type=str, default=None, help="Video name of the stored metrics")
     args = parser.parse_args()
     whisper_initial_labels = args.whisper_initial_labels
     ground_truth_labels = args.ground_truth_labels
@@ -76,15 +101,25 @@ if __name__ == "__main__":
     all_results = {}
 
     print("Denoising Proportion Variations === ")
-    speaker_results = auto_run_speaker(args.video_path, args.whisper_initial_labels, denoise=False, verification_threshold=0)
-    speaker_results = speaker_results["segments"]
-    evaluator = Evaluator(ground_truth_labels, speaker_results, None)
-    results = evaluator.evaluate()
-    all_results[0] = results
-    for denoise_prop in tqdm.tqdm([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]):
-        speaker_results = auto_run_speaker(args.video_path, args.whisper_initial_labels, denoise=True, denoise_prop=denoise_prop, verification_threshold=0)
-        speaker_results = speaker_results["segments"]
-        evaluator = Evaluator(ground_truth_labels, speaker_results, None)
+    # One sweep shares the loaded audio, the model and segment embeddings across all points
+    snapshot = usage_snapshot()
+    runner = SweepRunner(args.video_path, args.whisper_initial_labels, max_workers=args.workers)
+    points = runner.run(denoise_props=[None, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
+                        verification_thresholds=[0])
+    frame_scorer = FrameScorer([s for s in ground_truth_labels if s["text"]]) if args.scorer == "frame" else None
+    point_results = []
+    for point in tqdm.tqdm(points):
+        evaluator = Evaluator(ground_truth_labels, point["speaker_results"]["segments"], None,
+                              scorer=args.scorer, frame_scorer=frame_scorer)
         results = evaluator.evaluate()
-        all_results[denoise_prop] = results
-    json.dump(all_results, open(args.output_path, "w"))
\ No newline at end of file
+        all_results[point["denoise_prop"] or 0] = results
+        point_results.append(results)
+    json.dump(all_results, open(args.output_path, "w"))
+    if args.results_db:
+        # Points share one sweep, so each row carries the usage of the whole sweep
+        usage = usage_since(snapshot)
+        store = ResultsStore(args.results_db)
+        video_name = args.video_name or os.path.splitext(os.path.basename(args.video_path))[0]
+        for point, results in zip(points, point_results):
+            config = {"denoise_prop": point["denoise_prop"] or 0, "verification_threshold": 0, "scorer": args.scorer}
+            store.append_metrics(video_name, "denoise", config, results, usage)
\ No newline at end of file
@@ -4,11 +4,16 @@ from pyannote.core import Segment, Timeline, Annotation
 from pyannote.metrics.diarization import DiarizationErrorRate
 from jiwer import wer
 import os
+import sys
 import tqdm
 from sklearn.metrics import precision_recall_fscore_support, accuracy_score
 from argparse import ArgumentParser
 from auto_run_speaker import Evaluator
 from auto_run_speaker import auto_run_speaker
+from sweep import SweepRunner
+from frame_scoring import FrameScorer
+from reference_subsets import ReferenceSubsetEvaluator
+from results_store import ResultsStore, usage_snapshot, usage_since
 import copy
 
 def rewrite_speakers(ground_truth_labels: dict, speaker_duration: int):
@@ -45,20 +50,63 @@ if __name__ == "__main__":
     parser.add_argument("--ground_truth_labels", type=str, default="data/ground_truth_labels.json")
     parser.add_argument("--video_path", type=str, default="data/videos/video1.mp4")
     parser.add_argument("--output_path", type=str, default="data/all_results.json")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--scorer", type=str, default="pyannote", choices=["pyannote", "frame"])
+    parser.add_argument("--results_db", type=str, default=None, help="Also append the metrics to this results store")
+    parser.add_argument("--video_name", type=str, default=None, help="Video name of the stored metrics")
+    parser.add_argument("--mode", type=str, default="pipeline", choices=["pipeline", "subsets"],
+                        help="subsets: score random reference subsets from one embedding pass")
+    parser.add_argument("--seeds", type=int, default=200, help="Random reference subsets per duration in subsets mode")
     args = parser.parse_args()
     whisper_initial_labels = args.whisper_initial_labels
     ground_truth_labels = args.ground_truth_labels
     ground_truth_labels = json.load(open(ground_truth_labels))
     all_results = {}
+    speaker_durations = [5, 10, 15, 20, 25, 30]
+    video_name = args.video_name or os.path.splitext(os.path.basename(args.video_path))[0]
 
-    for speaker_duration in tqdm.tqdm([5, 10, 15, 20, 25, 30]):
+    if args.mode == "subsets":
+        snapshot = usage_snapshot()
+        segments = [s for s in ground_truth_labels if s["text"]]
+        runner = SweepRunner(args.video_path, args.whisper_initial_labels)
+        embeddings = runner.segment_embeddings(segments, denoise_prop=0.2)
+        curve = ReferenceSubsetEvaluator(segments, embeddings, verification_threshold=0).evaluate(
+            speaker_durations, seeds=args.seeds)
+        json.dump(curve, open(args.output_path, "w"))
+        if args.results_db:
+            store = ResultsStore(args.results_db)
+            usage = usage_since(snapshot)
+            for speaker_duration, summary in curve.items():
+                config = {"speaker_duration": speaker_duration, "denoise_prop": 0.2, "verification_threshold": 0,
+                          "scorer": "frame", "seeds": args.seeds}
+                store.append_metrics(video_name, "reference_subsets", config, summary, usage)
+        sys.exit(0)
+
+    reference_sets = {}
+    for speaker_duration in speaker_durations:
         new_speaker_labels = rewrite_speakers(ground_truth_labels, speaker_duration)
         curr_path = args.whisper_initial_labels.replace(".json", f"_speaker_duration_{speaker_duration}.json")
         json.dump(new_speaker_labels, open(curr_path, "w"))
-        print("Denoising Proportion Variations === ")
-        speaker_results = auto_run_speaker(args.video_path, curr_path, denoise=True, denoise_prop=0.2, verification_threshold=0)
-        speaker_results = speaker_results["segments"]
-        evaluator = Evaluator(ground_truth_labels, speaker_results, None)
+        reference_sets[speaker_duration] = new_speaker_labels
+    print("Denoising Proportion Variations === ")
+    # Segments are embedded once and reused for every reference duration
+    snapshot = usage_snapshot()
+    runner = SweepRunner(args.video_path, args.whisper_initial_labels, max_workers=args.workers)
+    points = runner.run(denoise_props=[0.2], verification_thresholds=[0], reference_sets=reference_sets)
+    frame_scorer = FrameScorer([s for s in ground_truth_labels if s["text"]]) if args.scorer == "frame" else None
+    point_results = []
+    for point in tqdm.tqdm(points):
+        evaluator = Evaluator(ground_truth_labels, point["speaker_results"]["segments"], None,
+                              scorer=args.scorer, frame_scorer=frame_scorer)
         results = evaluator.evaluate()
-        all_results[speaker_duration] = results
-    json.dump(all_results, open(args.output_path, "w"))
\ No newline at end of file
+        all_results[point["reference"]] = results
+        point_results.append(results)
+    json.dump(all_results, open(args.output_path, "w"))
+    if args.results_db:
+        # Points share one sweep, so each row carries the usage of the whole sweep
+        usage = usage_since(snapshot)
+        store = ResultsStore(args.results_db)
+        for point, results in zip(points, point_results):
+            config = {"speaker_duration": point["reference"], "denoise_prop": 0.2, "verification_threshold": 0,
+                      "scorer": args.scorer}
+            store.append_metrics(video_name, "speaker_duration", config, results, usage)
\ No newline at end of file
@@ -0,0 +1,382 @@
+"""
+Offline benchmark of the transcription and speaker identification pipeline.
+
+Generates deterministic synthetic recordings (several speakers, one close-talk channel
+per speaker, known segment timing) plus matching whisper-style JSON, then times each
+pipeline stage at several input durations. Whisper and the ECAPA speaker model are
+replaced by small deterministic stand-ins unless real models are requested, so the
+benchmark runs without network access or private data:
+
+    python benchmark.py --durations 30 120 600 --output data/benchmarks/current.json
+    python benchmark.py --compare data/benchmarks/baseline.json --max_slowdown 1.2
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import wave
+import shutil
+import logging
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from argparse import ArgumentParser
+from datetime import datetime
+import numpy as np
+import torch
+import torchaudio
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+VOCABULARY = ("patient", "pressure", "oxygen", "check", "line", "breathing", "okay", "ready", "push", "heart",
+              "rate", "monitor", "please", "tube", "saturation", "good", "again", "now", "hold", "compressions")
+
+
+def _speaker_voice(rng: np.random.Generator, speaker: int, num_samples: int) -> np.ndarray:
+    """Voiced syllable bursts with a speaker-specific pitch and harmonic balance"""
+    t = np.arange(num_samples) / SAMPLE_RATE
+    f0 = 95 + 40 * speaker + rng.uniform(-5, 5)
+    harmonics = rng.uniform(0.2, 1.0, size=6) / np.arange(1, 7)
+    # Slow pitch drift and ~4 Hz syllable envelope
+    phase = 2 * np.pi * np.cumsum(f0 * (1 + 0.05 * np.sin(2 * np.pi * 0.5 * t))) / SAMPLE_RATE
+    voice = sum(a * np.sin((h + 1) * phase) for h, a in enumerate(harmonics))
+    envelope = np.clip(np.sin(2 * np.pi * (3.5 + 0.3 * speaker) * t + rng.uniform(0, np.pi)), 0, None)
+    return (voice * envelope + 0.02 * rng.standard_normal(num_samples)).astype(np.float32)
+
+
+def _write_wav(path: str, audio: np.ndarray):
+    """Write (channels, samples) float audio as 16-bit PCM"""
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(audio.shape[0])
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.T.tobytes())
+
+
+def make_fixture(out_dir: str, duration: float, num_speakers: int = 3, seed: int = 0, labeled_fraction: float = 0.3):
+    """Write a synthetic recording and its transcripts; returns the paths and the transcript.
+
+    Channel ``c`` is speaker ``c``'s close-talk microphone, with the other speakers
+    bleeding in at a lower level. ``audio_mono.wav`` is the channel average.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    num_samples = int(duration * SAMPLE_RATE)
+    channels = np.zeros((num_speakers, num_samples), dtype=np.float32)
+    segments = []
+    t = 0.2
+    while t < duration - 0.5:
+        speaker = int(rng.integers(num_speakers))
+        length = float(min(rng.uniform(0.8, 6.0), duration - t - 0.1))
+        start, end = round(t, 2), round(t + length, 2)
+        lo, hi = int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+        voice = _speaker_voice(rng, speaker, hi - lo) * 0.3
+        for c in range(num_speakers):
+            channels[c, lo:hi] += voice * (1.0 if c == speaker else 0.15)
+        num_words = max(1, int(length * 2.5))
+        words = [str(rng.choice(VOCABULARY)) for _ in range(num_words)]
+        step = (end - start) / num_words
+        segments.append({
+            "id": len(segments),
+            "seek": 0,
+            "start": start,
+            "end": end,
+            "text": "".join(" " + w for w in words),
+            "tokens": [int(x) for x in rng.integers(50000, size=num_words + 1)],
+            "temperature": 0.0,
+            "avg_logprob": -0.3,
+            "compression_ratio": 1.2,
+            "no_speech_prob": 0.01,
+            "words": [{"word": " " + w, "start": round(start + i * step, 2), "end": round(start + (i + 1) * step, 2),
+                       "probability": 0.9} for i, w in enumerate(words)],
+            "speaker": f"SPEAKER_{speaker}",
+        })
+        t = end + float(rng.uniform(0.05, 0.6))
+    channels += 0.005 * rng.standard_normal(channels.shape).astype(np.float32)
+
+    multi_path = os.path.join(out_dir, "audio.wav")
+    mono_path = os.path.join(out_dir, "audio_mono.wav")
+    _write_wav(multi_path, channels)
+    _write_wav(mono_path, channels.mean(axis=0, keepdims=True))
+
+    ground_truth = [{k: s[k] for k in ("id", "start", "end", "text", "speaker")} for s in segments]
+    # Initial labels: the first segments of every speaker stay labeled, the rest are left to identify
+    labeled_per_speaker = {}
+    initial = []
+    for s in ground_truth:
+        count = labeled_per_speaker.get(s["speaker"], 0)
+        keep = count < max(1, int(labeled_fraction * len(segments) / num_speakers))
+        labeled_per_speaker[s["speaker"]] = count + 1
+        initial.append(dict(s, speaker=s["speaker"] if keep else ""))
+    labels_path = os.path.join(out_dir, "whisper_results.json")
+    ground_truth_path = os.path.join(out_dir, "ground_truth_labels.json")
+    json.dump({"segments": initial}, open(labels_path, "w"))
+    json.dump(ground_truth, open(ground_truth_path, "w"))
+
+    transcript = {"text": "".join(s["text"] for s in segments), "language": "en",
+                  "segments": [{k: v for k, v in s.items() if k != "speaker"} for s in segments]}
+    return {
+        "dir": out_dir,
+        "duration": duration,
+        "speakers": num_speakers,
+        "audio": multi_path,
+        "audio_mono": mono_path,
+        "labels": labels_path,
+        "ground_truth": ground_truth_path,
+        "transcript": transcript,
+    }
+
+
+class StubWhisperModel:
+    """Returns the fixture transcript after reading the audio, in place of a Whisper model"""
+
+    def __init__(self, transcript: dict):
+        self.transcript = transcript
+
+    def transcribe(self, audio, **kwargs):
+        # Like Whisper, accept a path or samples that were already loaded (e.g. cut down to speech)
+        if isinstance(audio, str):
+            torchaudio.load(audio)
+        return copy.deepcopy(self.transcript)
+
+
+class StubVerification:
+    """Deterministic stand-in for the ECAPA model: a fixed projection of log spectra"""
+
+    def __init__(self, dim: int = 192, n_fft: int = 400, seed: int = 0):
+        generator = torch.Generator().manual_seed(seed)
+        self.n_fft = n_fft
+        self.window = torch.hann_window(n_fft)
+        self.projection = torch.randn(n_fft // 2 + 1, dim, generator=generator)
+
+    def encode_batch(self, wavs, wav_lens=None, normalize=False):
+        if wavs.dim() == 1:
+            wavs = wavs.unsqueeze(0)
+        spectrum = torch.stft(wavs, self.n_fft, hop_length=160, window=self.window, return_complex=True).abs()
+        return (torch.log1p(spectrum).mean(dim=-1) @ self.projection).unsqueeze(1)
+
+    def verify_batch(self, wavs1, wavs2, wav1_lens=None, wav2_lens=None, threshold=0.25):
+        score = torch.nn.functional.cosine_similarity(self.encode_batch(wavs1), self.encode_batch(wavs2), dim=-1)
+        return score, score > threshold
+
+
+@contextlib.contextmanager
+def patched(target, name: str, value):
+    original = getattr(target, name)
+    setattr(target, name, value)
+    try:
+        yield
+    finally:
+        setattr(target, name, original)
+
+
+@contextlib.contextmanager
+def working_dir(path: str):
+    """Run a stage from a scratch directory so data/ caches of one repeat never leak into the next"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+class Models:
+    """Model handles for the stages: stand-ins by default, real models on request"""
+
+    def __init__(self, whisper_model: str = None, ecapa: bool = False):
+        self.whisper_model = whisper_model
+        self.ecapa = ecapa
+        self._verification = None
+
+    @property
+    def verification(self):
+        if self._verification is None:
+            if self.ecapa:
+                from speaker_identification import load_verification_model
+                self._verification = load_verification_model()
+            else:
+                self._verification = StubVerification()
+        return self._verification
+
+    @contextlib.contextmanager
+    def whisper(self, fixture: dict):
+        import whisper_transcribe
+        import multi_channel_speaker_identification
+        with contextlib.ExitStack() as stack:
+            if self.whisper_model:
+                for module in (whisper_transcribe, multi_channel_speaker_identification):
+                    stack.enter_context(patched(module, "whisper_model_name", lambda: self.whisper_model))
+            else:
+                stub = StubWhisperModel(fixture["transcript"])
+                stack.enter_context(patched(whisper_transcribe, "load_whisper_model", lambda: stub))
+            yield
+
+
+def stage_load_audio(fixture, workdir, models):
+    start = time.perf_counter()
+    torchaudio.load(fixture["audio"])
+    return time.perf_counter() - start
+
+
+def stage_denoise(fixture, workdir, models):
+    from speaker_identification import denoise_audio
+    audio, sr = torchaudio.load(fixture["audio_mono"])
+    start = time.perf_counter()
+    denoise_audio(audio, sr, 0.2)
+    return time.perf_counter() - start
+
+
+def stage_transcribe(fixture, workdir, models):
+    from whisper_transcribe import transcribe_with_whisper
+    with models.whisper(fixture):
+        start = time.perf_counter()
+        transcribe_with_whisper(fixture["audio_mono"], workdir)
+        return time.perf_counter() - start
+
+
+def stage_speaker_identification(fixture, workdir, models):
+    from speaker_identification import FileProcessor
+    verification = models.verification
+    start = time.perf_counter()
+    processor = FileProcessor(fixture["audio_mono"], fixture["labels"], verification_threshold=0,
+                              verification=verification)
+    processor.process(store_results=False)
+    return time.perf_counter() - start
+
+
+def stage_multi_channel(fixture, workdir, models):
+    import multi_channel_speaker_identification as mc
+    labels = os.path.join(workdir, "whisper_results.json")
+    shutil.copy(fixture["labels"], labels)
+    verification = models.verification
+    with models.whisper(fixture), working_dir(workdir), \
+            patched(mc, "load_verification_model", lambda: verification):
+        start = time.perf_counter()
+        processor = mc.MultiChannelFileProcessor(fixture["audio"], labels, denoise=True, denoise_prop=0.2,
+                                                 verification_threshold=0)
+        processor.process()
+        return time.perf_counter() - start
+
+
+def stage_mix_channels(fixture, workdir, models):
+    from audio_mixing import MixCache
+    start = time.perf_counter()
+    job = MixCache(os.path.join(workdir, "mixes")).start_mix(fixture["audio"], list(range(fixture["speakers"])), "auto_gain")
+    job.done.wait()
+    return time.perf_counter() - start
+
+
+def stage_frame_scoring(fixture, workdir, models):
+    from frame_scoring import FrameScorer
+    ground_truth = json.load(open(fixture["ground_truth"]))
+    hypothesis = json.load(open(fixture["labels"]))["segments"]
+    start = time.perf_counter()
+    scorer = FrameScorer(ground_truth)
+    scorer.diarization(hypothesis)
+    scorer.speaker_classification(hypothesis)
+    return time.perf_counter() - start
+
+
+STAGES = {
+    "load_audio": stage_load_audio,
+    "denoise": stage_denoise,
+    "transcribe": stage_transcribe,
+    "speaker_identification": stage_speaker_identification,
+    "multi_channel": stage_multi_channel,
+    "mix_channels": stage_mix_channels,
+    "frame_scoring": stage_frame_scoring,
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(durations, stages, repeats: int = 3, speakers: int = 3, seed: int = 0, models: Models = None):
+    models = models or Models()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as root:
+        for duration in durations:
+            fixture = make_fixture(os.path.join(root, f"fixture-{duration}"), duration, speakers, seed)
+            for stage in stages:
+                times = []
+                for repeat in range(repeats):
+                    workdir = tempfile.mkdtemp(dir=root, prefix=f"{stage}-")
+                    times.append(STAGES[stage](fixture, workdir, models))
+                    shutil.rmtree(workdir, ignore_errors=True)
+                median = statistics.median(times)
+                results.append({
+                    "stage": stage,
+                    "duration_seconds": duration,
+                    "speakers": speakers,
+                    "repeats": repeats,
+                    "times": times,
+                    "min": min(times),
+                    "median": median,
+                    "realtime_factor": median / duration,
+                })
+                logger.info(f"{stage:>24} {duration:>6}s  median {median:.3f}s  ({median / duration:.4f}x realtime)")
+    return {
+        "created_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "python": sys.version.split()[0],
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "models": {"whisper": models.whisper_model or "stub", "verification": "ecapa" if models.ecapa else "stub"},
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, max_slowdown: float = None) -> bool:
+    """Print per-stage median ratios against a baseline; returns False if any exceeds max_slowdown"""
+    baseline_medians = {(r["stage"], r["duration_seconds"]): r["median"] for r in baseline["results"]}
+    ok = True
+    print(f"{'stage':>24} {'duration':>8} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for r in current["results"]:
+        key = (r["stage"], r["duration_seconds"])
+        if key not in baseline_medians:
+            continue
+        ratio = r["median"] / baseline_medians[key] if baseline_medians[key] else float("inf")
+        flag = ""
+        if max_slowdown and ratio > max_slowdown:
+            ok, flag = False, "  SLOWER"
+        print(f"{r['stage']:>24} {r['duration_seconds']:>8} {baseline_medians[key]:>10.3f} {r['median']:>10.3f} {ratio:>7.2f}{flag}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 120])
+    parser.add_argument("--stages", type=str, nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--whisper_model", type=str, default=None, help="Use a real Whisper model, e.g. tiny")
+    parser.add_argument("--ecapa", action="store_true", help="Use the real ECAPA speaker model")
+    parser.add_argument("--output", type=str, default=None, help="Defaults to data/benchmarks/<commit>.json")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--max_slowdown", type=float, default=None, help="Exit non-zero if a stage is this much slower")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    results = run_benchmark(args.durations, args.stages, args.repeats, args.speakers, args.seed,
+                            Models(args.whisper_model, args.ecapa))
+    output = args.output or os.path.join("data", "benchmarks", f"{(results['git_commit'] or 'unknown')[:12]}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    json.dump(results, open(output, "w"), indent=2)
+    print(f"Results written to {output}")
+    if args.compare and not compare(results, json.load(open(args.compare)), args.max_slowdown):
+        sys.exit(1)
@@ -0,0 +1,124 @@
+"""
+Unsupervised speaker proposals for segments nobody has labeled.
+
+Speaker identification can only choose among speakers that already have labeled
+segments. Here the segment embeddings are clustered instead: unlabeled segments close
+to the centroid of a labeled speaker are proposed for that speaker, and the rest are
+grouped by average-linkage agglomerative clustering, cut at a cosine distance threshold,
+into new clusters for the annotator to name. Clustering runs on the condensed distance
+matrix in scipy's compiled linkage, so thousands of segments take well under a second.
+"""
+
+import logging
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import pdist
+
+logger = logging.getLogger(__name__)
+
+DISTANCE_THRESHOLD = 0.5
+MIN_CLUSTER_SIZE = 2
+REPRESENTATIVES = 3
+LINKAGES = ("average", "complete", "single")
+
+
+def flatten_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """(segments, channels, dim) embeddings as unit rows whose dot product is the mean per-channel cosine"""
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-6)
+    return unit.reshape(len(unit), -1) / np.sqrt(embeddings.shape[1])
+
+
+def speaker_centroids(vectors: np.ndarray, labels):
+    """(speakers, centroids) of the unit rows of each labeled speaker, renormalized"""
+    speakers = sorted({label for label in labels if label})
+    if not speakers:
+        return [], np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)
+    labels = np.asarray(labels, dtype=object)
+    centroids = np.stack([vectors[labels == speaker].mean(axis=0) for speaker in speakers])
+    return speakers, centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+
+
+def cluster_vectors(vectors: np.ndarray, distance_threshold: float = DISTANCE_THRESHOLD,
+                    method: str = "average") -> np.ndarray:
+    """Cluster label (0-based) of each unit row, merging while the linkage distance stays below the threshold"""
+    if method not in LINKAGES:
+        raise ValueError(f"Unknown linkage: {method}")
+    if len(vectors) < 2:
+        return np.zeros(len(vectors), dtype=np.int64)
+    # Rows are unit length, so 1 - dot is the cosine distance
+    tree = linkage(np.clip(pdist(vectors, "cosine"), 0.0, 2.0), method=method)
+    return fcluster(tree, t=distance_threshold, criterion="distance") - 1
+
+
+def propose_speakers(segments, embeddings: np.ndarray, distance_threshold: float = DISTANCE_THRESHOLD,
+                     min_cluster_size: int = MIN_CLUSTER_SIZE, method: str = "average") -> dict:
+    """Proposed speakers for the unlabeled segments, from (segments, channels, dim) embeddings.
+
+    Rows of segments that could not be embedded are NaN and end up in ``unassigned``.
+    Returns ``known`` (unlabeled segments that match a labeled speaker), ``clusters``
+    (groups of segments that match nobody, with their closest labeled speaker) and
+    ``unassigned`` segment ids.
+    """
+    valid = ~np.isnan(embeddings).any(axis=(1, 2))
+    ids = [seg.get("id", i) for i, seg in enumerate(segments)]
+    labels = [seg.get("speaker", "") for seg in segments]
+    vectors = np.zeros((len(segments), embeddings.shape[1] * embeddings.shape[2]), dtype=np.float32)
+    if valid.any():
+        vectors[valid] = flatten_embeddings(embeddings[valid])
+    durations = np.array([float(seg["end"]) - float(seg["start"]) for seg in segments])
+
+    labeled = [i for i in range(len(segments)) if labels[i] and valid[i]]
+    speakers, centroids = speaker_centroids(vectors[labeled], [labels[i] for i in labeled])
+    unlabeled = np.array([i for i in range(len(segments)) if not labels[i] and valid[i]], dtype=np.int64)
+
+    # Seed with the labeled speakers: segments close to one of their centroids are proposed for it
+    known = {}
+    rest = unlabeled
+    if speakers and unlabeled.size:
+        similarity = vectors[unlabeled] @ centroids.T
+        best = np.argmax(similarity, axis=1)
+        best_similarity = similarity[np.arange(len(unlabeled)), best]
+        matched = 1.0 - best_similarity <= distance_threshold
+        for i, speaker, score in zip(unlabeled[matched], best[matched], best_similarity[matched]):
+            known.setdefault(speakers[speaker], []).append((int(i), float(score)))
+        rest = unlabeled[~matched]
+
+    clusters = []
+    unassigned = [ids[i] for i in range(len(segments)) if not labels[i] and not valid[i]]
+    cluster_labels = cluster_vectors(vectors[rest], distance_threshold, method) if rest.size else np.zeros(0, int)
+    for cluster in np.unique(cluster_labels):
+        members = rest[cluster_labels == cluster]
+        if len(members) < min_cluster_size:
+            unassigned.extend(ids[i] for i in members)
+            continue
+        centroid = vectors[members].mean(axis=0)
+        centroid /= max(np.linalg.norm(centroid), 1e-6)
+        closeness = vectors[members] @ centroid
+        proposal = {
+            "segment_ids": [ids[i] for i in members],
+            "duration": round(float(durations[members].sum()), 3),
+            "cohesion": round(float(closeness.mean()), 4),
+            # Segments nearest the centroid are the best ones to listen to before naming the cluster
+            "representatives": [ids[i] for i in members[np.argsort(-closeness)[:REPRESENTATIVES]]],
+            "nearest_speaker": None,
+            "similarity": None,
+        }
+        if speakers:
+            similarity = centroids @ centroid
+            nearest = int(np.argmax(similarity))
+            proposal["nearest_speaker"], proposal["similarity"] = speakers[nearest], round(float(similarity[nearest]), 4)
+        clusters.append(proposal)
+    clusters.sort(key=lambda c: -c["duration"])
+    for number, proposal in enumerate(clusters, start=1):
+        proposal["cluster"] = number
+
+    return {
+        "known": [{"speaker": speaker, "segment_ids": [ids[i] for i, _ in matches],
+                   "similarity": round(float(np.mean([score for _, score in matches])), 4),
+                   "duration": round(float(sum(durations[i] for i, _ in matches)), 3)}
+                  for speaker, matches in sorted(known.items())],
+        "clusters": clusters,
+        "unassigned": unassigned,
+        "distance_threshold": distance_threshold,
+    }
@@ -0,0 +1,35 @@
+import hashlib
+import json
+import os
+import threading
+
+HASH_CHUNK_SIZE = 1 << 20
+
+# (path, size, mtime_ns) -> digest, so repeated requests on an unchanged file don't re-read it
+_file_hash_cache = {}
+_file_hash_lock = threading.Lock()
+
+
+def hash_file(file_path: str) -> str:
+    """Return the sha1 hex digest of a file's contents, memoized on (path, size, mtime)"""
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        if cache_key in _file_hash_cache:
+            return _file_hash_cache[cache_key]
+
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    result = digest.hexdigest()
+
+    with _file_hash_lock:
+        _file_hash_cache[cache_key] = result
+    return result
+
+
+def hash_params(*parts) -> str:
+    """Return a stable sha1 hex digest for a sequence of JSON-serializable values"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
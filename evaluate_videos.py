@@ -0,0 +1,220 @@
+"""
+Run speaker identification evaluations for many videos and configurations.
+
+The manifest is a JSON file listing videos and configurations; every video is run with
+every configuration:
+
+    {
+        "videos": [
+            {"name": "uab_video", "dir": "uploads/uab_video", "media": "video.mp4"},
+            {"name": "neo_cam_video", "media": "uploads/neo_cam_video/audio.wav",
+             "whisper_initial_labels": "uploads/neo_cam_video/whisper_results.json",
+             "ground_truth_labels": "uploads/neo_cam_video/ground_truth_labels.json"}
+        ],
+        "configs": [
+            {"pipeline": "single", "denoise_prop": null, "verification_threshold": 0},
+            {"pipeline": "single", "denoise_prop": 0.2, "verification_threshold": 0, "speaker_duration": 10},
+            {"pipeline": "multi_channel", "denoise_prop": 0.2, "verification_threshold": 0}
+        ]
+    }
+
+Each job runs in its own worker process under memory/CPU limits and its result is stored
+as soon as it finishes, so rerunning the same manifest skips completed jobs.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import traceback
+import multiprocessing
+from argparse import ArgumentParser
+from results_store import ResultsStore, usage_snapshot, usage_since
+from transcript_store import words_path_for
+
+logger = logging.getLogger(__name__)
+
+PIPELINES = ("single", "multi_channel")
+
+
+def load_manifest(manifest_path: str):
+    """Return the list of (video, config) jobs described by a manifest"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    jobs = []
+    for video in manifest["videos"]:
+        video_dir = video.get("dir", "")
+        resolved = {
+            "name": video["name"],
+            "media": os.path.join(video_dir, video["media"]),
+            "whisper_initial_labels": os.path.join(video_dir, video.get("whisper_initial_labels", "whisper_results.json")),
+            "ground_truth_labels": os.path.join(video_dir, video.get("ground_truth_labels", "ground_truth_labels.json")),
+        }
+        for config in manifest["configs"]:
+            if config.get("pipeline", "single") not in PIPELINES:
+                raise ValueError(f"Unknown pipeline {config.get('pipeline')!r}, expected one of {', '.join(PIPELINES)}")
+            jobs.append((resolved, config))
+    return jobs
+
+
+def run_job(video: dict, config: dict) -> dict:
+    """Run one speaker identification configuration on one video and evaluate it.
+
+    Derived reference labels and the speaker results written next to them live in a
+    directory of their own, so concurrent jobs on the same video never share a file and
+    nothing is left beside the source labels.
+    """
+    from auto_run_speaker import Evaluator, auto_run_speaker
+    from auto_run_speaker_diff_seeds import rewrite_speakers
+    from auto_run_multi_channel import auto_run_speaker_multi_channel
+
+    with open(video["ground_truth_labels"]) as f:
+        ground_truth_labels = json.load(f)
+    with tempfile.TemporaryDirectory(prefix=f"evaluate_{video['name']}_") as job_dir:
+        source_labels = video["whisper_initial_labels"]
+        labels_file = os.path.join(job_dir, os.path.basename(source_labels))
+        if config.get("speaker_duration") is not None:
+            # Reference labels limited to the given number of seconds per speaker
+            root, ext = os.path.splitext(labels_file)
+            labels_file = f"{root}_speaker_duration_{config['speaker_duration']}{ext}"
+            with open(labels_file, "w") as f:
+                json.dump(rewrite_speakers(ground_truth_labels, config["speaker_duration"]), f)
+        else:
+            shutil.copyfile(source_labels, labels_file)
+            if os.path.exists(words_path_for(source_labels)):
+                shutil.copyfile(words_path_for(source_labels), words_path_for(labels_file))
+
+        denoise_prop = config.get("denoise_prop")
+        run = auto_run_speaker_multi_channel if config.get("pipeline") == "multi_channel" else auto_run_speaker
+        speaker_results = run(video["media"], labels_file, denoise=denoise_prop is not None,
+                              denoise_prop=denoise_prop or 0.1,
+                              verification_threshold=config.get("verification_threshold", 0.2))
+    evaluator = Evaluator(ground_truth_labels, speaker_results["segments"], None,
+                          scorer=config.get("scorer", "pyannote"))
+    return evaluator.evaluate()
+
+
+def _apply_limits(memory_gb: float, cpu_seconds: int, threads: int):
+    if memory_gb:
+        limit = int(memory_gb * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _job_worker(conn, video: dict, config: dict, limits: dict):
+    """Entry point of a job process; sends ("ok", (result, usage)) or ("error", message) back"""
+    try:
+        _apply_limits(**limits)
+        snapshot = usage_snapshot()
+        result = run_job(video, config)
+        conn.send(("ok", (result, usage_since(snapshot))))
+    except MemoryError:
+        conn.send(("error", f"memory limit of {limits['memory_gb']} GB exceeded"))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class Orchestrator:
+    """Schedules (video, config) jobs over a pool of single-use worker processes.
+
+    A fresh process per job makes the resource limits per job and means a job killed for
+    exceeding them (or crashing in native code) only fails itself, not the pool.
+    """
+
+    def __init__(self, store: ResultsStore, workers: int = 1, memory_gb: float = None,
+                 cpu_seconds: int = None, timeout: float = None, max_attempts: int = 2,
+                 experiment: str = "default"):
+        self.store = store
+        self.experiment = experiment
+        self.workers = workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.limits = {"memory_gb": memory_gb, "cpu_seconds": cpu_seconds, "threads": threads}
+        # CUDA cannot be re-initialized in forked children
+        self.context = multiprocessing.get_context("spawn")
+
+    def pending(self, jobs):
+        """Jobs that still need to run: not done, and failed fewer than max_attempts times"""
+        todo = []
+        for video, config in jobs:
+            status, attempts = self.store.status(video["name"], config)
+            if status == "done":
+                continue
+            if status == "failed" and attempts >= self.max_attempts:
+                logger.warning(f"Skipping {video['name']} {config}: failed {attempts} times")
+                continue
+            todo.append((video, config))
+        return todo
+
+    def run(self, jobs, poll_interval: float = 0.5):
+        todo = self.pending(jobs)
+        logger.info(f"{len(jobs) - len(todo)} of {len(jobs)} jobs already complete, running {len(todo)}")
+        running = []
+        total, finished = len(todo), 0
+        while todo or running:
+            while todo and len(running) < self.workers:
+                video, config = todo.pop(0)
+                parent_conn, child_conn = self.context.Pipe(duplex=False)
+                process = self.context.Process(target=_job_worker, args=(child_conn, video, config, self.limits))
+                self.store.mark_running(video["name"], config)
+                process.start()
+                child_conn.close()
+                running.append((process, parent_conn, video, config, time.time()))
+
+            still_running = []
+            for process, conn, video, config, started in running:
+                if conn.poll():
+                    try:
+                        outcome, payload = conn.recv()
+                    except EOFError:
+                        outcome, payload = "error", "worker exited without a result"
+                elif not process.is_alive():
+                    outcome, payload = "error", f"worker exited with code {process.exitcode}"
+                elif self.timeout and time.time() - started > self.timeout:
+                    process.terminate()
+                    outcome, payload = "error", f"timed out after {self.timeout} s"
+                else:
+                    still_running.append((process, conn, video, config, started))
+                    continue
+                process.join()
+                conn.close()
+                if outcome == "ok":
+                    result, usage = payload
+                    self.store.record_result(video["name"], config, result, usage, experiment=self.experiment)
+                else:
+                    self.store.record_failure(video["name"], config, payload)
+                finished += 1
+                logger.info(f"[{finished}/{total}] {video['name']} {config}: {outcome}")
+            running = still_running
+            if running:
+                time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--manifest", type=str, default="data/evaluation_manifest.json")
+    parser.add_argument("--results_db", type=str, default="data/results.sqlite")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory_gb", type=float, default=None, help="Address space limit per job")
+    parser.add_argument("--cpu_seconds", type=int, default=None, help="CPU time limit per job")
+    parser.add_argument("--timeout", type=float, default=None, help="Wall clock limit per job in seconds")
+    parser.add_argument("--max_attempts", type=int, default=2)
+    parser.add_argument("--experiment", type=str, default=None, help="Experiment name of the stored metrics, defaults to the manifest name")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    orchestrator = Orchestrator(ResultsStore(args.results_db), workers=args.workers, memory_gb=args.memory_gb,
+                                cpu_seconds=args.cpu_seconds, timeout=args.timeout, max_attempts=args.max_attempts,
+                                experiment=args.experiment or os.path.splitext(os.path.basename(args.manifest))[0])
+    orchestrator.run(load_manifest(args.manifest))
@@ -0,0 +1,137 @@
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def dumps(obj, sort_keys: bool = True) -> bytes:
+    """Serialize to compact JSON bytes, sorting keys like jsonify by default; uses orjson when installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # Types orjson does not know fall back to the stdlib encoder below
+            pass
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), default=DefaultJSONProvider.default).encode("utf-8")
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by ``dumps``/``loads``, so every jsonify call gets the fast path"""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def accepted_encoding():
+    """Best content encoding the client of the current request accepts, or None"""
+    encoding = request.accept_encodings.best_match(ENCODINGS, default=None)
+    return encoding if encoding and request.accept_encodings[encoding] > 0 else None
+
+
+def _add_vary(response):
+    if "Accept-Encoding" not in response.headers.get("Vary", ""):
+        response.headers.add("Vary", "Accept-Encoding")
+
+
+def compress_response(response):
+    """after_request hook compressing buffered responses above the size threshold"""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or "Content-Encoding" in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    _add_vary(response)
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+class EncodedResponseCache:
+    """Encoded JSON response bodies keyed by the version of the data they were built from.
+
+    A key must change whenever the underlying data changes, e.g. include the signature
+    of the results file. Each entry keeps the serialized body and, once requested, its
+    compressed variants, so unchanged data is serialized and compressed only once. The
+    ETag lets polling clients revalidate with a 304 and no body at all.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def response(self, app, key, build):
+        """Response for ``key``, calling ``build()`` for the data only if it is not cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            body = dumps(build())
+            entry = {"identity": body, "etag": hashlib.blake2b(body, digest_size=16).hexdigest()}
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if request.if_none_match.contains(entry["etag"]):
+            response = app.response_class(status=304)
+            response.set_etag(entry["etag"])
+            return response
+
+        body, encoding = entry["identity"], None
+        if len(body) >= MIN_COMPRESS_SIZE:
+            encoding = accepted_encoding()
+            if encoding is not None:
+                if encoding not in entry:
+                    entry[encoding] = compress(body, encoding)
+                body = entry[encoding]
+        response = app.response_class(body, mimetype="application/json")
+        response.set_etag(entry["etag"])
+        if len(entry["identity"]) >= MIN_COMPRESS_SIZE:
+            _add_vary(response)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        return response
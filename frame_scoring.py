@@ -0,0 +1,133 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+def _labels(segments):
+    return sorted({s["speaker"] for s in segments if s.get("speaker")})
+
+
+def _bounds(segments, resolution: float) -> np.ndarray:
+    """(n, 2) segment boundaries snapped to the frame grid"""
+    bounds = np.array([(s["start"], s["end"]) for s in segments], dtype=np.float64).reshape(-1, 2)
+    return np.round(bounds / resolution) * resolution if resolution else bounds
+
+
+def rasterize(segments, labels, bounds: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """(cells, labels) count of active segments per label in each cell between boundaries.
+
+    Segments are dicts with start, end and speaker; segments without a speaker or with a
+    speaker outside ``labels`` are ignored. Overlapping segments of one speaker count
+    twice, as they do in pyannote.
+    """
+    column = {label: i for i, label in enumerate(labels)}
+    cols = np.array([column.get(s.get("speaker"), -1) for s in segments], dtype=np.int64)
+    keep = (cols >= 0) & (bounds[:, 1] > bounds[:, 0])
+    # Difference array: +1 at each segment start, -1 at its end, then a running sum per label
+    counts = np.zeros((len(boundaries), len(labels)), dtype=np.int32)
+    np.add.at(counts, (np.searchsorted(boundaries, bounds[keep, 0]), cols[keep]), 1)
+    np.add.at(counts, (np.searchsorted(boundaries, bounds[keep, 1]), cols[keep]), -1)
+    return np.cumsum(counts[:-1], axis=0)
+
+
+class FrameScorer:
+    """Frame-grid diarization scoring against one reference.
+
+    Segment boundaries are snapped to a grid of ``resolution`` seconds, and labels are
+    rasterized into per-speaker activity counts. Only the cells between consecutive
+    boundaries are stored, each weighted by its duration, which is equivalent to a dense
+    frame grid but scales with the number of segments rather than the audio length
+    (``resolution=None`` scores the exact boundaries). DER components then follow from
+    per-cell speaker counts and the optimal one-to-one speaker mapping, as in pyannote's
+    DiarizationErrorRate with no collar and overlap scored.
+
+    The reference is parsed once, so scoring many hypotheses against the same ground
+    truth (e.g. every point of a sweep) only has to parse the hypotheses.
+    """
+
+    def __init__(self, reference_segments, resolution: float = 0.01):
+        self.resolution = resolution
+        self.reference_segments = [s for s in reference_segments if s.get("speaker")]
+        self.reference_labels = _labels(self.reference_segments)
+        self.reference_bounds = _bounds(self.reference_segments, resolution)
+
+    def _grids(self, hypothesis_segments):
+        hypothesis_segments = [s for s in hypothesis_segments if s.get("speaker")]
+        hypothesis_labels = _labels(hypothesis_segments)
+        hypothesis_bounds = _bounds(hypothesis_segments, self.resolution)
+        boundaries = np.unique(np.concatenate([self.reference_bounds.ravel(), hypothesis_bounds.ravel()]))
+        durations = np.diff(boundaries)
+        reference = rasterize(self.reference_segments, self.reference_labels, self.reference_bounds, boundaries)
+        hypothesis = rasterize(hypothesis_segments, hypothesis_labels, hypothesis_bounds, boundaries)
+        return reference, hypothesis, hypothesis_labels, durations
+
+    def diarization(self, hypothesis_segments) -> dict:
+        """DER and its components in seconds, plus the speaker mapping and confusion matrix"""
+        reference, hypothesis, hypothesis_labels, durations = self._grids(hypothesis_segments)
+        n_ref = reference.sum(axis=1)
+        n_hyp = hypothesis.sum(axis=1)
+        # Seconds each (reference, hypothesis) speaker pair is active together
+        cooccurrence = (reference > 0).T.astype(np.float64) @ ((hypothesis > 0) * durations[:, None])
+        mapping = {}
+        correct = 0.0
+        if cooccurrence.size:
+            rows, cols = linear_sum_assignment(-cooccurrence)
+            pairs = [(r, c) for r, c in zip(rows, cols) if cooccurrence[r, c] > 0]
+            mapping = {hypothesis_labels[c]: self.reference_labels[r] for r, c in pairs}
+            if pairs:
+                rows, cols = np.array(pairs).T
+                correct = float((np.minimum(reference[:, rows], hypothesis[:, cols]).sum(axis=1) * durations).sum())
+
+        total = float((n_ref * durations).sum())
+        missed = float((np.maximum(n_ref - n_hyp, 0) * durations).sum())
+        false_alarm = float((np.maximum(n_hyp - n_ref, 0) * durations).sum())
+        confusion = float((np.minimum(n_ref, n_hyp) * durations).sum()) - correct
+        return {
+            "diarization error rate": (missed + false_alarm + confusion) / total if total else 0.0,
+            "total": total,
+            "missed detection": missed,
+            "false alarm": false_alarm,
+            "confusion": confusion,
+            "correct": correct,
+            "mapping": mapping,
+            "speaker_confusion": {
+                ref_label: {hyp_label: float(cooccurrence[i, j])
+                            for j, hyp_label in enumerate(hypothesis_labels) if cooccurrence[i, j]}
+                for i, ref_label in enumerate(self.reference_labels)
+            },
+        }
+
+    def speaker_classification(self, hypothesis_segments) -> dict:
+        """Time-weighted precision/recall/F1 of speaker names, averaged by reference duration.
+
+        Unlike comparing segment lists position by position, this needs no one-to-one
+        correspondence between reference and hypothesis segments.
+        """
+        reference, hypothesis, hypothesis_labels, durations = self._grids(hypothesis_segments)
+        labels = sorted(set(self.reference_labels) | set(hypothesis_labels))
+        ref = np.zeros((len(durations), len(labels)), dtype=bool)
+        hyp = np.zeros((len(durations), len(labels)), dtype=bool)
+        index = {label: i for i, label in enumerate(labels)}
+        ref[:, [index[l] for l in self.reference_labels]] = reference > 0
+        hyp[:, [index[l] for l in hypothesis_labels]] = hypothesis > 0
+
+        true_positive = ((ref & hyp) * durations[:, None]).sum(axis=0)
+        support = (ref * durations[:, None]).sum(axis=0)
+        predicted = (hyp * durations[:, None]).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(predicted > 0, true_positive / predicted, 0.0)
+            recall = np.where(support > 0, true_positive / support, 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        weights = support / support.sum() if support.sum() else support
+        speech = ref.any(axis=1)
+        speech_seconds = float(durations[speech].sum())
+        return {
+            "precision": float((precision * weights).sum()),
+            "recall": float((recall * weights).sum()),
+            "f1": float((f1 * weights).sum()),
+            "support": None,
+            "accuracy": float(durations[(ref & hyp).any(axis=1)].sum()) / speech_seconds if speech_seconds else 0.0,
+            "per_speaker": {
+                label: {"precision": float(p), "recall": float(r), "f1": float(f), "seconds": float(s)}
+                for label, p, r, f, s in zip(labels, precision, recall, f1, support)
+            },
+        }
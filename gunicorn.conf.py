@@ -0,0 +1,50 @@
+"""
+Production serving profile for either app:
+
+    gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c gunicorn.conf.py app_multi_channel:app
+
+Web workers are threaded and never load the ML models; transcription and speaker
+identification run in INFERENCE_WORKERS dedicated processes started by the gunicorn
+master and fed through the inference queue (see inference_queue.py). At most
+INFERENCE_MAX_PENDING jobs are queued or running at once; further requests get a 503.
+With INFERENCE_QUEUE=0 the web workers run inference themselves and preload the models
+once they start, so /ready only reports ready when they are loaded.
+"""
+
+import os
+
+# Read by the apps at import time, so the web workers send heavy jobs to the queue
+os.environ.setdefault("INFERENCE_QUEUE", "1")
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_WORKERS", 4))
+worker_class = "gthread"
+# Requests waiting for an inference job hold a thread, not the whole worker
+threads = int(os.environ.get("WEB_THREADS", 8))
+timeout = 120
+graceful_timeout = 30
+max_requests = 1000
+max_requests_jitter = 100
+accesslog = "-"
+
+_inference_pool = None
+
+
+def on_starting(server):
+    global _inference_pool
+    from inference_queue import InferencePool
+    _inference_pool = InferencePool(int(os.environ.get("INFERENCE_WORKERS", 1))).start()
+
+
+def post_worker_init(worker):
+    from inference_queue import queue_enabled
+    # With INFERENCE_QUEUE=0 each web worker loads the models itself; /ready waits for them
+    warmup = getattr(worker.wsgi, "extensions", {}).get("warmup")
+    if warmup is not None and not queue_enabled():
+        warmup.start()
+
+
+def on_exit(server):
+    if _inference_pool is not None:
+        _inference_pool.stop()
@@ -0,0 +1,372 @@
+"""
+Run transcription and speaker identification in dedicated inference processes.
+
+In the production profile (see gunicorn.conf.py) the web workers only serve the UI and
+editing endpoints. Heavy requests are put on a queue in SQLite, and one or more
+inference processes, each holding the Whisper and ECAPA models, take jobs from it in
+order. The web worker waits for its job and answers the request as before. When the
+number of queued and running jobs reaches the admission limit, new jobs are refused
+with QueueFull so the caller can answer 503 instead of piling up work.
+
+Background work (the warm-ahead prefetch, see prefetch.py) is queued at BACKGROUND
+priority: it does not count towards the admission limit, is claimed only when no
+interactive job is waiting, and gives way between its stages when one arrives.
+
+Inference processes can also be run on their own:
+
+    python inference_queue.py --workers 1
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import sqlite3
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime
+from argparse import ArgumentParser
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ("transcribe", "speaker_identification", "propose_speakers", "enroll_speakers", "prelabel_speakers",
+             "prefetch")
+# Job priorities; lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class QueueFull(Exception):
+    """Raised by InferenceQueue.submit when the admission limit is reached"""
+
+
+class InferenceError(Exception):
+    """An inference job failed; the message is the error reported by the inference process"""
+
+
+class Preempted(Exception):
+    """A background job stopped between stages to let interactive work run; it is requeued"""
+
+
+def queue_enabled() -> bool:
+    """Whether heavy endpoints go through the inference queue (INFERENCE_QUEUE=1)"""
+    return os.environ.get("INFERENCE_QUEUE", "").lower() in ("1", "true", "yes")
+
+
+class InferenceQueue:
+    """Durable FIFO of inference jobs shared by web workers and inference processes"""
+
+    def __init__(self, db_path: str = "data/inference_queue.sqlite", max_pending: int = None):
+        self.db_path = db_path
+        self.max_pending = max_pending if max_pending is not None else int(os.environ.get("INFERENCE_MAX_PENDING", 4))
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    worker TEXT,
+                    submitted_at TEXT,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            # Queues created before job priorities existed
+            if "priority" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_priority ON jobs (status, priority, id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def submit(self, kind: str, payload: dict, priority: int = INTERACTIVE) -> int:
+        """Queue a job and return its id, or raise QueueFull if too many interactive jobs are waiting or running.
+
+        A BACKGROUND job identical to one that is already queued or running is not queued
+        again; the id of the existing job is returned instead.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown inference job {kind!r}, expected one of {', '.join(JOB_KINDS)}")
+        payload_json = json.dumps(payload, sort_keys=True)
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so the admission check and insert are atomic
+            conn.execute("BEGIN IMMEDIATE")
+            if priority == INTERACTIVE:
+                active = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running') AND priority = ?",
+                                      (INTERACTIVE,)).fetchone()[0]
+                if active >= self.max_pending:
+                    conn.execute("ROLLBACK")
+                    raise QueueFull(f"{active} inference jobs are already queued or running")
+            else:
+                existing = conn.execute("""
+                    SELECT id FROM jobs WHERE status IN ('pending', 'running') AND kind = ? AND payload = ?
+                """, (kind, payload_json)).fetchone()
+                if existing:
+                    conn.execute("ROLLBACK")
+                    return existing[0]
+            job_id = conn.execute("""
+                INSERT INTO jobs (kind, payload, status, priority, submitted_at) VALUES (?, ?, 'pending', ?, ?)
+            """, (kind, payload_json, priority, datetime.now().isoformat())).lastrowid
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        logger.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def claim(self, worker: str):
+        """Take the oldest pending job of the highest priority as (id, kind, payload), or None if there is none"""
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                UPDATE jobs SET status = 'running', worker = ?, started_at = ?, attempts = attempts + 1
+                WHERE id = (SELECT id FROM jobs WHERE status = 'pending' ORDER BY priority, id LIMIT 1)
+                RETURNING id, kind, payload
+            """, (worker, datetime.now().isoformat())).fetchone()
+        finally:
+            conn.close()
+        return (row[0], row[1], json.loads(row[2])) if row else None
+
+    def complete(self, job_id: int, result: dict):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                         (json.dumps(result), datetime.now().isoformat(), job_id))
+
+    def fail(self, job_id: int, error: str):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                         (error, datetime.now().isoformat(), job_id))
+
+    def requeue(self, job_id: int):
+        """Put a preempted job back in the queue; giving way does not use up one of its attempts"""
+        with self._connect() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'pending', worker = NULL, started_at = NULL, attempts = attempts - 1
+                WHERE id = ?
+            """, (job_id,))
+
+    def interactive_waiting(self) -> bool:
+        """Whether an interactive job is queued and not yet claimed"""
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM jobs WHERE status = 'pending' AND priority = ? LIMIT 1",
+                                (INTERACTIVE,)).fetchone() is not None
+
+    def release(self, worker: str, max_attempts: int = 2) -> int:
+        """Requeue the jobs a dead inference process was running, failing those that already used up their attempts"""
+        with self._connect() as conn:
+            released = conn.execute("""
+                UPDATE jobs SET
+                    status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END,
+                    error = CASE WHEN attempts < ? THEN NULL ELSE 'Inference worker exited while running this job' END,
+                    worker = NULL
+                WHERE status = 'running' AND worker = ?
+            """, (max_attempts, max_attempts, worker)).rowcount
+        if released:
+            logger.warning(f"Released {released} jobs of inference worker {worker}")
+        return released
+
+    def status(self, job_id: int) -> dict:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, result, error = row
+        return {"id": job_id, "status": status, "result": json.loads(result) if result else None, "error": error}
+
+    def wait(self, job_id: int, timeout: float = None, poll_interval: float = 0.25) -> dict:
+        """Block until a job finishes and return its result; raise InferenceError if it failed"""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            job = self.status(job_id)
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise InferenceError(job["error"])
+            if deadline and time.time() > deadline:
+                raise TimeoutError(f"Inference job {job_id} did not finish within {timeout} seconds")
+            time.sleep(poll_interval)
+
+    def counts(self) -> dict:
+        """Number of jobs per status"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+def patch_torchaudio():
+    """speechbrain expects torchaudio.list_audio_backends, which newer torchaudio releases dropped"""
+    import torchaudio
+    if not hasattr(torchaudio, "list_audio_backends"):
+        torchaudio.list_audio_backends = lambda: ["soundfile"]
+
+
+def run_inference_job(kind: str, payload: dict, should_yield=None) -> dict:
+    """Run one job in this process. Results are written to disk and their paths returned.
+
+    Background jobs call ``should_yield()`` between stages and raise Preempted when it is true.
+    """
+    if kind == "transcribe":
+        from whisper_transcribe import transcribe_with_whisper
+        from transcript_store import save_transcript
+        os.makedirs(payload["segments_dir"], exist_ok=True)
+        results, audio_path = transcribe_with_whisper(payload["media_path"], payload["segments_dir"], save_json=False)
+        # Store the slim segment table for the UI and the word-level columns alongside it
+        save_transcript(results, payload["segments_dir"])
+        return {"whisper_results_file": os.path.join(payload["segments_dir"], "whisper_results.json"),
+                "audio_path": audio_path}
+    if kind == "speaker_identification":
+        from segment_edits import write_results_atomic
+        if payload.get("pipeline") == "multi_channel":
+            patch_torchaudio()
+            from multi_channel_speaker_identification import MultiChannelFileProcessor as Processor
+        else:
+            from speaker_identification import FileProcessor as Processor
+        options = {"sliding_window": True} if payload.get("sliding_window") else {}
+        processor = Processor(payload["audio_path"], payload["whisper_results_file"], payload.get("denoise", False),
+                              payload.get("denoise_prop", 0.1), payload.get("verification_threshold", 0.2), **options)
+        processor.process()
+        # Renamed into place, so the app never reads a half-written file
+        write_results_atomic(payload["speaker_results_file"], processor.speaker_results)
+        return {"speaker_results_file": payload["speaker_results_file"]}
+    if kind == "propose_speakers":
+        patch_torchaudio()
+        from sweep import SweepRunner, load_segments
+        from clustering import propose_speakers
+        segments = load_segments(payload["results_file"])
+        # Same artifact-store entry the prefetcher and speaker sweeps use for these segments
+        embeddings = SweepRunner(payload["audio_path"], payload["results_file"]).segment_embeddings(segments)
+        proposals = propose_speakers(segments, embeddings, payload.get("distance_threshold", 0.5),
+                                     payload.get("min_cluster_size", 2))
+        with open(payload["proposals_file"], "w") as f:
+            json.dump(proposals, f)
+        return {"proposals_file": payload["proposals_file"]}
+    if kind == "enroll_speakers":
+        patch_torchaudio()
+        from speaker_library import enroll_results, open_library
+        return {"enrolled": enroll_results(open_library(), payload["audio_path"], payload["results_file"])}
+    if kind == "prelabel_speakers":
+        patch_torchaudio()
+        from speaker_library import PRELABEL_THRESHOLD, open_library, prelabel_assignments
+        # The app applies these under its results lock, like a batch edit
+        return {"operations": prelabel_assignments(open_library(), payload["audio_path"], payload["results_file"],
+                                                   payload.get("threshold", PRELABEL_THRESHOLD))}
+    if kind == "prefetch":
+        from prefetch import run_prefetch, run_stage
+        # The ingest service queues one stage at a time, the apps the whole pipeline
+        if payload.get("stage"):
+            return run_stage(payload["media_path"], payload["segments_dir"], payload["stage"], should_yield)
+        return run_prefetch(payload["media_path"], payload["segments_dir"], should_yield)
+    raise ValueError(f"Unknown inference job {kind!r}")
+
+
+def _preload_models():
+    patch_torchaudio()
+    from whisper_transcribe import load_whisper_model
+    from speaker_identification import load_verification_model
+    load_whisper_model()
+    load_verification_model()
+
+
+def inference_worker(name: str, db_path: str = "data/inference_queue.sqlite", poll_interval: float = 0.5):
+    """Loop of one inference process: load the models once, then run queued jobs one at a time"""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - {name} - %(levelname)s - %(message)s")
+    queue = InferenceQueue(db_path)
+    queue.release(name)
+    try:
+        _preload_models()
+    except Exception:
+        # Jobs load the models again on first use and report the error to the caller
+        logger.error(f"Inference worker {name} could not preload models", exc_info=True)
+    logger.info(f"Inference worker {name} ready")
+    while True:
+        job = queue.claim(name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        job_id, kind, payload = job
+        logger.info(f"Running {kind} job {job_id}")
+        try:
+            queue.complete(job_id, run_inference_job(kind, payload, queue.interactive_waiting))
+            logger.info(f"Finished {kind} job {job_id}")
+        except Preempted as e:
+            logger.info(f"{kind} job {job_id} gave way to interactive work before {e}")
+            queue.requeue(job_id)
+        except Exception:
+            logger.error(f"{kind} job {job_id} failed", exc_info=True)
+            queue.fail(job_id, traceback.format_exc(limit=5))
+
+
+class InferencePool:
+    """Keeps a fixed number of inference processes alive, restarting any that exit.
+
+    Each process runs ``target(name, db_path, *target_args)``; by default the inference worker loop.
+    """
+
+    def __init__(self, workers: int = 1, db_path: str = "data/inference_queue.sqlite", check_interval: float = 5.0,
+                 target=inference_worker, target_args=(), name_prefix: str = "inference"):
+        self.workers = workers
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.target = target
+        self.target_args = tuple(target_args)
+        self.name_prefix = name_prefix
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {}
+        self._stopping = threading.Event()
+        self._monitor = None
+
+    def _name(self, index: int) -> str:
+        return f"{self.name_prefix}-{socket.gethostname()}-{index}"
+
+    def _spawn(self, index: int):
+        name = self._name(index)
+        process = self._context.Process(target=self.target, args=(name, self.db_path) + self.target_args,
+                                        name=name, daemon=True)
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Started worker {name} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._watch, name="inference-pool", daemon=True)
+        self._monitor.start()
+        return self
+
+    def _watch(self):
+        while not self._stopping.wait(self.check_interval):
+            for index, process in list(self._processes.items()):
+                if not process.is_alive() and not self._stopping.is_set():
+                    logger.error(f"Worker {process.name} exited with code {process.exitcode}, restarting")
+                    self._spawn(index)
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        for process in self._processes.values():
+            process.terminate()
+        for process in self._processes.values():
+            process.join(timeout)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="Number of inference processes")
+    parser.add_argument("--db_path", type=str, default="data/inference_queue.sqlite")
+    args = parser.parse_args()
+    pool = InferencePool(args.workers, args.db_path).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
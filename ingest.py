@@ -0,0 +1,405 @@
+"""
+Batch ingest of recordings dropped into the upload folder.
+
+    python ingest.py --upload_folder /path/to/uploads --concurrency transcribe=2
+
+A watcher notices new or changed media files under the upload folder, with inotify when
+the optional ``inotify_simple`` package is installed and by polling otherwise. Once a
+file has stopped changing for ``--settle`` seconds it is queued in data/ingest.sqlite,
+and the queued file then moves through the prefetch stages (probe, extract, transcribe,
+embed, waveform; see prefetch.py) one stage at a time. Every stage has its own pool of
+worker processes, so its concurrency is limited on its own, and a failed stage is
+retried with a growing delay before the file is marked failed. Transcripts are stored
+per folder (data/segments-<folder>), so only the first video found in a folder is
+ingested; others there are skipped with a warning. With an inference queue
+(INFERENCE_QUEUE=1), the transcribe and embed workers hand their stage to the inference
+processes as BACKGROUND jobs instead of loading the models themselves, so interactive
+requests keep priority. The apps report progress on ``/ingest_status``.
+
+Run one ingest service per queue database.
+"""
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from argparse import ArgumentParser
+from prefetch import STAGE_NAMES, run_stage, segments_dir_for
+from inference_queue import BACKGROUND, InferencePool, InferenceQueue, queue_enabled
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+# Video formats the UI can play, as served by /serve_video. Extracted .wav files land
+# next to the videos, so audio files are not ingested on their own.
+MEDIA_EXTENSIONS = (".mp4", ".avi", ".mov", ".wmv", ".flv", ".webm", ".mkv", ".m4v")
+# Worker processes per stage; Whisper and ECAPA stages hold a model in each process
+DEFAULT_CONCURRENCY = {"probe": 1, "extract": 2, "transcribe": 1, "embed": 1, "waveform": 1}
+# With an inference queue these run as BACKGROUND jobs in the inference processes, so
+# interactive requests go first and preempt them between stages
+HEAVY_STAGES = ("transcribe", "embed")
+HEARTBEAT_INTERVAL = 10.0
+
+
+def parse_concurrency(spec: str) -> dict:
+    """Per-stage worker counts from e.g. "transcribe=2,extract=4", on top of the defaults"""
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        stage, _, count = part.partition("=")
+        if stage not in concurrency or not count.isdigit():
+            raise ValueError(f"Invalid concurrency {part!r}, expected <stage>=<workers> with stage one of "
+                             f"{', '.join(STAGE_NAMES)}")
+        concurrency[stage] = int(count)
+    return concurrency
+
+
+class IngestQueue:
+    """Durable queue of media files moving through the ingest stages.
+
+    Each row is one version (size, mtime) of a file. It waits in one stage at a time and
+    moves on when that stage succeeds; a newer version of the same file supersedes rows
+    that are not finished yet.
+    """
+
+    def __init__(self, db_path: str = "data/ingest.sqlite", max_attempts: int = 3, retry_delay: float = 60.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    worker TEXT,
+                    queued_at TEXT,
+                    updated_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS items_by_stage ON items (stage, status, next_attempt_at, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS items_by_path ON items (path, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS service (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS segments_dirs (segments_dir TEXT PRIMARY KEY, path TEXT NOT NULL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def enqueue(self, path: str, size: int, mtime_ns: int):
+        """Queue a file version for the first stage; returns its id, or None if this version was already queued"""
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            latest = conn.execute("SELECT size, mtime_ns FROM items WHERE path = ? ORDER BY id DESC LIMIT 1",
+                                  (path,)).fetchone()
+            if latest == (size, mtime_ns):
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute("""
+                UPDATE items SET status = 'superseded', updated_at = ? WHERE path = ? AND status IN ('pending', 'running')
+            """, (now, path))
+            item_id = conn.execute("""
+                INSERT INTO items (path, size, mtime_ns, stage, status, queued_at, updated_at)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            """, (path, size, mtime_ns, STAGE_NAMES[0], now, now)).lastrowid
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        logger.info(f"Queued {path} for ingest")
+        return item_id
+
+    def segments_dir_owner(self, segments_dir: str, path: str) -> str:
+        """The file whose transcript goes to ``segments_dir``: the first one that asked for it"""
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO segments_dirs (segments_dir, path) VALUES (?, ?)", (segments_dir, path))
+            return conn.execute("SELECT path FROM segments_dirs WHERE segments_dir = ?", (segments_dir,)).fetchone()[0]
+
+    def claim(self, stage: str, worker: str):
+        """Take the oldest item that is due in a stage as (id, path), or None if there is none"""
+        conn = self._connect()
+        try:
+            row = conn.execute("""
+                UPDATE items SET status = 'running', worker = ?, updated_at = ?
+                WHERE id = (SELECT id FROM items WHERE stage = ? AND status = 'pending' AND next_attempt_at <= ?
+                            ORDER BY id LIMIT 1)
+                RETURNING id, path
+            """, (worker, datetime.now().isoformat(), stage, time.time())).fetchone()
+        finally:
+            conn.close()
+        return tuple(row) if row else None
+
+    def advance(self, item_id: int, stage: str):
+        """Move an item that finished ``stage`` on to the next stage, or mark it done after the last"""
+        index = STAGE_NAMES.index(stage)
+        next_stage = STAGE_NAMES[index + 1] if index + 1 < len(STAGE_NAMES) else None
+        with self._connect() as conn:
+            # A superseded item is no longer running, so it stays where it is
+            conn.execute("""
+                UPDATE items SET stage = ?, status = ?, attempts = 0, next_attempt_at = 0, error = NULL,
+                                 worker = NULL, updated_at = ?
+                WHERE id = ? AND status = 'running'
+            """, (next_stage or stage, "pending" if next_stage else "done", datetime.now().isoformat(), item_id))
+
+    _RETRY = """
+        UPDATE items SET
+            attempts = attempts + 1,
+            status = CASE WHEN attempts + 1 < :max_attempts THEN 'pending' ELSE 'failed' END,
+            next_attempt_at = :now + :retry_delay * (1 << attempts),
+            error = :error, worker = NULL, updated_at = :updated_at
+        WHERE status = 'running' AND {where}
+    """
+
+    def fail(self, item_id: int, error: str):
+        """Schedule a retry of the item's current stage, or mark it failed once it used up its attempts"""
+        with self._connect() as conn:
+            conn.execute(self._RETRY.format(where="id = :id"), self._retry_params(error, id=item_id))
+
+    def release(self, worker: str) -> int:
+        """Retry the item a dead worker was running; the crash counts as a failed attempt"""
+        with self._connect() as conn:
+            released = conn.execute(self._RETRY.format(where="worker = :worker"),
+                                    self._retry_params("Ingest worker exited while running this stage",
+                                                       worker=worker)).rowcount
+        if released:
+            logger.warning(f"Released {released} items of ingest worker {worker}")
+        return released
+
+    def _retry_params(self, error: str, **params) -> dict:
+        return dict(params, max_attempts=self.max_attempts, now=time.time(), retry_delay=self.retry_delay,
+                    error=error, updated_at=datetime.now().isoformat())
+
+    def heartbeat(self, info: dict):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO service (key, value) VALUES ('watcher', ?) "
+                         "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                         (json.dumps(dict(info, at=time.time())),))
+
+    def status(self, limit: int = 50) -> dict:
+        """Watcher state, items per stage and status, and the most recently updated items"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM service WHERE key = 'watcher'").fetchone()
+            by_stage = conn.execute("""
+                SELECT stage, status, COUNT(*) FROM items WHERE status IN ('pending', 'running') GROUP BY stage, status
+            """).fetchall()
+            totals = dict(conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+            recent = conn.execute("""
+                SELECT id, path, stage, status, attempts, error, queued_at, updated_at
+                FROM items ORDER BY updated_at DESC, id DESC LIMIT ?
+            """, (limit,)).fetchall()
+        watcher = json.loads(row[0]) if row else None
+        if watcher is not None:
+            watcher["alive"] = time.time() - watcher["at"] < 3 * HEARTBEAT_INTERVAL
+        stages = {stage: {"pending": 0, "running": 0} for stage in STAGE_NAMES}
+        for stage, status, count in by_stage:
+            stages.setdefault(stage, {"pending": 0, "running": 0})[status] = count
+        columns = ("id", "path", "stage", "status", "attempts", "error", "queued_at", "updated_at")
+        return {"watcher": watcher, "stages": stages, "totals": totals,
+                "items": [dict(zip(columns, item)) for item in recent]}
+
+
+def stage_worker(name: str, db_path: str, stage: str, inference_db: str = None, poll_interval: float = 2.0):
+    """Loop of one ingest process: run ``stage`` for queued items one at a time.
+
+    Heavy stages are handed to the inference queue in ``inference_db`` when one is given.
+    """
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - {name} - %(levelname)s - %(message)s")
+    queue = IngestQueue(db_path)
+    queue.release(name)
+    inference = InferenceQueue(inference_db) if inference_db and stage in HEAVY_STAGES else None
+    while True:
+        item = queue.claim(stage, name)
+        if item is None:
+            time.sleep(poll_interval)
+            continue
+        item_id, path = item
+        logger.info(f"Running {stage} for {path}")
+        try:
+            if inference is not None:
+                inference.wait(inference.submit("prefetch", {"media_path": path, "segments_dir": segments_dir_for(path),
+                                                             "stage": stage}, priority=BACKGROUND))
+            else:
+                run_stage(path, segments_dir_for(path), stage)
+            queue.advance(item_id, stage)
+        except Exception as e:
+            logger.error(f"{stage} failed for {path}", exc_info=True)
+            queue.fail(item_id, f"{type(e).__name__}: {e}")
+
+
+class UploadWatcher:
+    """Finds media files under the upload folder that are new or changed and have stopped changing"""
+
+    def __init__(self, upload_folder: str, queue: IngestQueue, settle: float = 30.0, poll_interval: float = 10.0,
+                 rescan_interval: float = 600.0, use_inotify: bool = True):
+        # Queued paths are absolute, so workers and apps can open them from any directory
+        self.upload_folder = os.path.abspath(upload_folder)
+        self.queue = queue
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.mode = "inotify" if use_inotify and INotify is not None else "polling"
+        self._handled = {}     # path -> (size, mtime_ns) already queued or found in the queue
+        self._candidates = {}  # path -> (size, mtime_ns, time this version was first seen)
+        self._stop = threading.Event()
+
+    def _is_media(self, path: str) -> bool:
+        return path.lower().endswith(MEDIA_EXTENSIONS) and not os.path.basename(path).startswith(".")
+
+    def observe(self, path: str, now: float = None):
+        """Note the current size and mtime of a file; a changed file waits to settle again"""
+        if not self._is_media(path):
+            return
+        now = time.time() if now is None else now
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._candidates.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self._handled.get(path) == signature:
+            return
+        candidate = self._candidates.get(path)
+        if candidate is None or candidate[:2] != signature:
+            self._candidates[path] = signature + (now,)
+
+    def scan(self, folder: str = None, now: float = None):
+        for root, dirs, files in os.walk(folder or self.upload_folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for filename in files:
+                self.observe(os.path.join(root, filename), now)
+
+    def settle_candidates(self, now: float = None):
+        """Queue every candidate whose size and mtime have not changed for ``settle`` seconds"""
+        now = time.time() if now is None else now
+        for path, (size, mtime_ns, since) in list(self._candidates.items()):
+            if now - since < self.settle:
+                continue
+            self.observe(path, now)
+            if self._candidates.get(path) == (size, mtime_ns, since):
+                del self._candidates[path]
+                self._handled[path] = (size, mtime_ns)
+                # Transcripts are stored per folder, so a second video there would get the first one's
+                segments_dir = segments_dir_for(path)
+                owner = self.queue.segments_dir_owner(segments_dir, path)
+                if owner != path:
+                    logger.warning(f"Not ingesting {path}: {segments_dir} already holds the data of {owner}; "
+                                   f"put each video in a folder of its own")
+                    continue
+                self.queue.enqueue(path, size, mtime_ns)
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        self.queue.heartbeat({"upload_folder": self.upload_folder, "mode": self.mode,
+                              "settling": len(self._candidates), "pid": os.getpid()})
+
+    def run(self):
+        logger.info(f"Watching {self.upload_folder} ({self.mode})")
+        if self.mode == "inotify":
+            self._run_inotify()
+        else:
+            self._run_polling()
+
+    def _run_polling(self):
+        last_scan = last_heartbeat = 0.0
+        while not self._stop.is_set():
+            now = time.time()
+            if now - last_scan >= self.poll_interval:
+                self.scan(now=now)
+                last_scan = now
+            self.settle_candidates(now)
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                self._heartbeat()
+                last_heartbeat = now
+            self._stop.wait(1.0)
+
+    def _run_inotify(self):
+        inotify = INotify()
+        watch_flags = flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO | flags.ATTRIB
+        directories = {}
+
+        def watch_tree(top):
+            for root, dirs, _ in os.walk(top):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                try:
+                    directories[inotify.add_watch(root, watch_flags)] = root
+                except OSError as e:
+                    logger.warning(f"Cannot watch {root}: {e}")
+
+        watch_tree(self.upload_folder)
+        self.scan()
+        last_scan = last_heartbeat = time.time()
+        while not self._stop.is_set():
+            for event in inotify.read(timeout=1000):
+                root = directories.get(event.wd)
+                if root is None or not event.name:
+                    continue
+                path = os.path.join(root, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        # Files may land in a new folder before its watch exists
+                        watch_tree(path)
+                        self.scan(path)
+                else:
+                    self.observe(path)
+            now = time.time()
+            # Events can be dropped when the kernel queue overflows, so rescan now and then
+            if now - last_scan >= self.rescan_interval:
+                self.scan(now=now)
+                last_scan = now
+            self.settle_candidates(now)
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                self._heartbeat()
+                last_heartbeat = now
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description="Watch the upload folder and ingest new recordings")
+    parser.add_argument("--upload_folder", type=str, default=os.environ.get("UPLOAD_FOLDER", "uploads/"))
+    parser.add_argument("--db_path", type=str, default="data/ingest.sqlite")
+    parser.add_argument("--concurrency", type=str, default=os.environ.get("INGEST_CONCURRENCY", ""),
+                        help="Worker processes per stage, e.g. transcribe=2,extract=4")
+    parser.add_argument("--settle", type=float, default=30.0,
+                        help="Seconds a file must stay unchanged before it is ingested")
+    parser.add_argument("--poll_interval", type=float, default=10.0, help="Seconds between scans when polling")
+    parser.add_argument("--polling", action="store_true", help="Poll even when inotify is available")
+    parser.add_argument("--inference_queue", type=str,
+                        default="data/inference_queue.sqlite" if queue_enabled() else None,
+                        help="Run transcribe and embed as background jobs on this inference queue "
+                             "(default with INFERENCE_QUEUE=1)")
+    args = parser.parse_args()
+
+    IngestQueue(args.db_path)
+    pools = [InferencePool(workers, args.db_path, target=stage_worker, target_args=(stage, args.inference_queue),
+                           name_prefix=f"ingest-{stage}").start()
+             for stage, workers in parse_concurrency(args.concurrency).items() if workers > 0]
+    watcher = UploadWatcher(args.upload_folder, IngestQueue(args.db_path), settle=args.settle,
+                            poll_interval=args.poll_interval, use_inotify=not args.polling)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pool in pools:
+            pool.stop()
+
+
+if __name__ == "__main__":
+    main()
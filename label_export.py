@@ -0,0 +1,149 @@
+import io
+import os
+import csv
+import glob
+import json
+import zlib
+import zipfile
+from word_index import video_name_for
+
+# format -> (file extension, content type)
+EXPORT_FORMATS = {
+    "json": ("json", "application/json"),
+    "jsonl": ("jsonl", "application/x-ndjson"),
+    "csv": ("csv", "text/csv; charset=utf-8"),
+    "rttm": ("rttm", "text/plain; charset=utf-8"),
+    "srt": ("srt", "application/x-subrip; charset=utf-8"),
+    "vtt": ("vtt", "text/vtt; charset=utf-8"),
+}
+
+
+def export_rows(segments):
+    """Yield {speaker, start, end, text} per segment in start-time order, without copying the segments"""
+    order = sorted(range(len(segments)), key=lambda i: segments[i].get("start", 0))
+    for i in order:
+        segment = segments[i]
+        yield {
+            "speaker": segment.get("speaker") or "",
+            "start": segment["start"],
+            "end": segment["end"],
+            "text": segment.get("text", ""),
+        }
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def _cue_text(row) -> str:
+    text = row["text"].strip()
+    return f"{row['speaker']}: {text}" if row["speaker"] else text
+
+
+def iter_export(segments, fmt: str, recording_id: str = "recording"):
+    """Yield the export of a segment list as text chunks, one segment at a time"""
+    rows = export_rows(segments)
+    if fmt == "json":
+        yield "["
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(row)
+        yield "]"
+    elif fmt == "jsonl":
+        for row in rows:
+            yield json.dumps(row) + "\n"
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["speaker", "start", "end", "text"])
+        for row in rows:
+            writer.writerow([row["speaker"], row["start"], row["end"], row["text"]])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == "rttm":
+        # RTTM fields are space separated, so spaces in names become underscores; unlabeled segments are left out
+        recording_id = recording_id.replace(" ", "_")
+        for row in rows:
+            if row["speaker"]:
+                yield (f"SPEAKER {recording_id} 1 {row['start']:.3f} {row['end'] - row['start']:.3f} "
+                       f"<NA> <NA> {row['speaker'].replace(' ', '_')} <NA> <NA>\n")
+    elif fmt == "srt":
+        for i, row in enumerate(rows, start=1):
+            yield (f"{i}\n{_timestamp(row['start'], ',')} --> {_timestamp(row['end'], ',')}\n"
+                   f"{_cue_text(row)}\n\n")
+    elif fmt == "vtt":
+        yield "WEBVTT\n\n"
+        for row in rows:
+            voice = f"<v {row['speaker']}>" if row["speaker"] else ""
+            yield f"{_timestamp(row['start'], '.')} --> {_timestamp(row['end'], '.')}\n{voice}{row['text'].strip()}\n\n"
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+
+
+def gzip_chunks(chunks, level: int = 6):
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode("utf-8"))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def processed_results_files(data_dir: str = "data"):
+    """Yield (video name, results file) for every transcribed video, preferring speaker results"""
+    for whisper_results_file in sorted(glob.glob(os.path.join(data_dir, "segments-*", "whisper_results.json"))):
+        speaker_results_file = whisper_results_file.replace(".json", "_speaker_results.json")
+        results_file = speaker_results_file if os.path.exists(speaker_results_file) else whisper_results_file
+        yield video_name_for(results_file), results_file
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink for ZipFile whose contents are handed out as they are written"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _load_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def iter_bulk_export(results_files, fmt: str, load_results=_load_json):
+    """Yield a zip archive with one export per video, streaming each entry as it is produced.
+
+    ``results_files`` yields (video name, results file) pairs. Only one video's segments
+    are held in memory at a time.
+    """
+    extension = EXPORT_FORMATS[fmt][0]
+    sink = _ZipStream()
+    # The sink cannot seek, so ZipFile writes sizes in data descriptors after each entry
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for video, results_file in results_files:
+            segments = load_results(results_file).get("segments", [])
+            with archive.open(f"{video}.{extension}", "w") as entry:
+                for chunk in iter_export(segments, fmt, recording_id=video):
+                    entry.write(chunk.encode("utf-8"))
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
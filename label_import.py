@@ -0,0 +1,159 @@
+import os
+import io
+import csv
+import json
+import math
+import tempfile
+
+IMPORT_FORMATS = ("json", "jsonl", "csv", "rttm")
+# Fields every uploaded JSON/JSONL segment must have, as in the exported format
+REQUIRED_FIELDS = ("speaker", "start", "end", "text")
+
+_WHITESPACE = " \t\n\r"
+
+
+class LabelImportError(ValueError):
+    """An uploaded label file is malformed; the message says where"""
+
+
+def import_format(filename: str) -> str:
+    """Import format from a file name, or None if it is not supported"""
+    extension = os.path.splitext(filename.lower())[1].lstrip(".")
+    if extension == "ndjson":
+        extension = "jsonl"
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def iter_json_array(stream, chunk_size: int = 1 << 16):
+    """Yield the elements of a top-level JSON array read incrementally from a text stream"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ""
+            fill()
+
+    if next_char() != "[":
+        raise LabelImportError("Invalid file format: expected array of segments")
+    pos += 1
+    index = 0
+    if next_char() == "]":
+        return
+    while True:
+        if not next_char():
+            raise LabelImportError(f"Unexpected end of file in segment at index {index}")
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A value that ends exactly at the buffer end may continue in the next chunk
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise LabelImportError(f"Invalid JSON in segment at index {index}: {e.msg}")
+            fill()
+        pos = end
+        yield value
+        index += 1
+        separator = next_char()
+        pos += 1
+        if separator == "]":
+            break
+        if separator != ",":
+            raise LabelImportError(f"Invalid JSON after segment at index {index - 1}: expected ',' or ']'")
+    if next_char():
+        raise LabelImportError("Unexpected data after the array of segments")
+
+
+def iter_jsonl(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise LabelImportError(f"Invalid JSON on line {line_number}: {e.msg}")
+
+
+def iter_csv(stream):
+    reader = csv.DictReader(stream)
+    missing = [field for field in ("speaker", "start", "end") if field not in (reader.fieldnames or [])]
+    if missing:
+        raise LabelImportError(f"CSV header is missing column(s): {', '.join(missing)}")
+    for row in reader:
+        yield {"speaker": row["speaker"], "start": row["start"], "end": row["end"], "text": row.get("text") or ""}
+
+
+def iter_rttm(stream):
+    for line_number, line in enumerate(stream, start=1):
+        fields = line.split()
+        if not fields or fields[0] != "SPEAKER":
+            continue
+        if len(fields) < 8:
+            raise LabelImportError(f"RTTM line {line_number} has {len(fields)} fields, expected 10")
+        try:
+            start, duration = float(fields[3]), float(fields[4])
+        except ValueError:
+            raise LabelImportError(f"RTTM line {line_number} has a non-numeric onset or duration")
+        yield {"speaker": fields[7], "start": start, "end": start + duration, "text": ""}
+
+
+_READERS = {"json": iter_json_array, "jsonl": iter_jsonl, "csv": iter_csv, "rttm": iter_rttm}
+
+
+def iter_valid_segments(stream, fmt: str):
+    """Yield uploaded segments in the whisper results format, validating each as it is read"""
+    for i, segment in enumerate(_READERS[fmt](stream)):
+        if not isinstance(segment, dict):
+            raise LabelImportError(f"Invalid segment format at index {i}: expected object")
+        for field in REQUIRED_FIELDS:
+            if field not in segment:
+                raise LabelImportError(f'Missing required field "{field}" in segment at index {i}')
+        try:
+            start, end = float(segment["start"]), float(segment["end"])
+        except (TypeError, ValueError):
+            raise LabelImportError(f"Invalid start or end time in segment at index {i}")
+        if not (math.isfinite(start) and math.isfinite(end)):
+            raise LabelImportError(f"Start and end time of segment at index {i} must be finite")
+        if end < start:
+            raise LabelImportError(f"Segment at index {i} ends before it starts")
+        yield {"id": i, "start": start, "end": end, "text": segment["text"], "speaker": segment["speaker"]}
+
+
+def import_segments(binary_stream, fmt: str, results_file: str) -> int:
+    """Validate an uploaded label file and write it as a whisper results file in one streaming pass.
+
+    Segments are written as they are validated, to a temporary file that only replaces
+    ``results_file`` once the whole upload is valid. Returns the number of segments.
+    """
+    stream = io.TextIOWrapper(binary_stream, encoding="utf-8", newline="" if fmt == "csv" else None)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(results_file)), suffix=".tmp")
+    count = 0
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write('{"segments":[')
+            for segment in iter_valid_segments(stream, fmt):
+                f.write(("," if count else "") + json.dumps(segment, separators=(",", ":")))
+                count += 1
+            f.write("]}")
+        os.replace(tmp_path, results_file)
+    except UnicodeDecodeError:
+        os.remove(tmp_path)
+        raise LabelImportError("File is not valid UTF-8 text")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        stream.detach()
+    return count
@@ -4,10 +4,14 @@ import torchaudio
 import torch
 from noisereduce.torchgate import TorchGate as TG
 import copy
-from whisper_transcribe import transcribe_with_whisper
+from whisper_transcribe import transcribe_with_whisper, whisper_model_name
+from speaker_identification import load_verification_model
+from artifact_store import ArtifactStore
+from content_hash import hash_file, hash_params
 from thefuzz import fuzz
+from tracing import span, file_size
+from vad import VAD_PARAMS, vad_enabled
 
-from speechbrain.inference.speaker import SpeakerRecognition
 
 class MultiChannelFileProcessor:
     def __init__(self, file_path: str, whisper_results_file: str, denoise: bool = False, denoise_prop: float = 1.0,
@@ -28,18 +32,21 @@ class MultiChannelFileProcessor:
         #     # torchaudio.save(dn_file_path_wav, src=enhanced_speech.cpu(), sample_rate=sr)
         #     self.audio = enhanced_speech.cpu()
         # else:
-        self.audio, self.sr = torchaudio.load(file_path)
+        with span("audio_load", input_bytes=file_size(file_path)) as s:
+            self.audio, self.sr = torchaudio.load(file_path)
+            s.set(channels=self.audio.shape[0], samples=self.audio.shape[-1], sample_rate=self.sr)
         self.channel_transcripts = {}
         self.speaker_info = {}
 
         self.denoise_prop = denoise_prop
 
         self.whisper_results_file = whisper_results_file
-        self.whisper_results = json.load(open(whisper_results_file))
+        with span("json_load", input_bytes=file_size(whisper_results_file)):
+            self.whisper_results = json.load(open(whisper_results_file))
 
-        # Intermediate save checkpoints
-        self.channel_transcripts_path = whisper_results_file.replace(".json", "_channel_transcripts.json")
-        self.channel_speaker_mapping_path = whisper_results_file.replace(".json", "_channel_spkr.json")
+        # Intermediate stage outputs, keyed by input content hash plus stage parameters
+        self.artifacts = ArtifactStore()
+        self.channel_transcript_manifests = {}
         self.extract_channels_from_audio(file_path)
         if "segments" not in self.whisper_results:
             new_results = {"segments": copy.deepcopy(self.whisper_results)}
@@ -49,24 +56,7 @@ class MultiChannelFileProcessor:
         self.channel_speaker_mapping = {}
         self.denoise_prop = denoise_prop
 
-        # Try CUDA first, fallback to CPU if there are issues
-        try:
-            if torch.cuda.is_available():
-                self.verification = SpeakerRecognition.from_hparams(
-                    source="speechbrain/spkrec-ecapa-voxceleb",
-                    savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb",
-                    run_opts={"device":"cuda"}
-                )
-                print("Using CUDA for speaker recognition")
-            else:
-                raise RuntimeError("CUDA not available")
-        except Exception as e:
-            print(f"CUDA initialization failed: {e}. Falling back to CPU.")
-            self.verification = SpeakerRecognition.from_hparams(
-                source="speechbrain/spkrec-ecapa-voxceleb",
-                savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb",
-                run_opts={"device":"cpu"}
-            )
+        self.verification = load_verification_model()
 
         self.verification_threshold = verification_threshold
 
@@ -85,35 +75,57 @@ class MultiChannelFileProcessor:
         return audio_tensor
 
     def extract_channels_from_audio(self, file_path: str):
-        if os.path.exists(self.channel_transcripts_path):
-            self.channel_transcripts = json.load(open(self.channel_transcripts_path))
-        else:
-            for channel in range(len(self.audio)):
-                if not os.path.exists(f"{file_path.replace('.wav', f'_channel_{channel}.wav')}"):
-                    curr_audio = self.audio[channel, :]
-                    curr_audio = self._ensure_audio_format(curr_audio)
-                    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-                    curr_audio = curr_audio.to(device)
-                    # Create TorchGating instance
-                    tg = TG(sr=self.sr, nonstationary=True, prop_decrease=self.denoise_prop).to(device)
-                    # Apply Spectral Gate to noisy speech signal
-                    enhanced_speech = tg(curr_audio)
-                    torchaudio.save(f"{file_path.replace('.wav', f'_channel_{channel}.wav')}", src=enhanced_speech.cpu(), sample_rate=self.sr)
-                    torch.cuda.empty_cache()
-                self.channel_transcripts[channel], _ = transcribe_with_whisper(f"{file_path.replace('.wav', f'_channel_{channel}.wav')}", "data/segments-channel_{channel}", save_json=False)
-            json.dump(self.channel_transcripts, open(self.channel_transcripts_path, "w+"))
-        for channel in self.channel_transcripts:
-            for i in range(len(self.channel_transcripts[channel]["segments"])):
-                curr_seg = self.channel_transcripts[channel]["segments"][i]
-                if "tokens" in curr_seg:
-                    self.channel_transcripts[channel]["segments"][i] = {
-                        "start": curr_seg["start"],
-                        "end": curr_seg["end"],
-                        "text": curr_seg["text"]
-                    }
-                else:
-                    break
-        json.dump(self.channel_transcripts, open(self.channel_transcripts_path, "w+"))
+        audio_hash = hash_file(file_path)
+        for channel in range(len(self.audio)):
+            denoise_manifest = self.denoise_channel(audio_hash, channel)
+            transcript_manifest = self.transcribe_channel(denoise_manifest)
+            self.channel_transcripts[str(channel)] = self.artifacts.load_json(transcript_manifest, "transcript")
+            self.channel_transcript_manifests[str(channel)] = transcript_manifest
+
+    def denoise_channel(self, audio_hash: str, channel: int):
+        stage = "denoise_channel"
+        inputs = {"audio": audio_hash}
+        params = {"channel": channel, "denoise_prop": self.denoise_prop}
+        key = self.artifacts.key(stage, inputs, params)
+        manifest = self.artifacts.lookup(stage, key)
+        if manifest is not None:
+            return manifest
+
+        curr_audio = self.audio[channel, :]
+        curr_audio = self._ensure_audio_format(curr_audio)
+        device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        curr_audio = curr_audio.to(device)
+        with span("denoise", channel=channel, samples=curr_audio.shape[-1], denoise_prop=self.denoise_prop):
+            # Create TorchGating instance
+            tg = TG(sr=self.sr, nonstationary=True, prop_decrease=self.denoise_prop).to(device)
+            # Apply Spectral Gate to noisy speech signal
+            enhanced_speech = tg(curr_audio)
+        with span("audio_save", channel=channel, samples=enhanced_speech.shape[-1]):
+            torchaudio.save(self.artifacts.output_path(stage, key, "audio.wav"), src=enhanced_speech.cpu(), sample_rate=self.sr)
+        torch.cuda.empty_cache()
+        return self.artifacts.commit(stage, key, inputs, params, {"audio": "audio.wav"})
+
+    def transcribe_channel(self, denoise_manifest: dict):
+        stage = "transcribe_channel"
+        inputs = {"audio": self.artifacts.output_hash(denoise_manifest, "audio")}
+        # Whisper only hears the detected speech when VAD is on, so its settings shape the transcript
+        params = {"model": whisper_model_name(), "vad": VAD_PARAMS if vad_enabled() else None}
+        key = self.artifacts.key(stage, inputs, params)
+        manifest = self.artifacts.lookup(stage, key)
+        if manifest is not None:
+            return manifest
+
+        with span("transcribe_channel", channel=denoise_manifest["params"]["channel"]):
+            transcript, _ = transcribe_with_whisper(self.artifacts.path(denoise_manifest, "audio"),
+                                                    self.artifacts.stage_dir(stage, key), save_json=False)
+        # Only the segment timing and text are used downstream
+        transcript = {
+            "text": transcript["text"],
+            "segments": [{"start": seg["start"], "end": seg["end"], "text": seg["text"]} for seg in transcript["segments"]]
+        }
+        self.artifacts.save_json(stage, key, "transcript.json", transcript)
+        return self.artifacts.commit(stage, key, inputs, params, {"transcript": "transcript.json"},
+                                     parents=[f"{denoise_manifest['stage']}/{denoise_manifest['key']}"])
 
     def extract_speaker_from_whisper(self):
         for s in self.whisper_results["segments"]:
@@ -124,18 +136,27 @@ class MultiChannelFileProcessor:
                     self.speaker_info[s["speaker"]]["reference_segments"].append(s["text"])
 
     def extract_speaker_from_channel_transcripts(self):
-        if os.path.exists(self.channel_speaker_mapping_path):
-            self.channel_speaker_mapping = json.load(open(self.channel_speaker_mapping_path))
+        stage = "channel_speaker_mapping"
+        references = {speaker: self.speaker_info[speaker]["reference_segments"] for speaker in self.speaker_info}
+        transcript_manifests = self.channel_transcript_manifests
+        inputs = {f"transcript_{channel}": self.artifacts.output_hash(transcript_manifests[channel], "transcript")
+                  for channel in transcript_manifests}
+        inputs["references"] = hash_params(references)
+        params = {"match_threshold": 80}
+        key = self.artifacts.key(stage, inputs, params)
+        manifest = self.artifacts.lookup(stage, key)
+        if manifest is not None:
+            self.channel_speaker_mapping = self.artifacts.load_json(manifest, "mapping")
         else:
             speaker_channel_mapping = {}
             for speaker in self.speaker_info:
                 speaker_channel_mapping[speaker] = []
                 all_ref_segs = " ".join(self.speaker_info[speaker]["reference_segments"])
-                best_ratio = None, 0
+                best_ratio = 0
                 for channel in self.channel_transcripts:
                     match_ratio = fuzz.token_set_ratio(all_ref_segs, self.channel_transcripts[channel]["text"])
                     print(match_ratio)
-                    if match_ratio > 80 and match_ratio >= best_ratio:
+                    if match_ratio > params["match_threshold"] and match_ratio >= best_ratio:
                         best_ratio = match_ratio
                         speaker_channel_mapping[speaker].append(channel)
 
@@ -153,7 +174,9 @@ class MultiChannelFileProcessor:
                     all_channel_texts = sorted(all_channel_texts, key=lambda x: x[1])
                     if len(all_channel_texts):
                         channel_speaker_mapping[all_channel_texts[0][0]] = speaker
-            json.dump(channel_speaker_mapping, open(self.channel_speaker_mapping_path, "w+"))
+            self.artifacts.save_json(stage, key, "mapping.json", channel_speaker_mapping)
+            self.artifacts.commit(stage, key, inputs, params, {"mapping": "mapping.json"},
+                                  parents=[f"{m['stage']}/{m['key']}" for m in transcript_manifests.values()])
             # If more than one channel is associated with the same speaker, we need to determine the best channel
             self.channel_speaker_mapping = channel_speaker_mapping
         if len(self.channel_speaker_mapping) != len(self.speaker_info):
@@ -192,7 +215,8 @@ class MultiChannelFileProcessor:
 
 
     def process(self, align_video_audio=False):
-        self.extract_speaker_from_channel_transcripts()
+        with span("channel_speaker_mapping", channels=len(self.channel_transcripts), speakers=len(self.speaker_info)):
+            self.extract_speaker_from_channel_transcripts()
         if align_video_audio:
             self.anchor_audio_and_video()
 
@@ -205,7 +229,8 @@ class MultiChannelFileProcessor:
                     final_speaker_results["segments"].append(seg)
         final_speaker_results["segments"] = sorted(final_speaker_results["segments"], key=lambda x: x["start"])
         self.speaker_results = final_speaker_results
-        json.dump(final_speaker_results, open(self.whisper_results_file.replace(".json", "_speaker_results.json"), "w+"))
+        with span("json_dump", segments=len(final_speaker_results["segments"])):
+            json.dump(final_speaker_results, open(self.whisper_results_file.replace(".json", "_speaker_results.json"), "w+"))
 
 
 
@@ -1,55 +1,73 @@
 #!/usr/bin/env python3
 """
 Script to plot diarization error rates and speaker classification F-1 scores
-from the results folder.
+from the results store (legacy all_results.json files in the results folder are
+imported into it on first use).
 """
 
-import json
 import os
-from pathlib import Path
 import matplotlib.pyplot as plt
-import numpy as np
 import seaborn as sns
 import pandas as pd
-import glob
+from argparse import ArgumentParser
+from results_store import ResultsStore
+
+def load_curves(store: ResultsStore, experiment: str, param: str, videos, labels: dict, exclude=(), **config_filters):
+    """{"DER": {label: [(param, value), ...]}, "F-1": {...}} for one experiment.
+
+    One experiment can hold several sweeps (an orchestrator manifest usually does), so
+    only rows whose configuration sets ``param`` and none of ``exclude`` are used.
+    Pipelines other than the single-channel one get a curve of their own.
+    """
+    curves = {"DER": {}, "F-1": {}}
+    rows = store.query_metrics(metrics=["diarization", "speaker_classification_f1.f1"],
+                               experiment=experiment, videos=videos, param=param, **config_filters)
+    for row in rows:
+        config = row["config"]
+        if param not in config or any(config.get(name) is not None for name in exclude):
+            continue
+        name = "DER" if row["metric"] == "diarization" else "F-1"
+        label = labels.get(row["video"], row["video"])
+        if config.get("pipeline", "single") != "single":
+            label = f"{label} ({config['pipeline']})"
+        curves[name].setdefault(label, []).append((row[param], row["value"]))
+    return curves
+
 
 if __name__ == "__main__":
-    all_speaker_len_res = {"DER": {}, "F-1": {}}
-    all_denoise_res = {"DER": {}, "F-1": {}}
+    parser = ArgumentParser()
+    parser.add_argument("--results_db", type=str, default="results/results.sqlite")
+    parser.add_argument("--videos", type=str, nargs="+", default=None,
+                        help="Videos to plot; all videos of --experiment, or the three study videos without it")
+    parser.add_argument("--scorer", type=str, default=None, help="Only plot results of this scorer")
+    parser.add_argument("--experiment", type=str, default=None,
+                        help="Plot both sweeps from this experiment, e.g. an evaluate_videos manifest name, "
+                             "instead of the legacy denoise and speaker_duration experiments")
+    args = parser.parse_args()
+
     label_dict = {
         "original_video": "Single-channel #1",
         "neo_cam_video": "Single-channel #2",
         "nrp_episodes_video": "Single-channel #3"
     }
-    for vname in ["original_video", "neo_cam_video", "nrp_episodes_video"]:
-        speaker_len_res = json.load(open(f"results/{vname}/all_results_diff_speaker_lengths.json"))
-        denoise_res = json.load(open(f"results/{vname}/all_results.json"))
-
-        all_denoise_der = []
-        all_denoise_f1 = []
-        for k in denoise_res:
-            all_denoise_der.append((float(k), denoise_res[k]["diarization"]))
-            all_denoise_f1.append((float(k), denoise_res[k]["speaker_classification_f1"]["f1"]))
-
-        all_denoise_res["DER"].update({
-            label_dict[vname]: all_denoise_der
-        })
-        all_denoise_res["F-1"].update({
-            label_dict[vname]: all_denoise_f1
-        })
-
-        all_speaker_der = []
-        all_speaker_f1 = []
-        for k in speaker_len_res:
-            all_speaker_der.append((float(k), speaker_len_res[k]["diarization"]))
-            all_speaker_f1.append((float(k), speaker_len_res[k]["speaker_classification_f1"]["f1"]))
+    store = ResultsStore(args.results_db)
+    videos = args.videos or (None if args.experiment else list(label_dict))
+    # Results written before the results store existed are imported once
+    for vname in videos or []:
+        legacy = [
+            (f"results/{vname}/all_results.json", "denoise", "denoise_prop", {}),
+            (f"results/{vname}/all_results_diff_speaker_lengths.json", "speaker_duration", "speaker_duration",
+             {"denoise_prop": 0.2}),
+        ]
+        for path, experiment, param, base_config in legacy:
+            if os.path.exists(path) and not store.has_metrics(vname, experiment):
+                store.import_legacy_results(path, vname, experiment, param, base_config)
 
-        all_speaker_len_res["DER"].update({
-            label_dict[vname]: all_speaker_der
-        })
-        all_speaker_len_res["F-1"].update({
-            label_dict[vname]: all_speaker_f1
-        })
+    filters = {"scorer": args.scorer} if args.scorer else {}
+    all_denoise_res = load_curves(store, args.experiment or "denoise", "denoise_prop", videos, label_dict,
+                                  exclude=("speaker_duration",), **filters)
+    all_speaker_len_res = load_curves(store, args.experiment or "speaker_duration", "speaker_duration", videos,
+                                      label_dict, **filters)
 
     # Set seaborn style
     sns.set_style("whitegrid")
@@ -0,0 +1,305 @@
+"""
+Warm-ahead pipeline: prepare a video before anyone asks for it.
+
+With PREFETCH=1 the apps hand every loaded video to the prefetcher, which probes it,
+extracts the audio, transcribes it, embeds the segments and builds the waveform overview
+at low priority. The ingest service (see ingest.py) runs the same stages for new uploads.
+Each stage records the signatures of its inputs and outputs in ``prefetch.json`` in the
+video's segments directory and is skipped while its inputs are unchanged and its outputs
+exist, so a later click on "Transcribe" finds the transcript ready and a preempted run
+resumes where it stopped. An existing transcript is never replaced.
+
+Interactive jobs always win: between stages the pipeline checks whether one is waiting
+and gives way if so. A stage that is already running finishes first.
+"""
+
+import os
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from contextlib import contextmanager
+from inference_queue import BACKGROUND, Preempted, patch_torchaudio, run_inference_job
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_FILE = "prefetch.json"
+# Taken around every read-modify-write of prefetch.json, and around running the stages of a video
+MANIFEST_LOCK = ".prefetch.lock"
+RUN_LOCK = ".prefetch.run.lock"
+WAVEFORM_FILE = "waveform.npz"
+WAVEFORM_PEAKS_PER_SECOND = 20
+
+
+def prefetch_enabled() -> bool:
+    """Whether loaded videos are prepared in the background (PREFETCH=1)"""
+    return os.environ.get("PREFETCH", "").lower() in ("1", "true", "yes")
+
+
+def segments_dir_for(media_path: str) -> str:
+    """Directory holding the transcript and derived data of a video, named after its folder"""
+    return f'data/segments-{media_path.split("/")[-2]}'
+
+
+def _signature(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _signatures(paths):
+    return {path: _signature(path) for path in paths}
+
+
+def _fresh(record) -> bool:
+    """Whether the files a stage read are unchanged since it ran and the files it wrote still exist.
+
+    Outputs may change afterwards without making the stage stale: the transcript is
+    edited by annotators, and running Whisper again would throw their edits away.
+    """
+    if not record:
+        return False
+    try:
+        return (all(_signature(path) == signature for path, signature in record["inputs"].items())
+                and all(os.path.exists(path) for path in record["outputs"]))
+    except FileNotFoundError:
+        return False
+
+
+def load_manifest(media_path: str, segments_dir: str) -> dict:
+    """Prefetch record of a video, or an empty one if it was never prefetched or the video changed"""
+    media = [os.path.abspath(media_path)] + _signature(media_path)
+    try:
+        with open(os.path.join(segments_dir, PREFETCH_FILE)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = None
+    if not manifest or manifest.get("media") != media:
+        return {"media": media, "stages": {}}
+    return manifest
+
+
+def _save_manifest(segments_dir: str, manifest: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=segments_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(segments_dir, PREFETCH_FILE))
+
+
+@contextmanager
+def _file_lock(segments_dir: str, name: str):
+    """Exclusive lock shared by the app, its prefetch thread, inference processes and ingest workers"""
+    os.makedirs(segments_dir, exist_ok=True)
+    with open(os.path.join(segments_dir, name), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _update_manifest(media_path: str, segments_dir: str, stage: str, record: dict) -> dict:
+    """Store the record of one stage without losing records other processes wrote meanwhile"""
+    with _file_lock(segments_dir, MANIFEST_LOCK):
+        manifest = load_manifest(media_path, segments_dir)
+        manifest["stages"][stage] = record
+        _save_manifest(segments_dir, manifest)
+    return manifest
+
+
+def prefetched_transcript(media_path: str, segments_dir: str):
+    """{whisper_results_file, audio_path} of a still valid prefetched transcript, like a transcribe job returns, or None"""
+    if not os.path.exists(media_path):
+        return None
+    record = load_manifest(media_path, segments_dir)["stages"].get("transcribe")
+    return record["result"] if _fresh(record) else None
+
+
+def _transcript_files(result: dict):
+    from transcript_store import words_path_for
+    files = [result["whisper_results_file"], words_path_for(result["whisper_results_file"])]
+    return [path for path in files if os.path.exists(path)]
+
+
+def record_transcript(media_path: str, segments_dir: str, result: dict):
+    """Record a transcript made by an interactive request, so the prefetcher does not transcribe again"""
+    _update_manifest(media_path, segments_dir, "transcribe", {"inputs": _signatures([result["audio_path"]]),
+                                                             "outputs": _signatures(_transcript_files(result)),
+                                                             "result": result})
+
+
+def _probe(media_path: str, segments_dir: str, state: dict):
+    # Unreadable or truncated uploads fail here, before any heavy stage runs
+    try:
+        probe = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", media_path],
+                               check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise ValueError(f"ffprobe could not read {media_path}: {e.stderr.strip()}")
+    duration = float(json.loads(probe.stdout).get("format", {}).get("duration", 0.0))
+    if duration <= 0:
+        raise ValueError(f"{media_path} has no duration")
+    return [media_path], [], {"duration": duration}
+
+
+def _extract(media_path: str, segments_dir: str, state: dict):
+    from whisper_transcribe import extract_audio
+    audio_path = extract_audio(media_path)
+    return [media_path], [audio_path], {"audio_path": audio_path}
+
+
+def _transcribe(media_path: str, segments_dir: str, state: dict):
+    from transcript_store import words_path_for
+    results_file = os.path.join(segments_dir, "whisper_results.json")
+    if not os.path.exists(results_file):
+        # Transcribe aside and move the files into place only if nobody produced a transcript
+        # meanwhile, e.g. an interactive request that the user has started editing
+        with tempfile.TemporaryDirectory(dir=segments_dir, prefix=".prefetch-") as tmp_dir:
+            tmp_result = run_inference_job("transcribe", {"media_path": media_path, "segments_dir": tmp_dir})
+            if not os.path.exists(results_file):
+                if os.path.exists(words_path_for(tmp_result["whisper_results_file"])):
+                    os.replace(words_path_for(tmp_result["whisper_results_file"]), words_path_for(results_file))
+                os.replace(tmp_result["whisper_results_file"], results_file)
+    else:
+        logger.info(f"Keeping the existing transcript {results_file}")
+    result = {"whisper_results_file": results_file, "audio_path": state["audio_path"]}
+    return [state["audio_path"]], _transcript_files(result), result
+
+
+def _embed(media_path: str, segments_dir: str, state: dict):
+    patch_torchaudio()
+    from sweep import SweepRunner, load_segments
+    # Cached in the artifact store under the same key speaker sweeps look up
+    embeddings = SweepRunner(state["audio_path"], state["whisper_results_file"]).segment_embeddings(
+        load_segments(state["whisper_results_file"]))
+    return [state["audio_path"], state["whisper_results_file"]], [], {"segments": len(embeddings)}
+
+
+def _waveform(media_path: str, segments_dir: str, state: dict):
+    waveform_file = build_waveform(state["audio_path"], os.path.join(segments_dir, WAVEFORM_FILE))
+    return [state["audio_path"]], [waveform_file], {"waveform_file": waveform_file}
+
+
+# Each stage returns (files it read, files it wrote, result); ``state`` holds the results of the earlier stages
+STAGES = [("probe", _probe), ("extract", _extract), ("transcribe", _transcribe), ("embed", _embed),
+          ("waveform", _waveform)]
+STAGE_NAMES = [name for name, _ in STAGES]
+
+
+def _run_stages(media_path: str, segments_dir: str, names, should_yield=None) -> dict:
+    # One pipeline per video at a time; whoever waited finds the stages done and skips them
+    with _file_lock(segments_dir, RUN_LOCK):
+        manifest = load_manifest(media_path, segments_dir)
+        state = {}
+        for name, stage in STAGES:
+            if name not in names:
+                continue
+            record = manifest["stages"].get(name)
+            if _fresh(record):
+                state.update(record["result"])
+                continue
+            if should_yield is not None and should_yield():
+                raise Preempted(name)
+            logger.info(f"Prefetch {name} for {media_path}")
+            inputs, outputs, result = stage(media_path, segments_dir, state)
+            state.update(result)
+            manifest = _update_manifest(media_path, segments_dir, name, {
+                "inputs": _signatures(inputs), "outputs": _signatures(outputs), "result": result})
+    return {name: record["result"] for name, record in manifest["stages"].items()}
+
+
+def run_prefetch(media_path: str, segments_dir: str, should_yield=None) -> dict:
+    """Run the stages that are not done yet; raise Preempted before a stage when ``should_yield()`` is true"""
+    return _run_stages(media_path, segments_dir, STAGE_NAMES, should_yield)
+
+
+def run_stage(media_path: str, segments_dir: str, name: str, should_yield=None) -> dict:
+    """Run one stage unless it is done, along with any earlier stage that is not; returns its result"""
+    names = STAGE_NAMES[:STAGE_NAMES.index(name) + 1]
+    return _run_stages(media_path, segments_dir, names, should_yield)[name]
+
+
+def build_waveform(audio_path: str, waveform_file: str) -> str:
+    """Write the min/max envelope of an audio file unless an up-to-date one exists; returns its path"""
+    import numpy as np
+    from audio_mixing import waveform_peaks
+    if os.path.exists(waveform_file) and os.path.getmtime(waveform_file) >= os.path.getmtime(audio_path):
+        return waveform_file
+    mins, maxs = waveform_peaks(audio_path, WAVEFORM_PEAKS_PER_SECOND)
+    tmp_path = f"{waveform_file}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez(tmp_path, min=mins, max=maxs, peaks_per_second=WAVEFORM_PEAKS_PER_SECOND)
+    os.replace(tmp_path, waveform_file)
+    return waveform_file
+
+
+def load_waveform(waveform_file: str) -> dict:
+    import numpy as np
+    with np.load(waveform_file) as data:
+        return {"peaks_per_second": int(data["peaks_per_second"]),
+                "min": np.round(data["min"], 4).tolist(), "max": np.round(data["max"], 4).tolist()}
+
+
+class Prefetcher:
+    """Queues videos for the warm-ahead pipeline at low priority.
+
+    With an inference queue the pipeline runs as BACKGROUND jobs in the inference
+    processes. Without one it runs in a background thread of this process, which starts
+    a stage only while no interactive job (see ``interactive``) is running.
+    """
+
+    def __init__(self, queue=None, enabled: bool = True):
+        self.queue = queue
+        self.enabled = enabled
+        self._pending = OrderedDict()
+        self._interactive = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @contextmanager
+    def interactive(self):
+        """Mark an interactive job as running, so the background pipeline gives way at its next stage"""
+        with self._condition:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._interactive -= 1
+                self._condition.notify_all()
+
+    def submit(self, media_path: str, segments_dir: str = None):
+        """Prepare a video in the background; the most recently submitted video goes first"""
+        if not self.enabled:
+            return
+        segments_dir = segments_dir or segments_dir_for(media_path)
+        if self.queue is not None:
+            self.queue.submit("prefetch", {"media_path": media_path, "segments_dir": segments_dir}, priority=BACKGROUND)
+            return
+        with self._condition:
+            self._pending[media_path] = segments_dir
+            self._pending.move_to_end(media_path, last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def _should_yield(self) -> bool:
+        return self._interactive > 0
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending or self._interactive:
+                    self._condition.wait()
+                media_path, segments_dir = self._pending.popitem(last=False)
+            try:
+                run_prefetch(media_path, segments_dir, self._should_yield)
+                logger.info(f"Prefetched {media_path}")
+            except Preempted:
+                with self._condition:
+                    # Resume it first once the interactive work is done; its finished stages are kept
+                    self._pending[media_path] = segments_dir
+                    self._pending.move_to_end(media_path, last=False)
+            except Exception:
+                logger.error(f"Prefetch of {media_path} failed", exc_info=True)
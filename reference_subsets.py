@@ -0,0 +1,116 @@
+import numpy as np
+from frame_scoring import FrameScorer
+
+
+def sample_reference_masks(segments, speaker_duration: float, seeds: int, rng: np.random.Generator,
+                           usable: np.ndarray = None) -> np.ndarray:
+    """(seeds, segments) boolean masks of randomly drawn reference segments.
+
+    Per speaker this follows ``rewrite_speakers``: candidates are the speaker's segments
+    shorter than the budget (or shorter than budget + 1 s if there are none), and
+    segments are taken until their total duration passes ``speaker_duration`` seconds.
+    Where ``rewrite_speakers`` always takes the longest candidates first, each seed here
+    draws them in a random order.
+    """
+    durations = np.array([s["end"] - s["start"] for s in segments])
+    speakers = np.array([s.get("speaker", "") for s in segments])
+    usable = np.ones(len(segments), dtype=bool) if usable is None else usable
+    masks = np.zeros((seeds, len(segments)), dtype=bool)
+    for speaker in sorted(set(speakers) - {""}):
+        own = (speakers == speaker) & usable
+        candidates = np.flatnonzero(own & (durations < speaker_duration))
+        if len(candidates) == 0:
+            candidates = np.flatnonzero(own & (durations < speaker_duration + 1))
+        if len(candidates) == 0:
+            continue
+        # One random order of the candidates per seed
+        order = candidates[rng.random((seeds, len(candidates))).argsort(axis=1)]
+        taken_before = np.cumsum(durations[order], axis=1) - durations[order]
+        rows = np.repeat(np.arange(seeds)[:, None], len(candidates), axis=1)
+        keep = taken_before <= speaker_duration
+        masks[rows[keep], order[keep]] = True
+    return masks
+
+
+def _summary(values: np.ndarray) -> dict:
+    """Mean with a normal-approximation 95% confidence interval and the 5-95% spread over seeds"""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {"mean": None, "std": None, "ci_low": None, "ci_high": None, "p05": None, "p95": None, "n": 0}
+    mean, std = float(values.mean()), float(values.std(ddof=1)) if len(values) > 1 else 0.0
+    half_width = 1.96 * std / np.sqrt(len(values))
+    return {
+        "mean": mean,
+        "std": std,
+        "ci_low": float(mean - half_width),
+        "ci_high": float(mean + half_width),
+        "p05": float(np.percentile(values, 5)),
+        "p95": float(np.percentile(values, 95)),
+        "n": int(len(values)),
+    }
+
+
+class ReferenceSubsetEvaluator:
+    """Scores many reference label budgets and random seeds from one set of segment embeddings.
+
+    Each segment is embedded once (see ``SweepRunner.segment_embeddings``). For each draw
+    of reference segments, every speaker's centroid is the mean of their reference
+    segments' normalized embeddings, and the remaining segments get the best-scoring
+    speaker above the threshold. Centroids approximate FileProcessor, which embeds the
+    speaker's concatenated reference audio instead, so absolute numbers can differ
+    slightly from full pipeline runs while trends across budgets are preserved.
+    """
+
+    def __init__(self, ground_truth_segments, embeddings: np.ndarray, verification_threshold: float = 0.0,
+                 resolution: float = 0.01):
+        self.segments = ground_truth_segments
+        self.usable = ~np.isnan(embeddings).any(axis=tuple(range(1, embeddings.ndim)))
+        normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=-1, keepdims=True), 1e-6)
+        self.embeddings = np.nan_to_num(normalized)
+        self.speakers = sorted({s["speaker"] for s in ground_truth_segments if s.get("speaker")})
+        speaker_index = {speaker: k for k, speaker in enumerate(self.speakers)}
+        self.labels = np.array([speaker_index.get(s.get("speaker"), -1) for s in ground_truth_segments])
+        self.one_hot = np.zeros((len(ground_truth_segments), len(self.speakers)), dtype=np.float32)
+        known = self.labels >= 0
+        self.one_hot[np.flatnonzero(known), self.labels[known]] = 1
+        self.verification_threshold = verification_threshold
+        self.scorer = FrameScorer([s for s in ground_truth_segments if s.get("speaker")], resolution)
+
+    def predict(self, masks: np.ndarray) -> np.ndarray:
+        """(seeds, segments) predicted speaker index for each mask, -1 where unlabeled"""
+        masks = masks & self.usable
+        members = masks[:, :, None] * self.one_hot[None]  # (seeds, segments, speakers)
+        counts = members.sum(axis=1)  # (seeds, speakers)
+        centroids = np.einsum("sik,icd->skcd", members, self.embeddings)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=-1, keepdims=True), 1e-6)
+        # Cosine score per channel, averaged over channels like FileProcessor
+        scores = np.einsum("icd,skcd->sikc", self.embeddings, centroids).mean(axis=-1)
+        scores[np.broadcast_to(counts[:, None, :] == 0, scores.shape)] = -np.inf
+        best = scores.argmax(axis=2)
+        best_score = np.take_along_axis(scores, best[:, :, None], axis=2)[:, :, 0]
+        predicted = np.where((best_score > self.verification_threshold) & self.usable, best, -1)
+        # Reference segments keep their own label, as in FileProcessor
+        return np.where(masks, self.labels[None], predicted)
+
+    def evaluate(self, speaker_durations, seeds: int = 100, seed: int = 0) -> dict:
+        """Learning curve: summary statistics of DER and F1 for each reference budget"""
+        rng = np.random.default_rng(seed)
+        curve = {}
+        for speaker_duration in speaker_durations:
+            masks = sample_reference_masks(self.segments, speaker_duration, seeds, rng, self.usable)
+            predicted = self.predict(masks)
+            der = np.empty(seeds)
+            f1 = np.empty(seeds)
+            for i in range(seeds):
+                hypothesis = [
+                    {"start": s["start"], "end": s["end"], "speaker": self.speakers[k]}
+                    for s, k in zip(self.segments, predicted[i]) if k >= 0
+                ]
+                der[i] = self.scorer.diarization(hypothesis)["diarization error rate"]
+                f1[i] = self.scorer.speaker_classification(hypothesis)["f1"]
+            curve[speaker_duration] = {
+                "diarization": _summary(der),
+                "speaker_classification_f1": _summary(f1),
+                "reference_seconds": _summary((masks * np.array([s["end"] - s["start"] for s in self.segments])).sum(axis=1)),
+            }
+        return curve
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import resource
+import threading
+from datetime import datetime
+from content_hash import hash_params
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("pending", "running", "done", "failed")
+
+
+def config_key(config: dict) -> str:
+    """Stable identifier of an evaluation configuration, independent of key order"""
+    return hash_params(config)
+
+
+def usage_snapshot():
+    """Wall and CPU clock of this process, to be passed to ``usage_since``"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return time.time(), usage.ru_utime + usage.ru_stime
+
+
+def usage_since(snapshot) -> dict:
+    """Wall/CPU seconds since a snapshot and the peak RSS of this process so far"""
+    wall, cpu = snapshot
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "wall_seconds": time.time() - wall,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime - cpu,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    }
+
+
+def flatten_metrics(result, prefix: str = "") -> dict:
+    """Numeric leaves of a nested evaluation result, keyed by dotted path.
+
+    ``{"diarization": 0.3, "speaker_classification_f1": {"f1": 0.8}}`` becomes
+    ``{"diarization": 0.3, "speaker_classification_f1.f1": 0.8}``.
+    """
+    if isinstance(result, bool):
+        return {}
+    if isinstance(result, (int, float)):
+        return {prefix: float(result)}
+    metrics = {}
+    if isinstance(result, dict):
+        for name, value in result.items():
+            metrics.update(flatten_metrics(value, f"{prefix}.{name}" if prefix else str(name)))
+    return metrics
+
+
+class ResultsStore:
+    """Durable store of evaluation results.
+
+    ``jobs`` has one row per (video, configuration) job. Every result is committed as
+    soon as its job finishes, so an interrupted run keeps everything it completed and a
+    restart only has to schedule what is missing.
+
+    ``metrics`` holds the same results in long format, one row per (video, experiment,
+    configuration, metric) with the timing and resource usage of the run that produced
+    it, so results of many runs can be filtered and aggregated with a single query.
+    """
+
+    def __init__(self, db_path: str = "data/results.sqlite"):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    video TEXT NOT NULL,
+                    config_key TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    PRIMARY KEY (video, config_key)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metrics (
+                    video TEXT NOT NULL,
+                    experiment TEXT NOT NULL,
+                    config_key TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    value REAL,
+                    wall_seconds REAL,
+                    cpu_seconds REAL,
+                    peak_rss_mb REAL,
+                    recorded_at TEXT,
+                    PRIMARY KEY (video, experiment, config_key, metric)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS metrics_by_metric ON metrics (metric, experiment)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def status(self, video: str, config: dict):
+        """Return (status, attempts) of a job, or (None, 0) if it was never scheduled"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, attempts FROM jobs WHERE video = ? AND config_key = ?",
+                               (video, config_key(config))).fetchone()
+        return row if row is not None else (None, 0)
+
+    def mark_running(self, video: str, config: dict):
+        with self._lock, self._connect() as conn:
+            conn.execute("""
+                INSERT INTO jobs (video, config_key, config, status, attempts, started_at)
+                VALUES (?, ?, ?, 'running', 1, ?)
+                ON CONFLICT (video, config_key) DO UPDATE SET
+                    status = 'running', attempts = attempts + 1, error = NULL, started_at = excluded.started_at
+            """, (video, config_key(config), json.dumps(config, sort_keys=True), datetime.now().isoformat()))
+
+    def record_result(self, video: str, config: dict, result: dict, usage: dict = None, experiment: str = "default"):
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE video = ? AND config_key = ?",
+                         (json.dumps(result), datetime.now().isoformat(), video, config_key(config)))
+            self._insert_metrics(conn, video, experiment, config, result, usage)
+        logger.info(f"Stored result for {video} {config}")
+
+    def append_metrics(self, video: str, experiment: str, config: dict, result: dict, usage: dict = None):
+        """Add the metrics of one evaluation, replacing earlier rows of the same configuration"""
+        with self._lock, self._connect() as conn:
+            self._insert_metrics(conn, video, experiment, config, result, usage)
+
+    @staticmethod
+    def _insert_metrics(conn, video, experiment, config, result, usage):
+        usage = usage or {}
+        key, config_json, now = config_key(config), json.dumps(config, sort_keys=True), datetime.now().isoformat()
+        conn.executemany("""
+            INSERT OR REPLACE INTO metrics
+                (video, experiment, config_key, config, metric, value, wall_seconds, cpu_seconds, peak_rss_mb, recorded_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (video, experiment, key, config_json, metric, value,
+             usage.get("wall_seconds"), usage.get("cpu_seconds"), usage.get("peak_rss_mb"), now)
+            for metric, value in flatten_metrics(result).items()
+        ])
+
+    def record_failure(self, video: str, config: dict, error: str):
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE video = ? AND config_key = ?",
+                         (error, datetime.now().isoformat(), video, config_key(config)))
+        logger.error(f"Job {video} {config} failed: {error}")
+
+    def results(self, video: str = None):
+        """Completed jobs as dicts with video, config and result"""
+        sql = "SELECT video, config, result FROM jobs WHERE status = 'done'"
+        params = []
+        if video:
+            sql += " AND video = ?"
+            params.append(video)
+        with self._connect() as conn:
+            return [
+                {"video": v, "config": json.loads(config), "result": json.loads(result)}
+                for v, config, result in conn.execute(sql + " ORDER BY video, finished_at", params)
+            ]
+
+    def query_metrics(self, metrics=None, experiment: str = None, videos=None, param: str = None, **config_filters):
+        """Metric rows matching the filters, as dicts.
+
+        ``param`` adds that configuration value to each row under its own name (e.g.
+        ``param="denoise_prop"`` for plotting against it); ``config_filters`` keep only
+        rows whose configuration has the given values.
+        """
+        sql = "SELECT video, experiment, config, metric, value, wall_seconds, cpu_seconds, peak_rss_mb FROM metrics WHERE 1 = 1"
+        params = []
+        if isinstance(metrics, str):
+            metrics = [metrics]
+        for column, values in (("metric", metrics), ("video", videos)):
+            if values:
+                sql += f" AND {column} IN ({', '.join('?' * len(values))})"
+                params.extend(values)
+        if experiment:
+            sql += " AND experiment = ?"
+            params.append(experiment)
+        for name, value in config_filters.items():
+            sql += " AND json_extract(config, ?) = ?"
+            params.extend([f"$.{name}", value])
+        rows = []
+        with self._connect() as conn:
+            for video, exp, config, metric, value, wall, cpu, rss in conn.execute(sql + " ORDER BY video, metric", params):
+                config = json.loads(config)
+                row = {"video": video, "experiment": exp, "config": config, "metric": metric, "value": value,
+                       "wall_seconds": wall, "cpu_seconds": cpu, "peak_rss_mb": rss}
+                if param:
+                    row[param] = config.get(param)
+                rows.append(row)
+        return rows
+
+    def has_metrics(self, video: str, experiment: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM metrics WHERE video = ? AND experiment = ? LIMIT 1",
+                                (video, experiment)).fetchone() is not None
+
+    def import_legacy_results(self, path: str, video: str, experiment: str, param: str, base_config: dict = None):
+        """Load an all_results.json written by the auto_run scripts, keyed by stringified parameter values"""
+        with open(path) as f:
+            all_results = json.load(f)
+        for value, result in all_results.items():
+            config = dict(base_config or {}, **{param: float(value)})
+            self.append_metrics(video, experiment, config, result)
+        logger.info(f"Imported {len(all_results)} results of {video} from {path}")
+        return len(all_results)
+
+    def export_all_results(self, video: str, sweep_param: str, output_path: str):
+        """Write the legacy all_results.json of one video, keyed by the swept parameter"""
+        all_results = {}
+        for row in self.results(video):
+            if sweep_param in row["config"]:
+                all_results[row["config"][sweep_param] or 0] = row["result"]
+        with open(output_path, "w") as f:
+            json.dump(all_results, f)
+        return all_results
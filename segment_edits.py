@@ -0,0 +1,165 @@
+import os
+import copy
+import math
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from fast_json import dumps
+
+EDIT_OPERATIONS = ("assign", "edit_text", "delete", "merge", "split")
+
+
+class SegmentEditError(ValueError):
+    """Raised when an edit operation cannot be applied; no edits of the batch are kept.
+
+    ``operation`` is the index of the offending operation in the batch.
+    """
+
+    def __init__(self, message: str, operation: int = None):
+        super().__init__(message)
+        self.operation = operation
+
+
+def _split_text(text: str, fraction: float):
+    """Split text at the word boundary closest to the given fraction of its length"""
+    target = int(len(text) * fraction)
+    boundaries = [i for i, ch in enumerate(text) if ch == " " and 0 < i < len(text)]
+    if not boundaries:
+        return text, ""
+    cut = min(boundaries, key=lambda i: abs(i - target))
+    return text[:cut], text[cut:]
+
+
+def apply_operations(results: dict, operations: list) -> dict:
+    """Apply a batch of segment edits in one pass and return the edited copy.
+
+    Supported operations (all address segments by ``segment_id``):
+      - ``{"op": "assign", "segment_id", "speaker"}``
+      - ``{"op": "edit_text", "segment_id", "text"}``
+      - ``{"op": "delete", "segment_id"}``
+      - ``{"op": "merge", "segment_ids": [...]}``, merged into the earliest segment
+      - ``{"op": "split", "segment_id", "time", "text_before"?, "text_after"?}``
+
+    Segment ids stay stable; segments created by a split get fresh ids. The input is
+    never modified, so a failing operation leaves the stored results untouched.
+    """
+    results = copy.deepcopy(results)
+    segments = results.get("segments", [])
+    by_id = {seg.get("id"): seg for seg in segments}
+    # Segments created by splits, placed right after the segment they came from
+    inserted_after = {}
+    deleted = set()
+    next_id = max((seg.get("id", -1) for seg in segments), default=-1) + 1
+
+    def live_segment(op_index, segment_id):
+        seg = by_id.get(segment_id) if isinstance(segment_id, (int, str)) else None
+        if seg is None or id(seg) in deleted:
+            raise SegmentEditError(f"Operation {op_index}: segment {segment_id} not found", op_index)
+        return seg
+
+    def string_field(op_index, operation, name):
+        value = operation.get(name)
+        if not isinstance(value, str):
+            raise SegmentEditError(f"Operation {op_index}: {name} must be a string", op_index)
+        return value
+
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise SegmentEditError(f"Operation {i}: expected an object, got {type(operation).__name__}", i)
+        op = operation.get("op")
+        if op == "assign":
+            live_segment(i, operation.get("segment_id"))["speaker"] = string_field(i, operation, "speaker")
+        elif op == "edit_text":
+            live_segment(i, operation.get("segment_id"))["text"] = string_field(i, operation, "text")
+        elif op == "delete":
+            deleted.add(id(live_segment(i, operation.get("segment_id"))))
+        elif op == "merge":
+            segment_ids = operation.get("segment_ids")
+            if not isinstance(segment_ids, list):
+                raise SegmentEditError(f"Operation {i}: segment_ids must be a list", i)
+            # A segment listed twice is merged once; merging it with only itself is an error, not a delete
+            segment_ids = list(dict.fromkeys(sid for sid in segment_ids if isinstance(sid, (int, str))))
+            if len(segment_ids) < 2:
+                raise SegmentEditError(f"Operation {i}: merge needs at least two distinct segment_ids", i)
+            to_merge = sorted((live_segment(i, sid) for sid in segment_ids), key=lambda s: s.get("start", 0))
+            target = to_merge[0]
+            target["end"] = max(s.get("end", 0) for s in to_merge)
+            target["text"] = "".join(s.get("text", "") for s in to_merge)
+            if not target.get("speaker"):
+                target["speaker"] = next((s["speaker"] for s in to_merge if s.get("speaker")), "")
+            for seg in to_merge[1:]:
+                deleted.add(id(seg))
+        elif op == "split":
+            seg = live_segment(i, operation.get("segment_id"))
+            time = operation.get("time")
+            if not isinstance(time, (int, float)) or isinstance(time, bool) or not math.isfinite(time):
+                raise SegmentEditError(f"Operation {i}: split time must be a number", i)
+            if not seg.get("start", 0) < time < seg.get("end", 0):
+                raise SegmentEditError(f"Operation {i}: split time must fall inside segment {seg.get('id')}", i)
+            if "text_before" in operation or "text_after" in operation:
+                text_before, text_after = operation.get("text_before", ""), operation.get("text_after", "")
+                if not isinstance(text_before, str) or not isinstance(text_after, str):
+                    raise SegmentEditError(f"Operation {i}: text_before and text_after must be strings", i)
+            else:
+                fraction = (time - seg["start"]) / (seg["end"] - seg["start"])
+                text_before, text_after = _split_text(seg.get("text", ""), fraction)
+            new_seg = {
+                "id": next_id,
+                "start": time,
+                "end": seg["end"],
+                "text": text_after,
+                "speaker": seg.get("speaker", ""),
+            }
+            next_id += 1
+            seg["end"] = time
+            seg["text"] = text_before
+            by_id[new_seg["id"]] = new_seg
+            # Keep the new piece next to its source; pieces out of time order are fixed by the final sort
+            inserted_after.setdefault(id(seg), []).append(new_seg)
+            inserted_after[id(new_seg)] = []
+        else:
+            raise SegmentEditError(f"Operation {i}: unknown op {op!r}, expected one of {', '.join(EDIT_OPERATIONS)}", i)
+
+    def with_inserted(seg):
+        yield seg
+        for child in inserted_after.get(id(seg), []):
+            yield from with_inserted(child)
+
+    ordered = []
+    for seg in segments:
+        for piece in with_inserted(seg):
+            if id(piece) not in deleted:
+                ordered.append(piece)
+    if any(ordered[j].get("start", 0) > ordered[j + 1].get("start", 0) for j in range(len(ordered) - 1)):
+        ordered.sort(key=lambda s: s.get("start", 0))
+    results["segments"] = ordered
+    results["version"] = results.get("version", 0) + 1
+    return results
+
+
+@contextmanager
+def results_file_lock(results_file: str):
+    """Exclusive lock on a results file for read-modify-write edits.
+
+    The lock is a ``flock`` on a sidecar file, so it is shared by the threads and web
+    workers of every process that edits the same results.
+    """
+    with open(results_file + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_results_atomic(results_file: str, results: dict):
+    """Write results to a temporary file and rename it over the target in one step"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(results_file)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dumps(results, sort_keys=False))
+        os.replace(tmp_path, results_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from fast_json import loads
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = 7 * 24 * 3600
+
+
+class SessionStore:
+    """Per-session state kept in process memory and backed by SQLite.
+
+    Each worker keeps the sessions it has served in memory; a version number stored with
+    every session tells it when another worker has changed one, so a request usually only
+    reads that integer instead of the session data. Sessions expire ``ttl`` seconds after
+    their last use.
+    """
+
+    def __init__(self, db_path: str = "data/sessions.sqlite", ttl: float = SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # sid -> (version, data json, expires_at)
+        self._memory = {}
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_by_expiry ON sessions (expires_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def load(self, sid: str):
+        """Session data, or None if the session does not exist or has expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT version, expires_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            if row is None or row[1] < now:
+                with self._lock:
+                    self._memory.pop(sid, None)
+                return None
+            version, expires_at = row
+            cached = self._memory.get(sid)
+            if cached is not None and cached[0] == version:
+                data_json = cached[1]
+            else:
+                data_json = conn.execute("SELECT data FROM sessions WHERE sid = ?", (sid,)).fetchone()[0]
+            # Only push the expiry forward once a tenth of the TTL has passed, not on every request
+            if expires_at - now < self.ttl * 0.9:
+                expires_at = now + self.ttl
+                conn.execute("UPDATE sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+        with self._lock:
+            self._memory[sid] = (version, data_json, expires_at)
+        return json.loads(data_json)
+
+    def save(self, sid: str, data: dict):
+        """Store the session if its data changed, including changes to nested values"""
+        data_json = json.dumps(data, sort_keys=True)
+        cached = self._memory.get(sid)
+        if cached is not None and cached[1] == data_json:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock, self._connect() as conn:
+            version = conn.execute("""
+                INSERT INTO sessions (sid, version, data, expires_at) VALUES (?, 1, ?, ?)
+                ON CONFLICT (sid) DO UPDATE SET version = version + 1, data = excluded.data, expires_at = excluded.expires_at
+                RETURNING version
+            """, (sid, data_json, expires_at)).fetchone()[0]
+            self._memory[sid] = (version, data_json, expires_at)
+        self._purge_expired()
+
+    def delete(self, sid: str):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            self._memory.pop(sid, None)
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        with self._lock, self._connect() as conn:
+            removed = conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount
+            for sid in [sid for sid, cached in self._memory.items() if cached[2] < now]:
+                del self._memory[sid]
+        if removed:
+            logger.info(f"Evicted {removed} expired sessions")
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: str = None, new: bool = False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface keeping session data in a SessionStore; the cookie only holds the id.
+
+    Sessions are saved after every request that used them, so in-place changes such as
+    ``session["current_video"].update(...)`` are kept too.
+    """
+
+    def __init__(self, store: SessionStore):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.accessed and not session.modified:
+            return
+        self.store.save(session.sid, dict(session))
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+class ResultsCache:
+    """Parsed results files shared by the requests of a worker.
+
+    Entries are checked against the file's modification time, size and inode on every
+    lookup, so a write by any process or worker is picked up on the next read. Callers
+    must not modify the returned results in place.
+    """
+
+    def __init__(self, max_entries: int = 16, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def signature(path: str):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self, path: str):
+        path = os.path.abspath(path)
+        signature = self.signature(path)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature and now - entry[2] < self.ttl:
+                self._entries.move_to_end(path)
+                return entry[1]
+        with open(path, "rb") as f:
+            results = loads(f.read())
+        self._put(path, signature, results)
+        return results
+
+    def put(self, path: str, results):
+        """Record results that were just written to ``path``, so the next read needs no parsing"""
+        path = os.path.abspath(path)
+        self._put(path, self.signature(path), results)
+
+    def _put(self, path, signature, results):
+        with self._lock:
+            self._entries[path] = (signature, results, time.time())
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
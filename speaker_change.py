@@ -0,0 +1,100 @@
+"""
+Speaker-change detection inside transcript segments.
+
+A segment is covered by fixed-size overlapping windows, each window is scored against
+every reference speaker, and runs of windows that agree on a speaker become the parts of
+the segment. Parts are cut at the word boundary closest to each change, so a segment
+spanning a handoff between two people is split where the second one starts talking.
+
+The functions here work on sample bounds, score matrices and word timestamps only; the
+embedding itself is done by ``FileProcessor`` in batches of equally sized windows.
+"""
+
+import numpy as np
+
+WINDOW_SECONDS = 1.5
+HOP_SECONDS = 0.75
+# Long segments get a wider hop instead of more windows, bounding the cost per segment
+MAX_WINDOWS = 32
+# A speaker must hold this many consecutive windows to count as a change
+MIN_RUN_WINDOWS = 2
+
+
+def window_bounds(start_sample: int, end_sample: int, sr: int, window_seconds: float = WINDOW_SECONDS,
+                  hop_seconds: float = HOP_SECONDS, max_windows: int = MAX_WINDOWS):
+    """(windows, 2) sample bounds of equally sized windows covering [start_sample, end_sample).
+
+    A segment shorter than one window yields a single window of the segment's length. The
+    last window ends at the end of the segment; at most ``max_windows`` windows are returned.
+    """
+    window = int(window_seconds * sr)
+    length = end_sample - start_sample
+    if length <= window:
+        return np.array([[start_sample, end_sample]], dtype=np.int64)
+    hop = max(int(hop_seconds * sr), int(np.ceil((length - window) / (max_windows - 1))))
+    starts = np.arange(start_sample, end_sample - window, hop, dtype=np.int64)
+    starts = np.append(starts, end_sample - window)
+    return np.stack([starts, starts + window], axis=1)
+
+
+def speaker_runs(window_scores: np.ndarray, min_run: int = MIN_RUN_WINDOWS):
+    """Group windows into runs of the same best-scoring speaker.
+
+    ``window_scores`` is (windows, speakers). Returns a list of (first_window, last_window,
+    speaker_index); runs shorter than ``min_run`` windows are absorbed by their neighbours.
+    """
+    best = np.argmax(window_scores, axis=1)
+    edges = np.flatnonzero(np.diff(best)) + 1
+    runs = [[int(lo), int(hi) - 1, int(best[lo])] for lo, hi in zip(np.r_[0, edges], np.r_[edges, len(best)])]
+    # Absorb short runs, shortest first, into the neighbour that scores them best
+    while len(runs) > 1:
+        lengths = [hi - lo + 1 for lo, hi, _ in runs]
+        i = int(np.argmin(lengths))
+        if lengths[i] >= min_run:
+            break
+        lo, hi, _ = runs[i]
+        neighbours = [j for j in (i - 1, i + 1) if 0 <= j < len(runs)]
+        j = max(neighbours, key=lambda n: window_scores[lo:hi + 1, runs[n][2]].mean())
+        runs[j][0], runs[j][1] = min(runs[j][0], lo), max(runs[j][1], hi)
+        del runs[i]
+        # Neighbours that now touch and agree become one run
+        merged = [runs[0]]
+        for run in runs[1:]:
+            if run[2] == merged[-1][2]:
+                merged[-1][1] = run[1]
+            else:
+                merged.append(run)
+        runs = merged
+    return [tuple(run) for run in runs]
+
+
+def change_times(windows: np.ndarray, runs, sr: int):
+    """Times in seconds of the changes between consecutive runs, midway between the windows on either side"""
+    centers = windows.mean(axis=1) / sr
+    return [float(centers[prev[1]] + centers[run[0]]) / 2 for prev, run in zip(runs, runs[1:])]
+
+
+def split_at_words(segment: dict, word_starts: np.ndarray, word_ends: np.ndarray, words, times):
+    """Split a segment at the word boundaries closest to the change ``times``.
+
+    Returns one part (start, end, text, run) per piece, where ``run`` is the index of the
+    run of windows the piece belongs to, or None when the words do not match the segment
+    text (e.g. it was edited) or every change falls before the second word.
+    """
+    if len(words) < 2 or "".join(words).strip() != segment.get("text", "").strip():
+        return None
+    # A cut at i starts a new part with word i; the first word can never start one
+    cuts = [int(np.argmin(np.abs(word_starts[1:] - t))) + 1 for t in times]
+    bounds = [(0, 0)] + [(cut, run) for run, cut in enumerate(cuts, start=1)] + [(len(words), None)]
+    parts = []
+    for (lo, run), (hi, _) in zip(bounds, bounds[1:]):
+        # Runs whose change snapped onto the same boundary as the next one have no words of their own
+        if lo >= hi:
+            continue
+        parts.append({
+            "start": float(segment["start"]) if lo == 0 else float(word_starts[lo]),
+            "end": float(segment["end"]) if hi == len(words) else float(word_ends[hi - 1]),
+            "text": "".join(words[lo:hi]),
+            "run": run,
+        })
+    return parts if len(parts) > 1 else None
@@ -8,58 +8,118 @@ import torch
 from noisereduce.torchgate import TorchGate as TG
 import tqdm
 import glob
+import threading
 import copy
+import logging
+import numpy as np
 
 from speechbrain.inference.speaker import SpeakerRecognition
+from tracing import span, file_size
+from vad import speech_parts, speech_regions, vad_enabled
+from speaker_change import change_times, speaker_runs, split_at_words, window_bounds
+from transcript_store import WordTable, source_transcript
+
+logger = logging.getLogger(__name__)
+
+def load_audio(file_path: str, denoise: bool = False, denoise_prop: float = 0.1):
+    """Load an audio file, optionally applying spectral-gate denoising. Returns (audio, sample_rate)"""
+    with span("audio_load", input_bytes=file_size(file_path)) as s:
+        audio, sr = torchaudio.load(file_path)
+        s.set(channels=audio.shape[0], samples=audio.shape[-1], sample_rate=sr)
+    if denoise:
+        audio = denoise_audio(audio, sr, denoise_prop)
+    return audio, sr
+
+
+def speech_clip(audio, sr: int, start_sample: int, end_sample: int, regions=None):
+    """Samples of a segment with the silence between speech regions left out (all of it without regions)"""
+    if regions is None:
+        return audio[:, start_sample:end_sample]
+    parts = speech_parts(start_sample, end_sample, regions, sr, min_samples=int(0.1 * sr))
+    if len(parts) == 1:
+        return audio[:, parts[0][0]:parts[0][1]]
+    return torch.cat([audio[:, start:end] for start, end in parts], dim=-1)
+
+
+def denoise_audio(audio, sr: int, denoise_prop: float = 0.1):
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    with span("denoise", samples=audio.shape[-1], channels=audio.shape[0], denoise_prop=denoise_prop):
+        # Create TorchGating instance
+        tg = TG(sr=sr, nonstationary=True, prop_decrease=denoise_prop).to(device)
+        # Apply Spectral Gate to noisy speech signal
+        enhanced_speech = tg(audio.to(device))
+        # dn_file_path_wav = os.path.splitext(file_path)[0] + "_denoised.wav"
+        # torchaudio.save(dn_file_path_wav, src=enhanced_speech.cpu(), sample_rate=sr)
+        return enhanced_speech.cpu()
+
+
+_verification_model = None
+_verification_model_lock = threading.Lock()
+
+
+def load_verification_model():
+    """Load the ECAPA speaker verification model once per process"""
+    global _verification_model
+    with _verification_model_lock:
+        if _verification_model is None:
+            with span("verification_model_load"):
+                _verification_model = _load_verification_model()
+        return _verification_model
+
+
+def _load_verification_model():
+    # Try CUDA first, fallback to CPU if there are issues
+    try:
+        if torch.cuda.is_available():
+            model = SpeakerRecognition.from_hparams(
+                source="speechbrain/spkrec-ecapa-voxceleb", 
+                savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb", 
+                run_opts={"device":"cuda"}
+            )
+            print("Using CUDA for speaker recognition")
+            return model
+        else:
+            raise RuntimeError("CUDA not available")
+    except Exception as e:
+        print(f"CUDA initialization failed: {e}. Falling back to CPU.")
+        return SpeakerRecognition.from_hparams(
+            source="speechbrain/spkrec-ecapa-voxceleb", 
+            savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb", 
+            run_opts={"device":"cpu"}
+        )
+
 
 class FileProcessor:
     def __init__(self, file_path: str, whisper_results_file: str, denoise: bool = False, denoise_prop: float = 0.1,
-                 verification_threshold: float = 0.2):
+                 verification_threshold: float = 0.2, audio=None, verification=None, sliding_window: bool = False):
         if not os.path.exists(file_path):
             raise FileNotFoundError
         if not os.path.exists(whisper_results_file):
             raise FileNotFoundError
-        device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-        if denoise:
-            noisy_speech, self.sr = torchaudio.load(file_path)
-            noisy_speech = noisy_speech.to(device)
-            # Create TorchGating instance
-            tg = TG(sr=self.sr, nonstationary=True, prop_decrease=denoise_prop).to(device)
-            # Apply Spectral Gate to noisy speech signal
-            enhanced_speech = tg(noisy_speech)
-            # dn_file_path_wav = os.path.splitext(file_path)[0] + "_denoised.wav"
-            # torchaudio.save(dn_file_path_wav, src=enhanced_speech.cpu(), sample_rate=sr)
-            self.audio = enhanced_speech.cpu()
+        if audio is not None:
+            self.audio, self.sr = audio
         else:
-            self.audio, self.sr = torchaudio.load(file_path)
+            self.audio, self.sr = load_audio(file_path, denoise, denoise_prop)
         self.whisper_results_file = whisper_results_file
-        self.whisper_results = json.load(open(whisper_results_file))
+        with span("json_load", input_bytes=file_size(whisper_results_file)):
+            self.whisper_results = json.load(open(whisper_results_file))
         if "segments" not in self.whisper_results:
             new_results = {"segments": copy.deepcopy(self.whisper_results)}
             self.whisper_results = new_results
         self.speaker_results = copy.deepcopy(self.whisper_results)
 
-        # Try CUDA first, fallback to CPU if there are issues
-        try:
-            if torch.cuda.is_available():
-                self.verification = SpeakerRecognition.from_hparams(
-                    source="speechbrain/spkrec-ecapa-voxceleb", 
-                    savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb", 
-                    run_opts={"device":"cuda"}
-                )
-                print("Using CUDA for speaker recognition")
-            else:
-                raise RuntimeError("CUDA not available")
-        except Exception as e:
-            print(f"CUDA initialization failed: {e}. Falling back to CPU.")
-            self.verification = SpeakerRecognition.from_hparams(
-                source="speechbrain/spkrec-ecapa-voxceleb", 
-                savedir=f"~/pretrained_models/spkrec-ecapa-voxceleb", 
-                run_opts={"device":"cpu"}
-            )
-            
+        self.verification = verification if verification is not None else load_verification_model()
+
         self.verification_threshold = verification_threshold
+        # Score fixed-size windows and split segments at speaker changes instead of one label per segment
+        self.sliding_window = sliding_window
         self.speaker_info = {}
+        # Only the speech inside a segment is embedded. Speech is detected on the undenoised
+        # samples as torchaudio decodes them, so it matches the sweep and works for video containers
+        self.speech_regions = None
+        if vad_enabled():
+            raw = (lambda: (self.audio, self.sr)) if not denoise and audio is None else (lambda: torchaudio.load(file_path))
+            self.speech_regions = speech_regions(file_path, load=raw)
         
     def _ensure_audio_format(self, audio_tensor):
         """Ensure audio tensor is properly formatted for processing"""
@@ -96,7 +156,7 @@ class FileProcessor:
                 if start_sample >= end_sample or start_sample < 0 or end_sample > self.audio.shape[-1]:
                     continue
                 
-                audio_segment = self.audio[:, start_sample:end_sample]
+                audio_segment = speech_clip(self.audio, self.sr, start_sample, end_sample, self.speech_regions)
                 
                 # Check if segment has sufficient length (at least 0.1 seconds)
                 if audio_segment.shape[-1] < int(0.1 * self.sr):
@@ -115,68 +175,176 @@ class FileProcessor:
                     continue
  
     def process(self, store_results: bool = True):
-        self.whisper_results = json.load(open(self.whisper_results_file))
+        with span("speaker_identification", segments=len(self.whisper_results["segments"])):
+            self._process(store_results)
+
+    def _process(self, store_results: bool):
+        with span("json_load", input_bytes=file_size(self.whisper_results_file)):
+            self.whisper_results = json.load(open(self.whisper_results_file))
         if "segments" not in self.whisper_results:
             new_results = {"segments": copy.deepcopy(self.whisper_results)}
             self.whisper_results = new_results
         self.speaker_results = copy.deepcopy(self.whisper_results)
-        self.concat_all_speaker_segments()
+        with span("reference_concat") as s:
+            self.concat_all_speaker_segments()
+            s.set(speakers=len(self.speaker_info),
+                  reference_samples=sum(info["reference_segments"].shape[-1] for info in self.speaker_info.values()))
         
         # Check if we have any reference speakers
         if not self.speaker_info:
             print("No reference speakers found. Please manually label some segments first.")
             return
         
-        # Iterate through each segment
-        for seg in self.speaker_results["segments"]:
-            if seg.get("speaker", "") != "":
-                continue
+        if self.sliding_window:
+            self._label_windows()
+        else:
+            self._label_segments()
+
+        if store_results:
+            with span("json_dump", segments=len(self.speaker_results["segments"])):
+                json.dump(self.speaker_results, open(self.whisper_results_file.replace(".json", "_speaker_results.json"), "w+"))
+
+        logger.info(f"Finished speaker identification of {self.whisper_results_file}")
+
+    def _label_segments(self):
+        unlabeled = [seg for seg in self.speaker_results["segments"] if seg.get("speaker", "") == ""]
+        with span("score_segments", segments=len(unlabeled), speakers=len(self.speaker_info)):
+            # Iterate through each segment
+            for seg in self.speaker_results["segments"]:
+                if seg.get("speaker", "") != "":
+                    continue
                 
-            # Validate segment bounds
-            start_sample = int(seg["start"] * self.sr)
-            end_sample = int(seg["end"] * self.sr)
+                # Validate segment bounds
+                start_sample = int(seg["start"] * self.sr)
+                end_sample = int(seg["end"] * self.sr)
             
-            if start_sample >= end_sample or start_sample < 0 or end_sample > self.audio.shape[-1]:
-                continue
+                if start_sample >= end_sample or start_sample < 0 or end_sample > self.audio.shape[-1]:
+                    continue
                 
-            # Extract current audio segment
-            curr_audio = self.audio[:, start_sample:end_sample]
+                # Extract current audio segment
+                curr_audio = speech_clip(self.audio, self.sr, start_sample, end_sample, self.speech_regions)
             
-            # Check if segment has sufficient length (at least 0.1 seconds)
-            if curr_audio.shape[-1] < int(0.1 * self.sr):
-                continue
+                # Check if segment has sufficient length (at least 0.1 seconds)
+                if curr_audio.shape[-1] < int(0.1 * self.sr):
+                    continue
             
-            best_speaker, best_score = None, float("-inf")
+                best_speaker, best_score = None, float("-inf")
             
-            # try:
-            # Ensure current audio is properly formatted
-            curr_audio = self._ensure_audio_format(curr_audio)
+                # try:
+                # Ensure current audio is properly formatted
+                curr_audio = self._ensure_audio_format(curr_audio)
             
-            for speaker in self.speaker_info:
-                # Verify the segment and try to find the best one
-                score, _ = self.verification.verify_batch(curr_audio, self.speaker_info[speaker]["reference_segments"])
-                score = score.mean().squeeze().item()
-                if score > best_score:
-                    best_score = score
-                    best_speaker = speaker
-
-            if best_score > self.verification_threshold:
-                seg["speaker"] = best_speaker
-                # Also update the segment by ID if it exists
-                for i in range(len(self.speaker_results["segments"])):
-                    if self.speaker_results["segments"][i].get("id") == seg.get("id"):
-                        self.speaker_results["segments"][i]["speaker"] = best_speaker
-                        break
+                for speaker in self.speaker_info:
+                    # Verify the segment and try to find the best one
+                    score, _ = self.verification.verify_batch(curr_audio, self.speaker_info[speaker]["reference_segments"])
+                    score = score.mean().squeeze().item()
+                    if score > best_score:
+                        best_score = score
+                        best_speaker = speaker
+
+                if best_score > self.verification_threshold:
+                    seg["speaker"] = best_speaker
+                    # Also update the segment by ID if it exists
+                    for i in range(len(self.speaker_results["segments"])):
+                        if self.speaker_results["segments"][i].get("id") == seg.get("id"):
+                            self.speaker_results["segments"][i]["speaker"] = best_speaker
+                            break
                             
-            # except RuntimeError as e:
-            #     print(f"Runtime error processing segment {seg.get('id', 'unknown')}: {e}")
-            #     print(best_speaker, best_score, self.verification_threshold, seg)
-            #     continue
-            # except Exception as e:
-            #     print(f"Unexpected error processing segment {seg.get('id', 'unknown')}: {e}")
-            #     continue
-                
-        if store_results:
-            json.dump(self.speaker_results, open(self.whisper_results_file.replace(".json", "_speaker_results.json"), "w+"))
-        
-        print("Finished Processing File!! <3")
\ No newline at end of file
+                # except RuntimeError as e:
+                #     print(f"Runtime error processing segment {seg.get('id', 'unknown')}: {e}")
+                #     print(best_speaker, best_score, self.verification_threshold, seg)
+                #     continue
+                # except Exception as e:
+                #     print(f"Unexpected error processing segment {seg.get('id', 'unknown')}: {e}")
+                #     continue
+
+    def _segment_words(self):
+        """Word timestamps of the transcript as (starts, ends, words) sorted by time, or None"""
+        word_table = WordTable.for_results(source_transcript(self.whisper_results_file))
+        if word_table is not None:
+            starts, ends, words = word_table.start, word_table.end, word_table.words
+            word_table.close()
+        else:
+            inline = [w for seg in self.whisper_results["segments"] for w in seg.get("words", [])]
+            if not inline:
+                return None
+            starts = np.array([w["start"] for w in inline], dtype=np.float32)
+            ends = np.array([w["end"] for w in inline], dtype=np.float32)
+            words = [w["word"] for w in inline]
+        order = np.argsort(starts, kind="stable")
+        return starts[order], ends[order], [words[i] for i in order]
+
+    def _label_windows(self):
+        """Score equally sized windows of every unlabeled segment and split segments where the best speaker changes"""
+        from sweep import cosine_scores, embed_clips
+        speakers = list(self.speaker_info)
+        # References are windowed too, so no embedding ever sees more than one window of audio.
+        # They were built from speech_clip, so with VAD on they hold no silence already.
+        reference_embeddings = []
+        for speaker in speakers:
+            reference = self.speaker_info[speaker]["reference_segments"]
+            windows = window_bounds(0, reference.shape[-1], self.sr)
+            reference_embeddings.append(embed_clips(self.verification, [reference[:, a:b] for a, b in windows]).mean(axis=0))
+        reference_embeddings = np.stack(reference_embeddings)
+
+        segments, segment_windows = [], []
+        for seg in self.speaker_results["segments"]:
+            if seg.get("speaker", "") != "":
+                continue
+            start_sample = int(seg["start"] * self.sr)
+            end_sample = int(seg["end"] * self.sr)
+            if start_sample >= end_sample or start_sample < 0 or end_sample > self.audio.shape[-1]:
+                continue
+            if end_sample - start_sample < int(0.1 * self.sr):
+                continue
+            segments.append(seg)
+            segment_windows.append(window_bounds(start_sample, end_sample, self.sr))
+        if not segments:
+            return
+
+        with span("score_windows", segments=len(segments), windows=sum(len(w) for w in segment_windows),
+                  speakers=len(speakers)):
+            # Windows keep their place on the timeline for the change times; only their silence is dropped
+            clips = [self._ensure_audio_format(speech_clip(self.audio, self.sr, a, b, self.speech_regions))
+                     for windows in segment_windows for a, b in windows]
+            scores = cosine_scores(embed_clips(self.verification, clips), reference_embeddings)
+        offsets = np.cumsum([0] + [len(w) for w in segment_windows])
+        words = self._segment_words()
+        splits = {}
+        for i, (seg, windows) in enumerate(zip(segments, segment_windows)):
+            window_scores = scores[offsets[i]:offsets[i + 1]]
+            runs = speaker_runs(window_scores)
+            parts = None
+            if len(runs) > 1 and words is not None:
+                starts, ends, texts = words
+                lo = np.searchsorted(starts, seg["start"] - 1e-3, side="left")
+                hi = np.searchsorted(starts, seg["end"], side="left")
+                parts = split_at_words(seg, starts[lo:hi], ends[lo:hi], texts[lo:hi],
+                                       change_times(windows, runs, self.sr))
+            if parts is None:
+                mean_scores = window_scores.mean(axis=0)
+                best = int(np.argmax(mean_scores))
+                if mean_scores[best] > self.verification_threshold:
+                    seg["speaker"] = speakers[best]
+                continue
+            for part in parts:
+                first, last, best = runs[part.pop("run")]
+                score = window_scores[first:last + 1, best].mean()
+                part["speaker"] = speakers[best] if score > self.verification_threshold else ""
+            splits[id(seg)] = parts
+
+        if splits:
+            # The first part keeps the segment's id, later parts get new ones
+            next_id = max((s["id"] for s in self.speaker_results["segments"] if isinstance(s.get("id"), int)),
+                          default=-1) + 1
+            segments_out = []
+            for seg in self.speaker_results["segments"]:
+                if id(seg) not in splits:
+                    segments_out.append(seg)
+                    continue
+                for j, part in enumerate(splits[id(seg)]):
+                    segments_out.append({**seg, **part, "id": seg.get("id") if j == 0 else next_id})
+                    if j > 0:
+                        next_id += 1
+            logger.info(f"Split {len(splits)} segments at speaker changes")
+            self.speaker_results["segments"] = segments_out
@@ -0,0 +1,237 @@
+"""
+Speaker library shared across recordings.
+
+The same instructors and standardized patients appear in many videos. Labeled segments
+of a video can be enrolled here: each becomes one embedding of its speaker, so a person
+collects several embeddings over recordings and conditions. New videos can then be
+pre-labeled from the library before anyone labels a segment by hand.
+
+Embeddings are stored in SQLite, one row per enrolled segment, and held in memory as
+one float32 matrix of unit rows. A query is a top-k nearest-neighbour search over that
+matrix: exact matrix products in chunks by default, or an HNSW index when ``faiss`` is
+installed and the library is large enough for approximate search to pay off.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+from content_hash import hash_file
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# Enroll only segments long enough for a reliable embedding
+MIN_ENROLL_SECONDS = 1.0
+# Oldest embeddings of a speaker are dropped beyond this, keeping the matrix compact
+MAX_PER_SPEAKER = 64
+TOP_K = 10
+PRELABEL_THRESHOLD = 0.5
+# The best speaker must beat the best other speaker among the neighbours by this much
+PRELABEL_MARGIN = 0.05
+ANN_MIN_ROWS = 20000
+QUERY_CHUNK = 256
+
+
+def speaker_vectors(embeddings: np.ndarray) -> np.ndarray:
+    """One unit vector per (segments, channels, dim) embedding, averaged over channels.
+
+    Averaging instead of concatenating keeps mono and multi-channel recordings in the same space.
+    """
+    unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=-1, keepdims=True), 1e-6)
+    vectors = unit.mean(axis=1)
+    return (vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-6)).astype(np.float32)
+
+
+class SpeakerLibrary:
+    """Enrolled speaker embeddings in SQLite with an in-memory top-k index.
+
+    Each process keeps the matrix in memory and rebuilds it only when the row count or
+    the newest row id in the table changed, i.e. when any process enrolled or dropped
+    embeddings.
+    """
+
+    def __init__(self, db_path: str = "data/speaker_library.sqlite", max_per_speaker: int = MAX_PER_SPEAKER):
+        self.db_path = db_path
+        self.max_per_speaker = max_per_speaker
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    speaker TEXT NOT NULL,
+                    source TEXT NOT NULL UNIQUE,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_by_speaker ON embeddings (speaker, id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def enroll(self, speaker: str, vectors: np.ndarray, sources) -> int:
+        """Add unit embeddings of one speaker; ``sources`` identify the segments they came from.
+
+        Enrolling a source again replaces its embedding and speaker, so re-enrolling a video
+        after correcting labels does not duplicate anything. Returns the number of rows written.
+        """
+        if not speaker:
+            raise ValueError("Speaker name must not be empty")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        now = time.time()
+        with self._connect() as conn:
+            existing = conn.execute("SELECT length(embedding) FROM embeddings LIMIT 1").fetchone()
+            if existing and existing[0] != vectors.shape[1] * vectors.itemsize:
+                raise ValueError(f"Embeddings have dimension {vectors.shape[1]}, the library uses {existing[0] // vectors.itemsize}")
+            conn.executemany("INSERT OR REPLACE INTO embeddings (speaker, source, embedding, created_at) VALUES (?, ?, ?, ?)",
+                             [(speaker, source, vector.tobytes(), now) for source, vector in zip(sources, vectors)])
+            conn.execute("""
+                DELETE FROM embeddings WHERE speaker = ? AND id NOT IN (
+                    SELECT id FROM embeddings WHERE speaker = ? ORDER BY id DESC LIMIT ?
+                )
+            """, (speaker, speaker, self.max_per_speaker))
+        return len(vectors)
+
+    def remove(self, speaker: str) -> int:
+        """Forget a speaker; returns the number of embeddings removed"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM embeddings WHERE speaker = ?", (speaker,)).rowcount
+
+    def speakers(self):
+        """Enrolled speakers with their number of embeddings, by name"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT speaker, COUNT(*), MAX(created_at) FROM embeddings GROUP BY speaker ORDER BY speaker").fetchall()
+        return [{"name": name, "embeddings": count, "updated_at": updated_at} for name, count, updated_at in rows]
+
+    def _load(self):
+        """(speaker names, speaker index per row, unit embedding matrix, ANN index or None)"""
+        with self._connect() as conn:
+            signature = conn.execute("SELECT COUNT(*), MAX(id) FROM embeddings").fetchone()
+            with self._lock:
+                if self._index is not None and self._index[0] == signature:
+                    return self._index[1:]
+            rows = conn.execute("SELECT speaker, embedding FROM embeddings ORDER BY id").fetchall()
+        names = sorted({speaker for speaker, _ in rows})
+        position = {name: i for i, name in enumerate(names)}
+        speaker = np.array([position[name] for name, _ in rows], dtype=np.int32)
+        if rows:
+            matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), -1)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        ann = None
+        if faiss is not None and len(rows) >= ANN_MIN_ROWS:
+            ann = faiss.IndexHNSWFlat(matrix.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            ann.add(matrix)
+        logger.info(f"Loaded speaker library: {len(names)} speakers, {len(rows)} embeddings")
+        with self._lock:
+            self._index = (signature, names, speaker, matrix, ann)
+        return names, speaker, matrix, ann
+
+    def search(self, queries: np.ndarray, k: int = TOP_K):
+        """(similarities, rows) of the ``k`` nearest enrolled embeddings of each unit query, best first.
+
+        Missing neighbours (fewer than ``k`` rows) have row -1 and similarity -inf.
+        """
+        _, _, matrix, ann = self._load()
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        if not len(matrix) or not len(queries):
+            return similarities, rows
+        if ann is not None:
+            found, found_rows = ann.search(queries, k)
+            valid = found_rows >= 0
+            similarities[valid], rows[valid] = found[valid], found_rows[valid]
+            return similarities, rows
+        n = min(k, len(matrix))
+        # Chunked so the (queries, rows) product stays small however large the library grows
+        for lo in range(0, len(queries), QUERY_CHUNK):
+            scores = queries[lo:lo + QUERY_CHUNK] @ matrix.T
+            top = np.argpartition(-scores, n - 1, axis=1)[:, :n] if n < len(matrix) else np.tile(np.arange(n), (len(scores), 1))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            rows[lo:lo + QUERY_CHUNK, :n] = np.take_along_axis(top, order, axis=1)
+            similarities[lo:lo + QUERY_CHUNK, :n] = np.take_along_axis(top_scores, order, axis=1)
+        return similarities, rows
+
+    def identify(self, queries: np.ndarray, k: int = TOP_K):
+        """Best speaker of each unit query with its similarity and its margin over the best other speaker.
+
+        Returns (names, similarities, margins); the name is None when the library is empty.
+        """
+        names, speaker, _, _ = self._load()
+        similarities, rows = self.search(queries, k)
+        if not names:
+            return [None] * len(queries), np.full(len(queries), -np.inf), np.zeros(len(queries))
+        speakers = np.where(rows >= 0, speaker[np.maximum(rows, 0)], -1)
+        best = speakers[:, 0]
+        others = np.where((speakers != best[:, None]) & (rows >= 0), similarities, -np.inf).max(axis=1)
+        # Without another speaker among the neighbours, the margin is measured against zero similarity
+        margins = similarities[:, 0] - np.maximum(others, 0.0)
+        return [names[i] if i >= 0 else None for i in best], similarities[:, 0], margins
+
+
+_libraries = {}
+
+
+def open_library(db_path: str = "data/speaker_library.sqlite") -> SpeakerLibrary:
+    """Library for a database path, shared within the process so its matrix is loaded once"""
+    if db_path not in _libraries:
+        _libraries[db_path] = SpeakerLibrary(db_path)
+    return _libraries[db_path]
+
+
+def _segment_embeddings(audio_path: str, results_file: str):
+    from sweep import SweepRunner, load_segments
+    segments = load_segments(results_file)
+    # Cached in the artifact store, shared with speaker proposals, sweeps and the prefetcher
+    return segments, SweepRunner(audio_path, results_file).segment_embeddings(segments)
+
+
+def enroll_results(library: SpeakerLibrary, audio_path: str, results_file: str,
+                   min_seconds: float = MIN_ENROLL_SECONDS) -> dict:
+    """Enroll every labeled segment of a results file; returns the number enrolled per speaker"""
+    segments, embeddings = _segment_embeddings(audio_path, results_file)
+    audio_hash = hash_file(audio_path)
+    by_speaker = {}
+    for i, seg in enumerate(segments):
+        if (seg.get("speaker") and float(seg["end"]) - float(seg["start"]) >= min_seconds
+                and not np.isnan(embeddings[i]).any()):
+            by_speaker.setdefault(seg["speaker"], []).append(i)
+    enrolled = {}
+    for speaker, rows in by_speaker.items():
+        # Segments are identified by audio content and time, so they survive renumbering
+        sources = [f'{audio_hash}:{float(segments[i]["start"]):.3f}-{float(segments[i]["end"]):.3f}' for i in rows]
+        enrolled[speaker] = library.enroll(speaker, speaker_vectors(embeddings[rows]), sources)
+    logger.info(f"Enrolled {sum(enrolled.values())} segments of {len(enrolled)} speakers from {results_file}")
+    return enrolled
+
+
+def prelabel_assignments(library: SpeakerLibrary, audio_path: str, results_file: str,
+                         threshold: float = PRELABEL_THRESHOLD, margin: float = PRELABEL_MARGIN) -> list:
+    """Library speakers for the unlabeled segments whose match is clear, as assign operations.
+
+    Nothing is written here: the app applies the operations like any other batch edit, so
+    they are versioned and never overwrite edits made while the embeddings were computed.
+    """
+    segments, embeddings = _segment_embeddings(audio_path, results_file)
+    rows = [i for i, seg in enumerate(segments) if not seg.get("speaker") and not np.isnan(embeddings[i]).any()]
+    if not rows:
+        return []
+    names, similarities, margins = library.identify(speaker_vectors(embeddings[rows]))
+    assignments = [{"op": "assign", "segment_id": segments[i].get("id", i), "speaker": name}
+                   for i, name, similarity, gap in zip(rows, names, similarities, margins)
+                   if name is not None and similarity >= threshold and gap >= margin]
+    logger.info(f"Matched {len(assignments)} of {len(rows)} unlabeled segments of {results_file} in the speaker library")
+    return assignments
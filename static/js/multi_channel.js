@@ -5,6 +5,7 @@ let currentAudio = null;
 let currentVideo = null;
 let currentSegments = [];
 let currentSpeakers = [];
+let currentWords = {};
 let currentFilter = 'all';
 let progressModalTimeout = null;
 let audioChannels = [];
@@ -46,6 +47,13 @@ function setupEventListeners() {
     document.getElementById('verificationThreshold').addEventListener('input', function(e) {
         document.getElementById('verificationThresholdValue').textContent = e.target.value;
     });
+
+    // Render the rows scrolled into view, at most once per frame
+    document.getElementById('segmentsContainer').addEventListener('scroll', function() {
+        if (!segmentScrollFrame) {
+            segmentScrollFrame = requestAnimationFrame(renderVisibleSegments);
+        }
+    });
 }
 
 // Audio loading functions
@@ -60,13 +68,14 @@ function loadAudio() {
     document.getElementById('loadAudioBtn').disabled = true;
 
     // Send audio path to backend
-    fetch('/load_audio', {
+    switchTranscript()
+    .then(() => fetch('/load_audio', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ audio_path: audioPath })
-    })
+    }))
     .then(response => response.json())
     .then(data => {
         if (data.success) {
@@ -99,13 +108,14 @@ function loadVideo() {
     document.getElementById('loadVideoBtn').disabled = true;
 
     // Send video path to backend
-    fetch('/load_video', {
+    switchTranscript()
+    .then(() => fetch('/load_video', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
         body: JSON.stringify({ video_path: videoPath })
-    })
+    }))
     .then(response => response.json())
     .then(data => {
         if (data.success) {
@@ -327,6 +337,7 @@ function setupAudioTimeUpdate() {
             if (currentTime) {
                 currentTime.textContent = formatTime(audioPlayer.currentTime);
             }
+            highlightSegmentAt(audioPlayer.currentTime);
         });
     }
 }
@@ -339,6 +350,7 @@ function setupVideoTimeUpdate() {
             if (currentTime) {
                 currentTime.textContent = formatTime(videoPlayer.currentTime);
             }
+            highlightSegmentAt(videoPlayer.currentTime);
         });
     }
 }
@@ -372,12 +384,12 @@ function handleSegmentsFileSelect() {
     
     if (fileInput.files && fileInput.files.length > 0) {
         const file = fileInput.files[0];
-        if (file.type === 'application/json' || file.name.toLowerCase().endsWith('.json')) {
+        if (/\.(json|jsonl|ndjson|csv|rttm)$/.test(file.name.toLowerCase())) {
             uploadBtn.disabled = false;
             showStatus(`Selected file: ${file.name}`, 'info');
         } else {
             uploadBtn.disabled = true;
-            showStatus('Please select a JSON file', 'error');
+            showStatus('Please select a JSON, JSONL, CSV or RTTM file', 'error');
         }
     } else {
         uploadBtn.disabled = true;
@@ -400,10 +412,11 @@ function uploadSegmentsFile() {
     showProgressModal('Uploading segments file...', 'Processing and validating the uploaded segments.');
     uploadBtn.disabled = true;
     
-    fetch('/upload_segments', {
+    switchTranscript()
+    .then(() => fetch('/upload_segments', {
         method: 'POST',
         body: formData
-    })
+    }))
     .then(response => {
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
@@ -511,15 +524,20 @@ function runSpeakerIdentification() {
 
 // Segment management functions
 function loadSegments() {
-    fetch('/get_segments')
+    flushEdits()
+        .then(() => fetch('/get_segments'))
         .then(response => response.json())
         .then(data => {
             if (data.error) {
                 showStatus('Error loading segments: ' + data.error, 'error');
                 return;
             }
-            currentSegments = data;
+            currentSegments = data.segments;
+            // Edits are checked against the version they were made on
+            editsVersion = data.version;
+            rememberServerSegments(data.segments);
             renderSegments();
+            loadWords();
         })
         .catch(error => {
             showStatus('Error loading segments: ' + error.message, 'error');
@@ -561,10 +579,33 @@ function loadDemoSegments() {
     renderSegments();
 }
 
+// Segment list virtualization: only the rows around the visible part of the list are in the DOM
+const SEGMENT_OVERSCAN_PX = 600;
+const SEGMENT_ROW_ESTIMATE_PX = 150;
+let filteredSegments = [];          // rows of the list, after the filter
+let segmentsByStart = [];           // currentSegments sorted by start time, for the playback highlight
+let segmentOffsets = [0];           // top of each row in px; the last entry is the height of the list
+let segmentRowHeights = new Map();  // segment id -> measured row height in px
+let renderedRows = new Map();       // segment id -> row element in the DOM
+let activeSegmentId = null;
+let segmentScrollFrame = null;
+
 function renderSegments() {
+    // The segments were (re)loaded, so every row is rebuilt
+    const rows = document.getElementById('segmentRows');
+    if (rows) {
+        rows.replaceChildren();
+    }
+    renderedRows.clear();
+    segmentsByStart = currentSegments.slice().sort((a, b) => a.start - b.start);
+    refreshSegmentList();
+}
+
+function refreshSegmentList() {
     const container = document.getElementById('segmentsContainer');
-    
+
     if (currentSegments.length === 0) {
+        renderedRows.clear();
         container.innerHTML = `
             <div class="text-center text-muted py-5">
                 <i class="fas fa-microphone fa-3x mb-3"></i>
@@ -574,10 +615,129 @@ function renderSegments() {
         return;
     }
 
-    const filteredSegments = filterSegments(currentSegments, currentFilter);
-    
-    container.innerHTML = filteredSegments.map(segment => `
-        <div class="segment-item ${segment.speaker ? 'labeled' : 'unlabeled'} fade-in">
+    let rows = document.getElementById('segmentRows');
+    if (!rows) {
+        container.innerHTML = '<div id="segmentRows" class="segment-rows"></div>';
+        rows = document.getElementById('segmentRows');
+    }
+    const scrollTop = container.scrollTop;
+    filteredSegments = filterSegments(currentSegments, currentFilter);
+    computeSegmentOffsets();
+    // Give the list its full height before restoring the scroll position
+    rows.style.paddingTop = '0px';
+    rows.style.paddingBottom = `${segmentOffsets[filteredSegments.length]}px`;
+    container.scrollTop = scrollTop;
+    renderVisibleSegments();
+}
+
+function computeSegmentOffsets() {
+    let measuredTotal = 0;
+    for (const height of segmentRowHeights.values()) {
+        measuredTotal += height;
+    }
+    // Rows not rendered yet are assumed to be as tall as the average measured row
+    const estimate = segmentRowHeights.size ? measuredTotal / segmentRowHeights.size : SEGMENT_ROW_ESTIMATE_PX;
+    segmentOffsets = new Array(filteredSegments.length + 1);
+    segmentOffsets[0] = 0;
+    for (let i = 0; i < filteredSegments.length; i++) {
+        const height = segmentRowHeights.get(filteredSegments[i].id);
+        segmentOffsets[i + 1] = segmentOffsets[i] + (height === undefined ? estimate : height);
+    }
+}
+
+// Index of the last item of a sorted array whose key is <= value, or -1
+function lastIndexAtOrBefore(items, value, key) {
+    let low = 0;
+    let high = items.length - 1;
+    let found = -1;
+    while (low <= high) {
+        const mid = (low + high) >> 1;
+        if (key(items[mid]) <= value) {
+            found = mid;
+            low = mid + 1;
+        } else {
+            high = mid - 1;
+        }
+    }
+    return found;
+}
+
+function renderVisibleSegments() {
+    segmentScrollFrame = null;
+    const container = document.getElementById('segmentsContainer');
+    const rows = document.getElementById('segmentRows');
+    if (!rows) return;
+
+    const count = filteredSegments.length;
+    const offset = o => o;
+    const first = Math.max(0, Math.min(count - 1,
+        lastIndexAtOrBefore(segmentOffsets, container.scrollTop - SEGMENT_OVERSCAN_PX, offset)));
+    const last = Math.min(count,
+        lastIndexAtOrBefore(segmentOffsets, container.scrollTop + container.clientHeight + SEGMENT_OVERSCAN_PX, offset) + 1);
+
+    const wanted = filteredSegments.slice(first, last);
+    const wantedIds = new Set(wanted.map(s => s.id));
+    for (const [segmentId, row] of renderedRows) {
+        if (!wantedIds.has(segmentId)) {
+            row.remove();
+            renderedRows.delete(segmentId);
+        }
+    }
+
+    // Rows already in the DOM stay in place; only the new ones are inserted
+    let cursor = rows.firstChild;
+    for (const segment of wanted) {
+        let row = renderedRows.get(segment.id);
+        if (!row) {
+            row = createSegmentRow(segment);
+            renderedRows.set(segment.id, row);
+        }
+        if (row === cursor) {
+            cursor = cursor.nextSibling;
+        } else {
+            rows.insertBefore(row, cursor);
+        }
+    }
+
+    placeSegmentRows(first, last);
+    if (measureSegmentRows(wanted)) {
+        computeSegmentOffsets();
+        placeSegmentRows(first, last);
+    }
+}
+
+function placeSegmentRows(first, last) {
+    const rows = document.getElementById('segmentRows');
+    const total = segmentOffsets[filteredSegments.length];
+    rows.style.paddingTop = `${segmentOffsets[first]}px`;
+    rows.style.paddingBottom = `${total - segmentOffsets[Math.max(first, last)]}px`;
+}
+
+// Record the heights of rendered rows; returns whether any changed
+function measureSegmentRows(segments) {
+    let changed = false;
+    for (const segment of segments) {
+        const row = renderedRows.get(segment.id);
+        const height = row ? row.offsetHeight : 0;
+        if (height && segmentRowHeights.get(segment.id) !== height) {
+            segmentRowHeights.set(segment.id, height);
+            changed = true;
+        }
+    }
+    return changed;
+}
+
+function createSegmentRow(segment) {
+    const row = document.createElement('div');
+    row.className = 'segment-row';
+    row.classList.toggle('active', segment.id === activeSegmentId);
+    row.innerHTML = segmentRowHtml(segment);
+    return row;
+}
+
+function segmentRowHtml(segment) {
+    return `
+        <div class="segment-item ${segment.speaker ? 'labeled' : 'unlabeled'}">
             <div class="segment-header d-flex justify-content-between align-items-center">
                 <span class="segment-time" style="cursor: pointer;" onclick="seekToSegment(${segment.start})" title="Click to seek to this time">
                     ${formatTime(segment.start)} - ${formatTime(segment.end)}
@@ -586,14 +746,136 @@ function renderSegments() {
                     ${segment.speaker ? 'Change Speaker' : 'Assign Speaker'}
                 </button>
             </div>
-            <div class="segment-text">${segment.text}</div>
+            <div class="segment-text">${renderSegmentText(segment)}</div>
             <div class="segment-speaker">
                 <span class="speaker-badge ${segment.speaker ? '' : 'unassigned'}">
                     ${segment.speaker || 'Unassigned'}
                 </span>
             </div>
         </div>
-    `).join('');
+    `;
+}
+
+// Re-render one changed segment in place, leaving the other rows alone
+function updateSegmentRow(segmentId) {
+    const segment = currentSegments.find(s => s.id === segmentId);
+    const row = renderedRows.get(segmentId);
+    if (segment && row) {
+        row.innerHTML = segmentRowHtml(segment);
+    }
+    if (!segment || filterSegments([segment], currentFilter).length === 0) {
+        // It left the current filter, so the list itself changes
+        refreshSegmentList();
+        return;
+    }
+    if (row && measureSegmentRows([segment])) {
+        refreshSegmentList();
+    }
+}
+
+// Highlight the segment under the playhead with a binary search over the start times
+function highlightSegmentAt(time) {
+    const index = lastIndexAtOrBefore(segmentsByStart, time, s => s.start);
+    const segment = index >= 0 && time < segmentsByStart[index].end ? segmentsByStart[index] : null;
+    const segmentId = segment ? segment.id : null;
+    if (segmentId === activeSegmentId) return;
+
+    const previous = renderedRows.get(activeSegmentId);
+    if (previous) {
+        previous.classList.remove('active');
+    }
+    activeSegmentId = segmentId;
+    const current = renderedRows.get(activeSegmentId);
+    if (current) {
+        current.classList.add('active');
+    }
+}
+
+// Word-level seeking and transcript search
+function loadWords() {
+    fetch('/get_words')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                return;
+            }
+            currentWords = {};
+            for (let i = 0; i < data.word.length; i++) {
+                const segmentId = data.segment_id[i];
+                if (!currentWords[segmentId]) {
+                    currentWords[segmentId] = [];
+                }
+                currentWords[segmentId].push({ word: data.word[i], start: data.start[i] });
+            }
+            renderSegments();
+        })
+        .catch(error => {
+            console.error('Error loading words:', error);
+        });
+}
+
+function renderSegmentText(segment) {
+    const words = currentWords[segment.id];
+    // Fall back to plain text once the transcript has been edited away from the timed words
+    if (!words || words.map(w => w.word).join('').trim() !== segment.text.trim()) {
+        return segment.text;
+    }
+    return words.map(w =>
+        `<span class="segment-word" onclick="seekToSegment(${w.start})" title="${formatTime(w.start)}">${w.word}</span>`
+    ).join('');
+}
+
+let searchMatches = [];
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = String(text);
+    return div.innerHTML;
+}
+
+function searchTranscripts() {
+    const query = document.getElementById('searchQuery').value.trim();
+    const resultsContainer = document.getElementById('searchResults');
+    if (!query) {
+        resultsContainer.innerHTML = '';
+        return;
+    }
+
+    fetch(`/search_words?q=${encodeURIComponent(query)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                showStatus('Error searching transcripts: ' + data.error, 'error');
+                return;
+            }
+            if (data.length === 0) {
+                resultsContainer.innerHTML = '<div class="text-muted small">No matches found</div>';
+                return;
+            }
+            // Handlers refer to matches by position, so names from the server never end up in code
+            searchMatches = data;
+            resultsContainer.innerHTML = data.map((match, index) => `
+                <div class="list-group-item list-group-item-action search-result" onclick="openSearchResult(${index})">
+                    <strong>${escapeHtml(match.word)}</strong>
+                    <small class="text-muted d-block">${escapeHtml(match.video)} &middot; segment ${escapeHtml(match.segment_id)} &middot; ${formatTime(match.start_ms / 1000)}</small>
+                </div>
+            `).join('');
+        })
+        .catch(error => {
+            showStatus('Error searching transcripts: ' + error.message, 'error');
+        });
+}
+
+function openSearchResult(index) {
+    const match = searchMatches[index];
+    if (!match) {
+        return;
+    }
+    if (match.current) {
+        seekToSegment(match.start_ms / 1000);
+    } else {
+        showStatus(`Match is in ${match.video} at ${formatTime(match.start_ms / 1000)}; load that recording to play it`, 'info');
+    }
 }
 
 function filterSegments(segments, filter) {
@@ -607,25 +889,38 @@ function filterSegments(segments, filter) {
     }
 }
 
+function setSegmentFilter(filter) {
+    currentFilter = filter;
+    document.getElementById('segmentsContainer').scrollTop = 0;
+    refreshSegmentList();
+}
+
 function showAllSegments() {
-    currentFilter = 'all';
-    renderSegments();
+    setSegmentFilter('all');
 }
 
 function showUnlabeledSegments() {
-    currentFilter = 'unlabeled';
-    renderSegments();
+    setSegmentFilter('unlabeled');
 }
 
 function showLabeledSegments() {
-    currentFilter = 'labeled';
-    renderSegments();
+    setSegmentFilter('labeled');
 }
 
 // Speaker management functions
 function loadSpeakers() {
     currentSpeakers = [];
     renderSpeakerList();
+
+    // Offer the speakers enrolled from earlier videos
+    fetch('/speaker_library')
+        .then(response => response.json())
+        .then(data => {
+            if (!data.error) {
+                addLibrarySpeakers(data);
+            }
+        })
+        .catch(error => console.error('Error loading speaker library:', error));
 }
 
 function renderSpeakerList() {
@@ -674,6 +969,169 @@ function removeSpeaker(name) {
     showStatus(`Speaker "${name}" removed`, 'success');
 }
 
+// Speaker proposals from clustering the segment embeddings
+let speakerProposals = [];
+
+function proposeSpeakers() {
+    showProgressModal('Proposing speakers...', 'Grouping the unlabeled segments by voice.');
+
+    // Cluster the labels as they are now, including buffered edits
+    flushEdits()
+        .then(() => fetch('/propose_speakers', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({})
+        }))
+        .then(response => response.json())
+        .then(data => {
+            hideProgressModal();
+            if (data.error) {
+                showStatus('Speaker proposals failed: ' + data.error, 'error');
+                return;
+            }
+            const known = data.known.map(group => ({
+                name: group.speaker,
+                segmentIds: group.segment_ids,
+                duration: group.duration,
+                note: `Sounds like ${group.speaker} (${group.similarity.toFixed(2)})`
+            }));
+            const clusters = data.clusters.map(cluster => ({
+                name: '',
+                segmentIds: cluster.segment_ids,
+                representatives: cluster.representatives,
+                duration: cluster.duration,
+                note: cluster.nearest_speaker
+                    ? `New voice, closest to ${cluster.nearest_speaker} (${cluster.similarity.toFixed(2)})`
+                    : 'New voice'
+            }));
+            speakerProposals = known.concat(clusters);
+            renderSpeakerProposals();
+            showStatus(`Proposed ${clusters.length} new speaker${clusters.length === 1 ? '' : 's'}`, 'success');
+        })
+        .catch(error => {
+            hideProgressModal();
+            showStatus('Error proposing speakers: ' + error.message, 'error');
+        });
+}
+
+function renderSpeakerProposals() {
+    const container = document.getElementById('speakerProposals');
+    container.innerHTML = speakerProposals.map((proposal, index) => `
+        <div class="list-group-item">
+            <div class="d-flex justify-content-between align-items-center">
+                <strong>${proposal.name || 'Unnamed speaker'}</strong>
+                <small class="text-muted">${proposal.segmentIds.length} segments, ${formatTime(proposal.duration)}</small>
+            </div>
+            <small class="text-muted d-block">${proposal.note}</small>
+            <div class="input-group input-group-sm mt-1">
+                <button class="btn btn-outline-secondary" type="button" onclick="playSpeakerProposal(${index})" title="Play a typical segment">
+                    <i class="fas fa-play"></i>
+                </button>
+                <input type="text" class="form-control" id="proposalName${index}" value="${proposal.name}" placeholder="Speaker name">
+                <button class="btn btn-outline-primary" type="button" onclick="applySpeakerProposal(${index})" title="Assign these segments">
+                    <i class="fas fa-check"></i>
+                </button>
+            </div>
+        </div>
+    `).join('');
+}
+
+function playSpeakerProposal(index) {
+    const proposal = speakerProposals[index];
+    const segmentId = (proposal.representatives || proposal.segmentIds)[0];
+    const segment = currentSegments.find(s => s.id === segmentId);
+    if (segment) {
+        seekToSegment(segment.start);
+    }
+}
+
+function applySpeakerProposal(index) {
+    const proposal = speakerProposals[index];
+    const name = document.getElementById(`proposalName${index}`).value.trim();
+    if (!name) {
+        showStatus('Please enter a speaker name', 'error');
+        return;
+    }
+
+    const segmentIds = new Set(proposal.segmentIds);
+    let assigned = 0;
+    currentSegments.forEach(segment => {
+        // Segments labeled since the proposals were made keep their label
+        if (segmentIds.has(segment.id) && !segment.speaker) {
+            segment.speaker = name;
+            updateSegmentRow(segment.id);
+            queueEdit({ op: 'assign', segment_id: segment.id, speaker: name });
+            assigned++;
+        }
+    });
+
+    if (!currentSpeakers.some(s => s.name === name)) {
+        currentSpeakers.push({ name: name, description: `Custom speaker: ${name}` });
+        renderSpeakerList();
+    }
+    speakerProposals.splice(index, 1);
+    renderSpeakerProposals();
+    showStatus(`Assigned ${assigned} segment${assigned === 1 ? '' : 's'} to "${name}"`, 'success');
+}
+
+function enrollSpeakers() {
+    showProgressModal('Enrolling speakers...', 'Adding the labeled segments to the speaker library.');
+    flushEdits()
+        .then(() => fetch('/enroll_speakers', { method: 'POST' }))
+        .then(response => response.json())
+        .then(data => {
+            hideProgressModal();
+            if (data.error) {
+                showStatus('Enrollment failed: ' + data.error, 'error');
+                return;
+            }
+            const names = Object.keys(data.enrolled);
+            showStatus(`Enrolled ${names.length} speaker${names.length === 1 ? '' : 's'} in the library`, 'success');
+            addLibrarySpeakers(data.speakers);
+        })
+        .catch(error => {
+            hideProgressModal();
+            showStatus('Error enrolling speakers: ' + error.message, 'error');
+        });
+}
+
+function prelabelFromLibrary() {
+    showProgressModal('Pre-labeling from library...', 'Matching unlabeled segments against enrolled speakers.');
+    flushEdits()
+        .then(() => fetch('/prelabel_speakers', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({})
+        }))
+        .then(response => response.json())
+        .then(data => {
+            hideProgressModal();
+            if (data.success) {
+                showStatus(data.message, 'success');
+                loadSegments();
+            } else {
+                showStatus('Pre-labeling failed: ' + data.error, 'error');
+            }
+        })
+        .catch(error => {
+            hideProgressModal();
+            showStatus('Error pre-labeling from library: ' + error.message, 'error');
+        });
+}
+
+function addLibrarySpeakers(librarySpeakers) {
+    librarySpeakers.forEach(speaker => {
+        const description = `Library: ${speaker.embeddings} voice sample${speaker.embeddings === 1 ? '' : 's'}`;
+        const existing = currentSpeakers.find(s => s.name === speaker.name);
+        if (existing) {
+            existing.description = description;
+        } else {
+            currentSpeakers.push({ name: speaker.name, description: description });
+        }
+    });
+    renderSpeakerList();
+}
+
 function selectSpeaker(segmentId) {
     const segment = currentSegments.find(s => s.id === segmentId);
     if (!segment) return;
@@ -696,36 +1154,186 @@ function assignSpeaker(segmentId, speakerName) {
     const segment = currentSegments.find(s => s.id === segmentId);
     if (segment) {
         segment.speaker = speakerName;
-        renderSegments();
+        updateSegmentRow(segmentId);
         
         const modal = document.getElementById('speakerModal');
         const bsModal = bootstrap.Modal.getInstance(modal);
         bsModal.hide();
         
-        fetch('/update_segment_speaker', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                segment_id: segmentId,
-                speaker: speakerName
-            })
-        })
-        .then(response => response.json())
+        queueEdit({ op: 'assign', segment_id: segmentId, speaker: speakerName });
+    }
+}
+
+// Buffered segment edits, flushed to the server in batches
+const EDIT_FLUSH_DELAY_MS = 1500;
+const EDIT_FLUSH_MAX_OPS = 50;
+const EDIT_CONFLICT_RETRIES = 2;
+let pendingEdits = [];
+let editsVersion = null;
+// The segments as the server has them at editsVersion, to tell which ones changed on a conflict
+let serverSegments = new Map();
+let editFlushTimer = null;
+let editFlushInFlight = null;
+
+function queueEdit(operation) {
+    pendingEdits.push(operation);
+    if (pendingEdits.length >= EDIT_FLUSH_MAX_OPS) {
+        flushEdits();
+        return;
+    }
+    clearTimeout(editFlushTimer);
+    editFlushTimer = setTimeout(flushEdits, EDIT_FLUSH_DELAY_MS);
+}
+
+function flushEdits() {
+    clearTimeout(editFlushTimer);
+    editFlushTimer = null;
+    if (editFlushInFlight) {
+        return editFlushInFlight;
+    }
+    if (pendingEdits.length === 0) {
+        return Promise.resolve();
+    }
+
+    const batch = pendingEdits;
+    pendingEdits = [];
+    let reload = false;
+    editFlushInFlight = sendEdits(batch, editsVersion)
         .then(data => {
             if (data.success) {
-                showStatus(`Speaker "${speakerName}" assigned to segment`, 'success');
+                editsVersion = data.version;
+                advanceServerSegments(data.sent);
+                if (data.dropped > 0) {
+                    showStatus(`Saved ${data.applied} edit${data.applied === 1 ? '' : 's'}; ${data.dropped} discarded because their segments were changed elsewhere`, 'error');
+                } else {
+                    showStatus(`Saved ${data.applied} edit${data.applied === 1 ? '' : 's'}`, 'success');
+                }
+                // After a conflict the edits were applied on top of someone else's changes; show the result
+                reload = Boolean(data.rebased);
+            } else if (Number.isInteger(data.operation)) {
+                // One operation is invalid; discard it and send the others again
+                pendingEdits = data.sent.filter((_, i) => i !== data.operation).concat(pendingEdits);
+                showStatus('Edit discarded: ' + data.error, 'error');
+                reload = true;
             } else {
-                showStatus('Error updating speaker: ' + data.error, 'error');
+                showStatus('Error saving edits: ' + data.error, 'error');
+                reload = true;
             }
         })
         .catch(error => {
-            showStatus('Error updating speaker: ' + error.message, 'error');
+            // Keep the edits so the next flush retries them
+            pendingEdits = batch.concat(pendingEdits);
+            showStatus('Error saving edits: ' + error.message, 'error');
+        })
+        .finally(() => {
+            editFlushInFlight = null;
+            if (reload) {
+                // Sends whatever is still pending before reloading
+                loadSegments();
+            } else if (pendingEdits.length > 0 && !editFlushTimer) {
+                editFlushTimer = setTimeout(flushEdits, EDIT_FLUSH_DELAY_MS);
+            }
         });
+    return editFlushInFlight;
+}
+
+function resetEdits() {
+    clearTimeout(editFlushTimer);
+    editFlushTimer = null;
+    pendingEdits = [];
+    editsVersion = null;
+    serverSegments = new Map();
+}
+
+// Edits refer to segment ids and the version of the current transcript, so they are
+// saved before the session switches to another one and never carried over to it
+function switchTranscript() {
+    return flushEdits().then(flushEdits).then(resetEdits);
+}
+
+function editSegmentIds(operation) {
+    return operation.op === 'merge' ? operation.segment_ids : [operation.segment_id];
+}
+
+function rememberServerSegments(segments) {
+    serverSegments = new Map(segments.map(s => [s.id, { start: s.start, end: s.end, text: s.text, speaker: s.speaker }]));
+}
+
+// Saved edits are applied to the snapshot as the server applied them; segments touched by
+// merges and splits are left out, so edits to them are only kept after a reload
+function advanceServerSegments(operations) {
+    operations.forEach(op => {
+        const segment = serverSegments.get(op.segment_id);
+        if (op.op === 'assign' && segment) {
+            segment.speaker = op.speaker;
+        } else if (op.op === 'edit_text' && segment) {
+            segment.text = op.text;
+        } else {
+            editSegmentIds(op).forEach(id => serverSegments.delete(id));
+        }
+    });
+}
+
+function segmentUnchanged(id, latest) {
+    const before = serverSegments.get(id);
+    const now = latest.get(id);
+    return Boolean(before && now) && before.start === now.start && before.end === now.end &&
+        before.text === now.text && before.speaker === now.speaker;
+}
+
+function sendEdits(batch, baseVersion, attempt = 0) {
+    const body = { operations: batch };
+    if (baseVersion !== null) {
+        body.base_version = baseVersion;
     }
+    return fetch('/batch_edit_segments', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    })
+    .then(response => response.json().then(data => {
+        if (response.status !== 409) {
+            return Object.assign(data, { sent: batch });
+        }
+        if (attempt >= EDIT_CONFLICT_RETRIES) {
+            return { error: 'Segments keep changing on the server; reload them and redo the edits', sent: batch };
+        }
+        // The segments changed underneath us: only edits to segments nobody else changed are
+        // re-applied to the latest version, the others would overwrite someone's work
+        return fetch('/get_segments')
+            .then(response => response.json())
+            .then(latest => {
+                if (latest.error) {
+                    return { error: latest.error, sent: batch };
+                }
+                const latestById = new Map(latest.segments.map(s => [s.id, s]));
+                const keep = op => editSegmentIds(op).every(id => segmentUnchanged(id, latestById));
+                const rebased = batch.filter(keep);
+                // Edits still waiting in the buffer would be sent against the new version unchecked
+                const waiting = pendingEdits.filter(keep);
+                const dropped = batch.length - rebased.length + pendingEdits.length - waiting.length;
+                pendingEdits = waiting;
+                rememberServerSegments(latest.segments);
+                if (rebased.length === 0) {
+                    return { success: true, version: latest.version, applied: 0, rebased: true, dropped, sent: rebased };
+                }
+                return sendEdits(rebased, latest.version, attempt + 1)
+                    .then(result => Object.assign(result, { rebased: true, dropped: dropped + (result.dropped || 0) }));
+            });
+    }));
 }
 
+window.addEventListener('beforeunload', function() {
+    if (pendingEdits.length > 0) {
+        const edits = { operations: pendingEdits };
+        if (editsVersion !== null) {
+            edits.base_version = editsVersion;
+        }
+        const body = new Blob([JSON.stringify(edits)], { type: 'application/json' });
+        navigator.sendBeacon('/batch_edit_segments', body);
+    }
+});
+
 // Utility functions
 function formatTime(seconds) {
     const mins = Math.floor(seconds / 60);
@@ -0,0 +1,279 @@
+import os
+import json
+import copy
+import logging
+import multiprocessing
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torchaudio
+from artifact_store import ArtifactStore
+from content_hash import hash_file, hash_params
+from speaker_identification import denoise_audio, load_verification_model, speech_clip
+from tracing import span
+from vad import speech_regions, vad_enabled
+
+logger = logging.getLogger(__name__)
+
+MIN_SEGMENT_SECONDS = 0.1
+EMBEDDING_MODEL = "speechbrain/spkrec-ecapa-voxceleb"
+
+
+def load_segments(results_file: str):
+    """Segments of a whisper/labels file, which may be a bare list or a {"segments": [...]} dict"""
+    results = json.load(open(results_file))
+    return results["segments"] if "segments" in results else results
+
+
+def segment_bounds(seg, sr: int, num_samples: int):
+    """Sample bounds of a segment, or None when FileProcessor would skip it"""
+    start_sample = int(seg["start"] * sr)
+    end_sample = int(seg["end"] * sr)
+    if start_sample >= end_sample or start_sample < 0 or end_sample > num_samples:
+        return None
+    if end_sample - start_sample < int(MIN_SEGMENT_SECONDS * sr):
+        return None
+    return start_sample, end_sample
+
+
+def embed_clips(verification, clips, batch_size: int = 16):
+    """ECAPA embeddings of (channels, samples) clips, batched by similar length.
+
+    Returns an array of shape (len(clips), channels, dim). Each channel is embedded as
+    its own batch item, exactly like ``verify_batch`` does for multi-channel audio.
+    """
+    if not clips:
+        return np.zeros((0, 0, 0), dtype=np.float32)
+    order = sorted(range(len(clips)), key=lambda i: clips[i].shape[-1])
+    num_channels = clips[0].shape[0]
+    embeddings = [None] * len(clips)
+    with span("embedding", clips=len(clips), samples=sum(c.shape[-1] for c in clips)), torch.no_grad():
+        for batch_start in range(0, len(order), batch_size):
+            batch = [clips[i] for i in order[batch_start:batch_start + batch_size]]
+            max_len = max(c.shape[-1] for c in batch)
+            wavs = torch.zeros(len(batch) * num_channels, max_len)
+            lens = torch.zeros(len(batch) * num_channels)
+            for j, clip in enumerate(batch):
+                wavs[j * num_channels:(j + 1) * num_channels, :clip.shape[-1]] = clip
+                lens[j * num_channels:(j + 1) * num_channels] = clip.shape[-1] / max_len
+            emb = verification.encode_batch(wavs, lens, normalize=False).squeeze(1).cpu().numpy()
+            for j, i in enumerate(order[batch_start:batch_start + batch_size]):
+                embeddings[i] = emb[j * num_channels:(j + 1) * num_channels]
+    return np.stack(embeddings).astype(np.float32)
+
+
+def cosine_scores(segment_embeddings: np.ndarray, reference_embeddings: np.ndarray) -> np.ndarray:
+    """(segments, speakers) cosine scores, averaged over channels like FileProcessor's score.mean()"""
+    seg = segment_embeddings / np.maximum(np.linalg.norm(segment_embeddings, axis=-1, keepdims=True), 1e-6)
+    ref = reference_embeddings / np.maximum(np.linalg.norm(reference_embeddings, axis=-1, keepdims=True), 1e-6)
+    return np.einsum("scd,kcd->skc", seg, ref).mean(axis=-1)
+
+
+def assign_speakers(segments, scores: np.ndarray, speakers, threshold: float):
+    """Label unlabeled segments with their best-scoring speaker when it clears the threshold"""
+    results = {"segments": copy.deepcopy(segments)}
+    if not speakers:
+        return results
+    best = np.argmax(scores, axis=1)
+    best_score = scores[np.arange(len(scores)), best]
+    for i, seg in enumerate(results["segments"]):
+        if seg.get("speaker", "") != "" or np.isnan(best_score[i]):
+            continue
+        if best_score[i] > threshold:
+            seg["speaker"] = speakers[best[i]]
+    return results
+
+
+# Per-process state of sweep workers: the raw audio and the model are loaded once per worker
+_worker_state = {}
+
+
+def _init_worker(file_path: str, num_threads: int = None):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    _worker_state["audio"], _worker_state["sr"] = torchaudio.load(file_path)
+    _worker_state["file_path"] = file_path
+    # From the samples just loaded, so inputs only torchaudio can decode (e.g. mp4) work too
+    _worker_state["speech_regions"] = (speech_regions(file_path, load=lambda: (_worker_state["audio"], _worker_state["sr"]))
+                                       if vad_enabled() else None)
+    _worker_state["verification"] = load_verification_model()
+
+
+def _embedding_params(denoise_prop) -> dict:
+    regions = _worker_state["speech_regions"]
+    return {"denoise_prop": denoise_prop, "model": EMBEDDING_MODEL,
+            "vad": hash_params(regions.tolist()) if regions is not None else None}
+
+
+def _clip(audio, bounds):
+    """Speech-only samples of a segment, exactly as FileProcessor embeds them"""
+    return speech_clip(audio, _worker_state["sr"], bounds[0], bounds[1], _worker_state["speech_regions"])
+
+
+def _cached_segment_embeddings(artifacts: ArtifactStore, audio_hash: str, denoise_prop, all_bounds, get_audio):
+    """Embeddings of the given sample bounds, from the artifact store when already computed"""
+    params = _embedding_params(denoise_prop)
+    inputs = {"audio": audio_hash, "segments": hash_params(all_bounds)}
+    key = artifacts.key("segment_embeddings", inputs, params)
+    manifest = artifacts.lookup("segment_embeddings", key)
+    if manifest is None:
+        logger.info(f"Embedding {len(all_bounds)} segments for denoise_prop={denoise_prop}")
+        clips = [_clip(get_audio(), bounds) for bounds in all_bounds]
+        np.save(artifacts.output_path("segment_embeddings", key, "embeddings.npy"),
+                embed_clips(_worker_state["verification"], clips))
+        manifest = artifacts.commit("segment_embeddings", key, inputs, params, {"embeddings": "embeddings.npy"})
+    return np.load(artifacts.path(manifest, "embeddings"))
+
+
+def _run_denoise_point(task):
+    """Score every (reference set, threshold) point that shares one denoise setting"""
+    audio_hash, denoise_prop, reference_sets, thresholds, artifacts_root = task
+    artifacts = ArtifactStore(artifacts_root)
+    raw_audio, sr = _worker_state["audio"], _worker_state["sr"]
+    verification = _worker_state["verification"]
+    num_samples = raw_audio.shape[-1]
+    params = _embedding_params(denoise_prop)
+    audio = None
+
+    def get_audio():
+        nonlocal audio
+        if audio is None:
+            audio = denoise_audio(raw_audio, sr, denoise_prop) if denoise_prop is not None else raw_audio
+        return audio
+
+    # Every distinct segment across reference sets is embedded once per denoise setting
+    all_bounds = sorted({b for segments in reference_sets.values()
+                         for b in (segment_bounds(s, sr, num_samples) for s in segments) if b})
+    segment_embeddings = _cached_segment_embeddings(artifacts, audio_hash, denoise_prop, all_bounds, get_audio)
+    row_for_bounds = {b: i for i, b in enumerate(all_bounds)}
+
+    points = []
+    for reference_name, segments in reference_sets.items():
+        speakers, references = _reference_segments(segments, sr, num_samples)
+        ref_inputs = {"audio": audio_hash, "references": hash_params(references)}
+        ref_key = artifacts.key("reference_embeddings", ref_inputs, params)
+        ref_manifest = artifacts.lookup("reference_embeddings", ref_key)
+        if ref_manifest is None:
+            # Same reference construction as FileProcessor: each speaker's labeled segments concatenated in time order
+            clips = [torch.cat([_clip(get_audio(), b) for b in references[s]], dim=-1) for s in speakers]
+            np.save(artifacts.output_path("reference_embeddings", ref_key, "embeddings.npy"), embed_clips(verification, clips))
+            ref_manifest = artifacts.commit("reference_embeddings", ref_key, ref_inputs, params, {"embeddings": "embeddings.npy"})
+        reference_embeddings = np.load(artifacts.path(ref_manifest, "embeddings"))
+
+        rows = [row_for_bounds.get(segment_bounds(s, sr, num_samples)) for s in segments]
+        scores = np.full((len(segments), len(speakers)), np.nan, dtype=np.float32)
+        valid = [i for i, row in enumerate(rows) if row is not None]
+        if speakers and valid:
+            with span("scoring", segments=len(valid), speakers=len(speakers)):
+                scores[valid] = cosine_scores(segment_embeddings[[rows[i] for i in valid]], reference_embeddings)
+        for threshold in thresholds:
+            points.append({
+                "denoise_prop": denoise_prop,
+                "verification_threshold": threshold,
+                "reference": reference_name,
+                "speaker_results": assign_speakers(segments, scores, speakers, threshold),
+            })
+    return points
+
+
+def _reference_segments(segments, sr: int, num_samples: int):
+    references = {}
+    for seg in sorted(segments, key=lambda x: x["start"]):
+        if seg.get("speaker"):
+            bounds = segment_bounds(seg, sr, num_samples)
+            if bounds:
+                references.setdefault(seg["speaker"], []).append(bounds)
+    speakers = sorted(references)
+    return speakers, references
+
+
+class SweepRunner:
+    """Runs FileProcessor-equivalent speaker identification over a parameter grid.
+
+    Work shared between grid points is done once: each worker loads the audio and the
+    ECAPA model a single time, segments are embedded once per denoise setting, reference
+    embeddings once per (denoise setting, reference set), and thresholds only re-threshold
+    the score matrix. Embeddings are cached in the artifact store, so re-running a grid
+    with extra thresholds or reference sets skips the embedding passes entirely.
+    Independent denoise settings run in parallel worker processes.
+    """
+
+    def __init__(self, file_path: str, whisper_results_file: str, max_workers: int = 1,
+                 artifacts_root: str = "data/artifacts"):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        self.file_path = file_path
+        self.whisper_results_file = whisper_results_file
+        self.max_workers = max_workers
+        self.artifacts_root = artifacts_root
+
+    def run(self, denoise_props=(None,), verification_thresholds=(0.2,), reference_sets=None):
+        """Return one result per grid point.
+
+        ``denoise_props`` uses None for "no denoising". ``reference_sets`` maps a name to a
+        labeled segment list (e.g. one per reference duration); by default the labels in
+        the whisper results file are used.
+        """
+        if reference_sets is None:
+            reference_sets = {None: load_segments(self.whisper_results_file)}
+        audio_hash = hash_file(self.file_path)
+        tasks = [(audio_hash, prop, reference_sets, list(verification_thresholds), self.artifacts_root)
+                 for prop in denoise_props]
+
+        if self.max_workers <= 1 or len(tasks) == 1:
+            if _worker_state.get("file_path") != self.file_path:
+                _init_worker(self.file_path)
+            results = [_run_denoise_point(task) for task in tasks]
+        else:
+            num_threads = max(1, (os.cpu_count() or 1) // self.max_workers)
+            if vad_enabled():
+                # Detect speech once here, so the workers all find it in the artifact store
+                speech_regions(self.file_path, load=lambda: torchaudio.load(self.file_path))
+            # CUDA cannot be re-initialized in forked children
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                     initializer=_init_worker, initargs=(self.file_path, num_threads)) as pool:
+                results = list(pool.map(_run_denoise_point, tasks))
+        return [point for points in results for point in points]
+
+    def segment_embeddings(self, segments, denoise_prop=None):
+        """Embeddings aligned with ``segments``; rows of segments FileProcessor would skip are NaN"""
+        if _worker_state.get("file_path") != self.file_path:
+            _init_worker(self.file_path)
+        raw_audio, sr = _worker_state["audio"], _worker_state["sr"]
+        num_samples = raw_audio.shape[-1]
+        bounds = [segment_bounds(s, sr, num_samples) for s in segments]
+        all_bounds = sorted({b for b in bounds if b})
+        audio = {}
+
+        def get_audio():
+            if "audio" not in audio:
+                audio["audio"] = denoise_audio(raw_audio, sr, denoise_prop) if denoise_prop is not None else raw_audio
+            return audio["audio"]
+
+        embeddings = _cached_segment_embeddings(ArtifactStore(self.artifacts_root), hash_file(self.file_path),
+                                                denoise_prop, all_bounds, get_audio)
+        row_for_bounds = {b: i for i, b in enumerate(all_bounds)}
+        aligned = np.full((len(segments),) + embeddings.shape[1:], np.nan, dtype=np.float32)
+        for i, b in enumerate(bounds):
+            if b:
+                aligned[i] = embeddings[row_for_bounds[b]]
+        return aligned
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--whisper_initial_labels", type=str, default="data/whisper_results.json")
+    parser.add_argument("--audio_path", type=str, default="data/videos/video1.wav")
+    parser.add_argument("--denoise_props", type=float, nargs="*", default=[0.1, 0.2, 0.3, 0.4, 0.5])
+    parser.add_argument("--include_no_denoise", action="store_true")
+    parser.add_argument("--verification_thresholds", type=float, nargs="+", default=[0.0, 0.2])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output_path", type=str, default="data/sweep_results.json")
+    args = parser.parse_args()
+
+    denoise_props = ([None] if args.include_no_denoise else []) + args.denoise_props
+    runner = SweepRunner(args.audio_path, args.whisper_initial_labels, max_workers=args.workers)
+    points = runner.run(denoise_props=denoise_props, verification_thresholds=args.verification_thresholds)
+    json.dump(points, open(args.output_path, "w"))
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import resource
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the wall time histogram exported to Prometheus
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, float("inf"))
+
+_enabled = os.environ.get("TRACING", "").lower() in ("1", "true", "yes")
+_log_path = os.environ.get("TRACING_LOG")
+# Each process keeps its span statistics here, so /metrics covers the inference processes and all web workers
+_stats_dir = os.environ.get("TRACING_STATS_DIR", "data/spans")
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+
+
+def enable(log_path: str = None):
+    """Turn span recording on; spans are also appended as JSON lines to ``log_path`` if given"""
+    global _enabled, _log_path
+    _enabled = True
+    if log_path:
+        _log_path = log_path
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Span:
+    """One timed pipeline step; attributes such as input sizes can be added while it runs"""
+
+    __slots__ = ("name", "attrs", "parent", "_wall", "_cpu", "_rss")
+
+    def __init__(self, name: str, attrs: dict, parent):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        stack.append(self)
+        self._rss = _peak_rss_bytes()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak_rss = _peak_rss_bytes()
+        _local.stack.pop()
+        record = {
+            "span": self.name,
+            "parent": self.parent,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "peak_rss_bytes": peak_rss,
+            "peak_rss_growth_bytes": peak_rss - self._rss,
+            "error": exc_type.__name__ if exc_type else None,
+            "attrs": self.attrs,
+            "timestamp": time.time(),
+        }
+        _record(record)
+        return False
+
+
+class _NoopSpan:
+    """Returned by ``span`` while tracing is off, so instrumentation costs one flag check"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager timing a block: ``with span("denoise", samples=n) as s: ...``"""
+    if not _enabled:
+        return _NOOP
+    stack = _local.__dict__.get("stack")
+    return Span(name, attrs, stack[-1].name if stack else None)
+
+
+def file_size(path: str):
+    """Size of a file for span attributes, or None if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _record(record: dict):
+    line = json.dumps(record, default=str)
+    logger.info(line)
+    with _lock:
+        stats = _stats.get(record["span"])
+        if stats is None:
+            stats = _stats[record["span"]] = {
+                "count": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": 0, "buckets": [0] * len(BUCKETS)}
+        stats["count"] += 1
+        stats["errors"] += record["error"] is not None
+        stats["wall"] += record["wall_seconds"]
+        stats["cpu"] += record["cpu_seconds"]
+        stats["peak_rss"] = max(stats["peak_rss"], record["peak_rss_bytes"])
+        for i, upper in enumerate(BUCKETS):
+            if record["wall_seconds"] <= upper:
+                stats["buckets"][i] += 1
+                break
+        if _log_path:
+            with open(_log_path, "a") as f:
+                f.write(line + "\n")
+        _write_stats()
+
+
+def _stats_path(pid: int) -> str:
+    return os.path.join(_stats_dir, f"{pid}.json")
+
+
+def _write_stats():
+    """Publish this process's statistics for the other processes (caller holds ``_lock``)"""
+    try:
+        os.makedirs(_stats_dir, exist_ok=True)
+        path = _stats_path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(_stats, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logger.warning(f"Failed to write span statistics to {_stats_dir}: {e}")
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merged_stats() -> dict:
+    """Statistics of this process plus those published by other live processes"""
+    with _lock:
+        merged = {name: dict(s, buckets=list(s["buckets"])) for name, s in _stats.items()}
+    try:
+        names = os.listdir(_stats_dir)
+    except OSError:
+        return merged
+    for file_name in names:
+        pid, ext = os.path.splitext(file_name)
+        if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        if not _process_alive(int(pid)):
+            # Counters of a process that exited are dropped; Prometheus treats that as a counter reset
+            try:
+                os.remove(_stats_path(int(pid)))
+            except OSError:
+                pass
+            continue
+        try:
+            with open(_stats_path(int(pid))) as f:
+                other = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, s in other.items():
+            stats = merged.setdefault(name, {"count": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "peak_rss": 0,
+                                             "buckets": [0] * len(BUCKETS)})
+            for field in ("count", "errors", "wall", "cpu"):
+                stats[field] += s[field]
+            stats["peak_rss"] = max(stats["peak_rss"], s["peak_rss"])
+            stats["buckets"] = [a + b for a, b in zip(stats["buckets"], s["buckets"])]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    """Span statistics aggregated over all processes in the Prometheus text exposition format"""
+    stats = _merged_stats()
+    lines = [
+        "# HELP pipeline_span_seconds Wall time of pipeline spans.",
+        "# TYPE pipeline_span_seconds histogram",
+    ]
+    for name, s in sorted(stats.items()):
+        label = f'span="{_escape(name)}"'
+        cumulative = 0
+        for upper, count in zip(BUCKETS, s["buckets"]):
+            cumulative += count
+            le = "+Inf" if upper == float("inf") else repr(upper)
+            lines.append(f'pipeline_span_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        lines.append(f"pipeline_span_seconds_sum{{{label}}} {s['wall']}")
+        lines.append(f"pipeline_span_seconds_count{{{label}}} {s['count']}")
+    for metric, help_text, kind, field in (
+        ("pipeline_span_cpu_seconds_total", "CPU time of pipeline spans.", "counter", "cpu"),
+        ("pipeline_span_errors_total", "Pipeline spans that raised.", "counter", "errors"),
+        ("pipeline_span_peak_rss_bytes", "Highest process peak RSS seen at the end of a span.", "gauge", "peak_rss"),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, s in sorted(stats.items()):
+            lines.append(f'{metric}{{span="{_escape(name)}"}} {s[field]}')
+    lines.append("# HELP process_peak_rss_bytes Peak resident set size of this process.")
+    lines.append("# TYPE process_peak_rss_bytes gauge")
+    lines.append(f"process_peak_rss_bytes {_peak_rss_bytes()}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        if os.path.exists(_stats_path(os.getpid())):
+            os.remove(_stats_path(os.getpid()))
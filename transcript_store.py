@@ -0,0 +1,180 @@
+import os
+import json
+import numpy as np
+
+# Fields kept in the JSON segment table that the UI and speaker identification read
+SEGMENT_FIELDS = ("id", "start", "end", "text", "speaker")
+
+# Per-segment Whisper decoding statistics moved out of the JSON table
+SEGMENT_STAT_COLUMNS = {
+    "seek": np.int32,
+    "temperature": np.float32,
+    "avg_logprob": np.float32,
+    "compression_ratio": np.float32,
+    "no_speech_prob": np.float32,
+}
+
+
+def words_path_for(results_file: str) -> str:
+    """Path of the columnar word sidecar that belongs to a segment table"""
+    return os.path.splitext(results_file)[0] + "_words.npz"
+
+
+def source_transcript(results_file: str) -> str:
+    """Whisper segment table a speaker results file was derived from (the file itself if it is one)"""
+    root, ext = os.path.splitext(results_file)
+    while root.endswith("_speaker_results"):
+        root = root[:-len("_speaker_results")]
+    return root + ext
+
+
+def _offsets(lengths) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _encode_strings(strings):
+    """Pack strings into one utf-8 byte buffer plus offsets"""
+    encoded = [s.encode("utf-8") for s in strings]
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, _offsets([len(e) for e in encoded])
+
+
+def split_whisper_result(result: dict):
+    """Split a raw Whisper result into a slim segment table and columnar arrays"""
+    segments = result.get("segments", [])
+    table = {
+        "language": result.get("language"),
+        "segments": [{k: seg[k] for k in SEGMENT_FIELDS if k in seg} for seg in segments],
+    }
+
+    words = [w for seg in segments for w in seg.get("words", [])]
+    word_text, word_text_offsets = _encode_strings([w["word"] for w in words])
+    columns = {
+        "segment_word_offsets": _offsets([len(seg.get("words", [])) for seg in segments]),
+        "segment_ids": np.array([seg.get("id", i) for i, seg in enumerate(segments)], dtype=np.int64),
+        "word_start": np.array([w["start"] for w in words], dtype=np.float32),
+        "word_end": np.array([w["end"] for w in words], dtype=np.float32),
+        "word_probability": np.array([w.get("probability", np.nan) for w in words], dtype=np.float32),
+        "word_text": word_text,
+        "word_text_offsets": word_text_offsets,
+        "segment_token_offsets": _offsets([len(seg.get("tokens", [])) for seg in segments]),
+        "tokens": np.array([t for seg in segments for t in seg.get("tokens", [])], dtype=np.int32),
+    }
+    for name, dtype in SEGMENT_STAT_COLUMNS.items():
+        columns[name] = np.array([seg.get(name, np.nan) for seg in segments], dtype=dtype)
+    return table, columns
+
+
+def save_transcript(result: dict, segment_dir: str, results_name: str = "whisper_results.json"):
+    """Write a Whisper result as a slim JSON segment table plus an .npz word sidecar.
+
+    Returns the slim table, which is what the UI endpoints read and rewrite.
+    """
+    table, columns = split_whisper_result(result)
+    results_file = os.path.join(segment_dir, results_name)
+    with open(results_file, "w") as f:
+        json.dump(table, f, separators=(",", ":"))
+    np.savez_compressed(words_path_for(results_file), **columns)
+    return table
+
+
+class WordTable:
+    """Lazily loaded word-level columns for one transcript.
+
+    Arrays are only read from the .npz sidecar when first accessed, so loading the
+    segment table for the UI never touches word timestamps.
+    """
+
+    def __init__(self, words_file: str):
+        self.words_file = words_file
+        self._npz = None
+        self._word_strings = None
+
+    @classmethod
+    def for_results(cls, results_file: str):
+        """Return the word table next to a segment table, or None if there is none"""
+        words_file = words_path_for(results_file)
+        if not os.path.exists(words_file):
+            return None
+        return cls(words_file)
+
+    def column(self, name: str) -> np.ndarray:
+        if self._npz is None:
+            self._npz = np.load(self.words_file)
+        return self._npz[name]
+
+    @property
+    def start(self) -> np.ndarray:
+        return self.column("word_start")
+
+    @property
+    def end(self) -> np.ndarray:
+        return self.column("word_end")
+
+    @property
+    def probability(self) -> np.ndarray:
+        return self.column("word_probability")
+
+    @property
+    def segment_index(self) -> np.ndarray:
+        """Index into the segment table of each word"""
+        offsets = self.column("segment_word_offsets")
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+    @property
+    def segment_ids(self):
+        """Id of the segment of each word, or None for sidecars written before ids were stored"""
+        if self._npz is None:
+            self._npz = np.load(self.words_file)
+        if "segment_ids" not in self._npz.files:
+            return None
+        return self.column("segment_ids")[self.segment_index]
+
+    @property
+    def words(self):
+        if self._word_strings is None:
+            data = self.column("word_text").tobytes()
+            offsets = self.column("word_text_offsets")
+            self._word_strings = [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+        return self._word_strings
+
+    def __len__(self):
+        return len(self.start)
+
+    def segment_words(self, segment_index: int):
+        """Word dicts of one segment, in the shape Whisper produces them"""
+        offsets = self.column("segment_word_offsets")
+        lo, hi = offsets[segment_index], offsets[segment_index + 1]
+        words, start, end, probability = self.words, self.start, self.end, self.probability
+        return [
+            {"word": words[i], "start": float(start[i]), "end": float(end[i]), "probability": float(probability[i])}
+            for i in range(lo, hi)
+        ]
+
+    def close(self):
+        if self._npz is not None:
+            self._npz.close()
+            self._npz = None
+
+
+def load_full_result(results_file: str) -> dict:
+    """Rebuild the raw Whisper result (words, tokens and decoding stats) from the split format"""
+    with open(results_file) as f:
+        result = json.load(f)
+    word_table = WordTable.for_results(results_file)
+    if word_table is None:
+        return result
+
+    token_offsets = word_table.column("segment_token_offsets")
+    tokens = word_table.column("tokens")
+    stats = {name: word_table.column(name) for name in SEGMENT_STAT_COLUMNS}
+    for i, seg in enumerate(result["segments"]):
+        seg["tokens"] = tokens[token_offsets[i]:token_offsets[i + 1]].tolist()
+        for name, values in stats.items():
+            seg[name] = values[i].item()
+        seg["words"] = word_table.segment_words(i)
+    result["text"] = "".join(seg["text"] for seg in result["segments"])
+    word_table.close()
+    return result
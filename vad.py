@@ -0,0 +1,185 @@
+"""
+Energy-based voice activity detection.
+
+Frames of ~30 ms are scored by their energy in one streaming pass over the audio; frames
+well above the recording's noise floor are speech. Runs of speech separated by short
+pauses are merged, isolated blips dropped and every region padded, so the result errs
+on the side of keeping audio. Regions are cached in the artifact store per audio content
+hash, so a file is only scanned once.
+
+Whisper and the speaker embeddings then only see the speech regions; ``SpeechTimeline``
+maps times in the concatenated speech back to the original recording.
+"""
+
+import os
+import logging
+import numpy as np
+from artifact_store import ArtifactStore
+from audio_mixing import audio_info, iter_frames
+from content_hash import hash_file
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+VAD_PARAMS = {
+    "frame_seconds": 0.03,
+    # Speech must be this far above the noise floor (the 10th percentile frame energy)
+    "margin_db": 12.0,
+    "floor_percentile": 10,
+    # Pauses shorter than this stay inside a region, shorter regions are dropped
+    "min_silence": 0.6,
+    "min_speech": 0.2,
+    "padding": 0.25,
+}
+# Below this much silence, cutting it out is not worth the seams
+MAX_SPEECH_FRACTION = 0.9
+
+
+def vad_enabled() -> bool:
+    """Whether silence is skipped before transcription and embedding (on unless VAD=0)"""
+    return os.environ.get("VAD", "1").lower() not in ("0", "false", "no")
+
+
+def frame_energy_db(file_path: str, frame_seconds: float):
+    """Mean energy in dB of consecutive frames over all channels; returns (energies, frame duration in seconds)"""
+    _, _, sample_rate = audio_info(file_path)
+    frame = max(1, int(round(sample_rate * frame_seconds)))
+    energies = [np.square(frames, dtype=np.float64).mean(axis=(1, 2)) for frames in iter_frames(file_path, frame)]
+    if not energies:
+        return np.zeros(0), frame / sample_rate
+    return 10.0 * np.log10(np.concatenate(energies) + 1e-12), frame / sample_rate
+
+
+def samples_energy_db(samples, sample_rate: int, frame_seconds: float):
+    """``frame_energy_db`` of (channels, samples) audio that is already in memory, a block of frames at a time"""
+    frame = max(1, int(round(sample_rate * frame_seconds)))
+    samples = np.asarray(samples, dtype=np.float32)
+    energies = []
+    step = frame * 1024
+    for start in range(0, samples.shape[-1], step):
+        block = samples[:, start:start + step]
+        whole = block.shape[-1] // frame * frame
+        if whole:
+            frames = block[:, :whole].reshape(block.shape[0], -1, frame)
+            energies.append(np.square(frames, dtype=np.float64).mean(axis=(0, 2)))
+        # Only the last block can end in a shorter frame
+        if whole < block.shape[-1]:
+            energies.append(np.square(block[:, whole:], dtype=np.float64).mean(keepdims=True).ravel())
+    if not energies:
+        return np.zeros(0), frame / sample_rate
+    return 10.0 * np.log10(np.concatenate(energies) + 1e-12), frame / sample_rate
+
+
+def detect_speech(energy_db: np.ndarray, hop: float, duration: float, params: dict = VAD_PARAMS) -> np.ndarray:
+    """(regions, 2) array of [start, end) speech regions in seconds from per-frame energies"""
+    if energy_db.size == 0:
+        return np.zeros((0, 2))
+    floor = np.percentile(energy_db, params["floor_percentile"])
+    # Without a clear gap between the floor and the loud frames there is nothing to tell apart
+    if np.percentile(energy_db, 95) - floor < 2 * params["margin_db"]:
+        return np.array([[0.0, duration]])
+    speech = energy_db > floor + params["margin_db"]
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], speech.astype(np.int8), [0]])))
+    starts, ends = edges[0::2] * hop, np.minimum(edges[1::2] * hop, duration)
+    starts, ends = _merge(starts, ends, params["min_silence"])
+    keep = ends - starts >= params["min_speech"]
+    starts = np.maximum(starts[keep] - params["padding"], 0.0)
+    ends = np.minimum(ends[keep] + params["padding"], duration)
+    return np.stack(_merge(starts, ends, 0.0), axis=1) if starts.size else np.zeros((0, 2))
+
+
+def _merge(starts: np.ndarray, ends: np.ndarray, min_gap: float):
+    """Merge sorted regions whose gap is not longer than ``min_gap``"""
+    if starts.size == 0:
+        return starts, ends
+    first = np.concatenate([[True], starts[1:] - ends[:-1] > min_gap])
+    group_starts = np.flatnonzero(first)
+    return starts[group_starts], np.maximum.reduceat(ends, group_starts)
+
+
+def speech_regions(file_path: str, artifacts_root: str = "data/artifacts", load=None) -> np.ndarray:
+    """Speech regions of an audio file in seconds, computed once per content hash.
+
+    The file is streamed with the WAV/libsndfile readers. For inputs they cannot open, such
+    as video containers, ``load`` returns the decoded (channels, samples) audio and its sample
+    rate instead; it is only called when the regions are not cached yet.
+    """
+    artifacts = ArtifactStore(artifacts_root)
+    inputs = {"audio": hash_file(file_path)}
+    key = artifacts.key("vad", inputs, VAD_PARAMS)
+    manifest = artifacts.lookup("vad", key)
+    if manifest is None:
+        if load is not None:
+            samples, sample_rate = load()
+            num_frames = samples.shape[-1]
+        else:
+            num_frames, _, sample_rate = audio_info(file_path)
+        with span("vad", samples=num_frames) as s:
+            if load is not None:
+                energy_db, hop = samples_energy_db(samples, sample_rate, VAD_PARAMS["frame_seconds"])
+            else:
+                energy_db, hop = frame_energy_db(file_path, VAD_PARAMS["frame_seconds"])
+            regions = detect_speech(energy_db, hop, num_frames / sample_rate)
+            s.set(regions=len(regions), speech_seconds=float(np.sum(regions[:, 1] - regions[:, 0])))
+        np.save(artifacts.output_path("vad", key, "regions.npy"), regions)
+        manifest = artifacts.commit("vad", key, inputs, VAD_PARAMS, {"regions": "regions.npy"})
+    return np.load(artifacts.path(manifest, "regions"))
+
+
+def speech_parts(start_sample: int, end_sample: int, regions: np.ndarray, sample_rate: int, min_samples: int = 0):
+    """Sample ranges of [start_sample, end_sample) inside speech regions.
+
+    Falls back to the whole range when the speech in it totals less than ``min_samples``,
+    so a segment is never dropped just because the detector missed it.
+    """
+    bounds = np.round(regions * sample_rate).astype(np.int64)
+    first = np.searchsorted(bounds[:, 1], start_sample, side="right")
+    last = np.searchsorted(bounds[:, 0], end_sample, side="left")
+    parts = [(int(max(start, start_sample)), int(min(end, end_sample))) for start, end in bounds[first:last]]
+    if sum(end - start for start, end in parts) < max(min_samples, 1):
+        return [(start_sample, end_sample)]
+    return parts
+
+
+class SpeechTimeline:
+    """The speech regions of a recording laid end to end, with the mapping back to the original times"""
+
+    def __init__(self, regions: np.ndarray, duration: float):
+        self.regions = regions
+        self.duration = duration
+        # offsets[i] is where region i starts in the concatenated speech
+        self.offsets = np.concatenate([[0.0], np.cumsum(regions[:, 1] - regions[:, 0])])
+
+    @property
+    def speech_fraction(self) -> float:
+        return float(self.offsets[-1] / self.duration) if self.duration > 0 else 1.0
+
+    def worth_compacting(self) -> bool:
+        return len(self.regions) > 0 and self.speech_fraction <= MAX_SPEECH_FRACTION
+
+    def compact(self, samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """Concatenate the speech regions of a (..., samples) array"""
+        bounds = np.round(self.regions * sample_rate).astype(np.int64)
+        return np.concatenate([samples[..., start:end] for start, end in bounds], axis=-1)
+
+    def to_original(self, times, side: str = "right") -> np.ndarray:
+        """Map times in the concatenated speech to the original recording.
+
+        A time exactly on the seam between two regions maps to the start of the later one
+        with ``side="right"`` (use for start times) and to the end of the earlier one with
+        ``side="left"`` (use for end times).
+        """
+        times = np.asarray(times, dtype=np.float64)
+        index = np.clip(np.searchsorted(self.offsets, times, side=side) - 1, 0, len(self.regions) - 1)
+        return self.regions[index, 0] + (times - self.offsets[index])
+
+    def restore_result(self, result: dict) -> dict:
+        """Shift the segment and word timestamps of a Whisper result back to the original timeline, in place"""
+        items = [seg for seg in result.get("segments", [])]
+        items += [word for seg in items for word in seg.get("words", [])]
+        if items:
+            starts = self.to_original([item["start"] for item in items], side="right")
+            ends = self.to_original([item["end"] for item in items], side="left")
+            for item, start, end in zip(items, starts, ends):
+                item["start"], item["end"] = round(float(start), 3), round(float(max(end, start)), 3)
+        return result
@@ -0,0 +1,73 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def warmup_requested() -> bool:
+    """Whether the apps should preload models in the background (WARMUP=1)"""
+    return os.environ.get("WARMUP", "").lower() in ("1", "true", "yes")
+
+
+class Warmup:
+    """Runs named loading steps (heavy imports, model loads) in a background thread.
+
+    The server can accept requests while the steps run; endpoints that need a model
+    still load it on first use, so warm-up only moves that cost off the first request.
+    ``status`` backs the ``/ready`` endpoint.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self._state = {name: "pending" for name, _ in self.steps}
+        self._errors = {}
+        self._seconds = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        for name, step in self.steps:
+            with self._lock:
+                self._state[name] = "running"
+            start = time.perf_counter()
+            try:
+                step()
+                state = "done"
+            except Exception as e:
+                logger.error(f"Warm-up step {name} failed: {e}", exc_info=True)
+                self._errors[name] = str(e)
+                state = "failed"
+            with self._lock:
+                self._state[name] = state
+                self._seconds[name] = round(time.perf_counter() - start, 3)
+            logger.info(f"Warm-up step {name} {state} in {self._seconds[name]}s")
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def status(self) -> dict:
+        """Readiness summary: ready once every step is done, or right away if warm-up was never started"""
+        with self._lock:
+            steps = dict(self._state)
+            seconds = dict(self._seconds)
+        if not self.started:
+            return {"ready": True, "warmup": "disabled", "steps": steps}
+        if any(state == "failed" for state in steps.values()):
+            warmup = "failed"
+        elif all(state == "done" for state in steps.values()):
+            warmup = "done"
+        else:
+            warmup = "running"
+        return {"ready": warmup == "done", "warmup": warmup, "steps": steps, "seconds": seconds,
+                "errors": dict(self._errors)}
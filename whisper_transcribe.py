@@ -8,18 +8,45 @@ import torch
 from logging import getLogger
 import logging
 import subprocess
+import threading
+from transcript_store import save_transcript
+from vad import SpeechTimeline, speech_regions, vad_enabled
+from tracing import span, file_size
 
 logger = getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def transcribe_with_whisper(file_path: str, segment_dir: str, save_json: bool = True):
-    if not file_path.endswith(".wav"):
-        file_path_wav = os.path.splitext(file_path)[0] + ".wav"
-        if not os.path.exists(file_path_wav):
-            logger.info(f"Extracting audio from video file using FFmpeg: {file_path}")
-            # Use FFmpeg directly for all video formats to avoid moviepy issues
-            try:
-                # Extract audio to WAV format suitable for Whisper
+def whisper_model_name():
+    """Name of the Whisper model used on this machine"""
+    return "large" if torch.cuda.is_available() else "small"
+
+_whisper_models = {}
+# Threaded workers and the warm-up thread may ask for the model at the same time
+_whisper_models_lock = threading.Lock()
+
+def load_whisper_model():
+    """Load the Whisper model once per process and device"""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    key = (whisper_model_name(), device)
+    with _whisper_models_lock:
+        if key not in _whisper_models:
+            with span("whisper_model_load", model=key[0], device=device):
+                _whisper_models[key] = whisper.load_model(key[0], device=device)
+        return _whisper_models[key]
+
+def extract_audio(file_path: str) -> str:
+    """Extract 16 kHz mono WAV audio next to a video file, once; returns the WAV path"""
+    if file_path.endswith(".wav"):
+        return file_path
+    file_path_wav = os.path.splitext(file_path)[0] + ".wav"
+    if not os.path.exists(file_path_wav):
+        logger.info(f"Extracting audio from video file using FFmpeg: {file_path}")
+        # Use FFmpeg directly for all video formats to avoid moviepy issues. It writes to a
+        # temporary file, so a concurrent or interrupted extraction never leaves a partial WAV
+        tmp_path_wav = f"{os.path.splitext(file_path)[0]}.{os.getpid()}.{threading.get_ident()}.tmp.wav"
+        try:
+            # Extract audio to WAV format suitable for Whisper
+            with span("ffmpeg_extract", input_bytes=file_size(file_path)) as s:
                 subprocess.run([
                     'ffmpeg', '-i', file_path,
                     '-vn',  # No video
@@ -27,23 +54,23 @@ def transcribe_with_whisper(file_path: str, segment_dir: str, save_json: bool =
                     '-ar', '16000',  # 16kHz sample rate (good for speech/Whisper)
                     '-ac', '1',  # Mono
                     '-y',  # Overwrite output file if exists
-                    file_path_wav
+                    tmp_path_wav
                 ], check=True, capture_output=True, text=True)
-                logger.info(f"Successfully extracted audio to: {file_path_wav}")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"FFmpeg extraction failed: {e.stderr}")
-                raise Exception(f"Failed to extract audio: {e.stderr}")
-        file_path = file_path_wav
-    else:
-        file_path = file_path
+                os.replace(tmp_path_wav, file_path_wav)
+                s.set(output_bytes=file_size(file_path_wav))
+            logger.info(f"Successfully extracted audio to: {file_path_wav}")
+        except subprocess.CalledProcessError as e:
+            logger.error(f"FFmpeg extraction failed: {e.stderr}")
+            if os.path.exists(tmp_path_wav):
+                os.remove(tmp_path_wav)
+            raise Exception(f"Failed to extract audio: {e.stderr}")
+    return file_path_wav
+
+def transcribe_with_whisper(file_path: str, segment_dir: str, save_json: bool = True):
+    file_path = extract_audio(file_path)
     logger.info("Current file path " + file_path)
     
-    if not torch.cuda.is_available():
-        device = "cpu"
-        model = whisper.load_model("small", device=device)
-    else:
-        device = "cuda"
-        model = whisper.load_model("large", device=device)
+    model = load_whisper_model()
     
     try:
         # if os.path.exists(f"{segment_dir}/whisper_results.json"):
@@ -51,9 +78,23 @@ def transcribe_with_whisper(file_path: str, segment_dir: str, save_json: bool =
         # elif os.path.exists(os.path.join(os.path.dirname(file_path), "whisper_results.json")):
         #     result = json.load(open(os.path.join(os.path.dirname(file_path), "whisper_results.json")))
         # else:
-        result = model.transcribe(file_path, word_timestamps=True)
+        with span("transcribe", input_bytes=file_size(file_path)) as s:
+            audio = whisper.load_audio(file_path)
+            timeline = None
+            if vad_enabled():
+                timeline = SpeechTimeline(speech_regions(file_path), len(audio) / whisper.audio.SAMPLE_RATE)
+            if timeline is not None and timeline.worth_compacting():
+                # Whisper only hears the speech; its timestamps are shifted back afterwards
+                s.set(speech_fraction=round(timeline.speech_fraction, 3))
+                result = timeline.restore_result(model.transcribe(timeline.compact(audio, whisper.audio.SAMPLE_RATE),
+                                                                  word_timestamps=True))
+            else:
+                result = model.transcribe(audio, word_timestamps=True)
+            s.set(segments=len(result.get("segments", [])))
         if save_json:
-            json.dump(result, open(f"{segment_dir}/whisper_results.json", "w"))
+            with span("save_transcript", segments=len(result.get("segments", []))):
+                save_transcript(result, segment_dir)
     except Exception as e:
-        logger.info(str(e))
+        logger.error(f"Transcription of {file_path} failed: {str(e)}")
+        raise
     return result, file_path
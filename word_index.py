@@ -0,0 +1,242 @@
+import os
+import re
+import glob
+import json
+import sqlite3
+import logging
+import threading
+import time
+from datetime import datetime
+from transcript_store import WordTable, words_path_for
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Index rows read per query while looking for phrase hits
+SEARCH_PAGE_ROWS = 500
+
+
+def _tokens(text: str):
+    return TOKEN_RE.findall(text.lower())
+
+
+def video_name_for(results_file: str) -> str:
+    """Recordings are transcribed into data/segments-<video folder>/"""
+    folder = os.path.basename(os.path.dirname(os.path.abspath(results_file)))
+    return folder[len("segments-"):] if folder.startswith("segments-") else folder
+
+
+def iter_words(results_file: str):
+    """Yield (segment_id, start, end, word) in transcript order from either storage format"""
+    with open(results_file) as f:
+        segments = json.load(f).get("segments", [])
+    word_table = WordTable.for_results(results_file)
+    if word_table is not None:
+        segment_ids = word_table.segment_ids
+        if segment_ids is None:
+            # Older sidecars only know segment positions; they match the table unless segments were since deleted from it
+            segment_ids = word_table.segment_index
+            if len(segments) == len(word_table.column("segment_word_offsets")) - 1:
+                segment_ids = [segments[seg].get("id", seg) for seg in segment_ids]
+        for segment_id, word, start, end in zip(segment_ids, word_table.words, word_table.start, word_table.end):
+            yield int(segment_id), float(start), float(end), word
+        word_table.close()
+    else:
+        for i, seg in enumerate(segments):
+            for w in seg.get("words", []):
+                yield seg.get("id", i), w["start"], w["end"], w["word"]
+
+
+class WordIndex:
+    """Full-text index over word-level timestamps of every processed transcript.
+
+    Words are stored one row per word in an SQLite FTS5 table, in transcript order, so a
+    phrase match can be confirmed by reading the rows that follow the first word. A
+    transcript is only re-indexed when its files change.
+    """
+
+    def __init__(self, db_path: str = "data/word_index.sqlite"):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_scan = 0.0
+        self._scan_lock = threading.Lock()
+        self._scanner = None
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    id INTEGER PRIMARY KEY,
+                    results_file TEXT UNIQUE,
+                    video TEXT,
+                    signature TEXT,
+                    num_words INTEGER,
+                    indexed_at TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts5(
+                    word,
+                    transcript_id UNINDEXED,
+                    segment_id UNINDEXED,
+                    start_ms UNINDEXED,
+                    end_ms UNINDEXED,
+                    tokenize = 'unicode61'
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _signature(results_file: str) -> str:
+        parts = []
+        for path in (results_file, words_path_for(results_file)):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        return "|".join(parts)
+
+    def index_transcript(self, results_file: str, video: str = None) -> bool:
+        """Index one transcript; returns False when it was already up to date"""
+        results_file = os.path.abspath(results_file)
+        video = video or video_name_for(results_file)
+        signature = self._signature(results_file)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT id, signature FROM transcripts WHERE results_file = ?", (results_file,)).fetchone()
+            if row is not None and row[1] == signature:
+                return False
+            rows = [
+                (word, segment_id, int(round(start * 1000)), int(round(end * 1000)))
+                for segment_id, start, end, word in iter_words(results_file)
+            ]
+            if row is not None:
+                transcript_id = row[0]
+                conn.execute("DELETE FROM words WHERE transcript_id = ?", (transcript_id,))
+                conn.execute(
+                    "UPDATE transcripts SET video = ?, signature = ?, num_words = ?, indexed_at = ? WHERE id = ?",
+                    (video, signature, len(rows), datetime.now().isoformat(), transcript_id))
+            else:
+                transcript_id = conn.execute(
+                    "INSERT INTO transcripts (results_file, video, signature, num_words, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                    (results_file, video, signature, len(rows), datetime.now().isoformat())).lastrowid
+            conn.executemany(
+                "INSERT INTO words (word, transcript_id, segment_id, start_ms, end_ms) VALUES (?, ?, ?, ?, ?)",
+                [(word, transcript_id, segment_id, start_ms, end_ms) for word, segment_id, start_ms, end_ms in rows])
+        logger.info(f"Indexed {len(rows)} words from {results_file}")
+        return True
+
+    def index_all(self, data_dir: str = "data") -> int:
+        """Pick up any new or changed transcripts under the data directory"""
+        updated = 0
+        for results_file in sorted(glob.glob(os.path.join(data_dir, "segments-*", "whisper_results.json"))):
+            try:
+                updated += self.index_transcript(results_file)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Failed to index {results_file}: {e}")
+        return updated
+
+    def refresh(self, data_dir: str = "data", max_age: float = 60.0) -> bool:
+        """Rescan the data directory on a background thread unless that was done within the last ``max_age`` seconds.
+
+        Searches never wait for the scan; they see new transcripts once it has indexed them.
+        Returns whether a scan was started.
+        """
+        with self._scan_lock:
+            if time.time() - self._last_scan < max_age or (self._scanner is not None and self._scanner.is_alive()):
+                return False
+            self._last_scan = time.time()
+            self._scanner = threading.Thread(target=self.index_all, args=(data_dir,), name="word-index", daemon=True)
+            self._scanner.start()
+        return True
+
+    def search(self, query: str, limit: int = 100, video: str = None):
+        """Find a word or phrase across all transcripts.
+
+        Every query term is matched as a prefix of the indexed word, so "resp" finds
+        "respiration"; the last word of a phrase hit gives its end time. Hits come back
+        ordered by video and time. SQLite returns single-word hits in that order a page at
+        a time, and keeps only the top rows while sorting. Phrase hits are read in index
+        order, in pages, until ``limit`` of them continue with the rest of the phrase.
+        """
+        terms = _tokens(query)
+        if not terms:
+            return []
+        first_term = '"' + terms[0] + '"*'
+        sql = """
+            SELECT w.rowid, t.video, t.results_file, w.segment_id, w.start_ms, w.end_ms, w.word, w.transcript_id
+            FROM words w JOIN transcripts t ON t.id = w.transcript_id
+            WHERE words MATCH ?
+        """
+        params = [f"word : {first_term}"]
+        if video:
+            sql += " AND t.video = ?"
+            params.append(video)
+
+        def candidates(conn):
+            if len(terms) == 1:
+                offset = 0
+                while True:
+                    page = conn.execute(sql + " ORDER BY t.video, w.start_ms LIMIT ? OFFSET ?",
+                                        params + [limit, offset]).fetchall()
+                    yield from page
+                    if len(page) < limit:
+                        return
+                    offset += limit
+            else:
+                last_rowid = 0
+                while True:
+                    page = conn.execute(sql + " AND w.rowid > ? ORDER BY w.rowid LIMIT ?",
+                                        params + [last_rowid, SEARCH_PAGE_ROWS]).fetchall()
+                    yield from page
+                    if len(page) < SEARCH_PAGE_ROWS:
+                        return
+                    last_rowid = page[-1][0]
+
+        matches = []
+        if limit <= 0:
+            return matches
+        with self._connect() as conn:
+            for rowid, video_name, results_file, segment_id, start_ms, end_ms, word, transcript_id in candidates(conn):
+                if len(terms) > 1:
+                    # Rows of one transcript are inserted in order, so the phrase continues at rowid + 1..
+                    following = conn.execute(
+                        "SELECT word, end_ms, transcript_id FROM words WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                        (rowid, rowid + len(terms) * 2)).fetchall()
+                    phrase_words, phrase_end = self._match_phrase(terms, word, end_ms, following, transcript_id)
+                    if phrase_words is None:
+                        continue
+                    word, end_ms = phrase_words, phrase_end
+                elif not any(token.startswith(terms[0]) for token in _tokens(word)):
+                    continue
+                matches.append({
+                    "video": video_name,
+                    "results_file": results_file,
+                    "segment_id": segment_id,
+                    "start_ms": start_ms,
+                    "end_ms": end_ms,
+                    "word": word.strip(),
+                })
+                if len(matches) >= limit:
+                    break
+        if len(terms) > 1:
+            matches.sort(key=lambda match: (match["video"], match["start_ms"]))
+        return matches
+
+    @staticmethod
+    def _match_phrase(terms, first_word, end_ms, following, transcript_id):
+        """Check that the words after a first-term hit spell out the rest of the phrase"""
+        tokens = _tokens(first_word)
+        words = [first_word]
+        for word, word_end_ms, word_transcript_id in following:
+            if len(tokens) >= len(terms) or word_transcript_id != transcript_id:
+                break
+            tokens.extend(_tokens(word))
+            words.append(word)
+            end_ms = word_end_ms
+        if len(tokens) < len(terms) or tokens[:len(terms) - 1] != terms[:len(terms) - 1]:
+            return None, None
+        if not tokens[len(terms) - 1].startswith(terms[-1]):
+            return None, None
+        return "".join(words), end_ms